@@ -0,0 +1,43 @@
+# coding:utf-8
+u"""
+pymet.stats.eof の計算方法ごとの実行時間のベンチマーク。
+
+(nt, ny, nx) のfloat32の偏差場から上位nmodes個のモードを求める時間と、全モードを特異値分解で
+求めた場合の寄与率との差を表示する。
+
+ $ python benchmarks/bench_eof.py [nt ny nx]
+
+デフォルトは (365, 91, 180)。
+"""
+import sys
+import time
+import numpy as np
+import pymet.stats as stats
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def main(nt, ny, nx, nmodes=10):
+    rs = np.random.RandomState(0)
+    lat = np.linspace(-90, 90, ny)
+    var = rs.randn(nt, 20).dot(rs.randn(20, ny*nx)*np.linspace(10, 1, 20)[:, np.newaxis])
+    var = (var + rs.randn(nt, ny*nx)).reshape(nt, ny, nx).astype(np.float32)
+    var -= var.mean(axis=0)
+    ref = stats.eof(var, 0, lat, 1, method='svd')[2][:nmodes]
+    print "shape={0}, nmodes={1}".format(var.shape, nmodes)
+    for method in ['svd', 'covariance', 'randomized', 'lanczos']:
+        nm = None if method == 'svd' else nmodes
+        t = measure(lambda: stats.eof(var, 0, lat, 1, nmodes=nm, method=method, random_state=0))
+        err = np.abs(stats.eof(var, 0, lat, 1, nmodes=nm, method=method, random_state=0)[2][:nmodes] - ref).max()
+        print "{0:12s}{1:>8.3f}s{2:>12.2e}%".format(method, t, err)
+
+if __name__ == '__main__':
+    nt, ny, nx = 365, 91, 180
+    if len(sys.argv) == 4:
+        nt, ny, nx = [int(s) for s in sys.argv[1:]]
+    main(nt, ny, nx)
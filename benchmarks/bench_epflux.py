@@ -0,0 +1,52 @@
+# coding:utf-8
+u"""
+pymet.dynamics.epflux のベンチマーク。
+
+2.5度格子、17層の (nt, 17, 73, 144) の u, v, T, omega について、一度に計算する時間と
+時間方向にchunkずつ分けて計算する時間を、偏差の配列を作る単純な実装と比べて表示する。
+
+ $ python benchmarks/bench_epflux.py [nt]
+
+デフォルトは 60 。
+"""
+import sys
+import time
+import numpy as np
+import pymet.dynamics as dynamics
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def naive(u, v, t, omega, xdim):
+    eddy = lambda a: a - a.mean(axis=xdim, keepdims=True)
+    up, vp, tp, wp = eddy(u), eddy(v), eddy(t), eddy(omega)
+    return (up*vp).mean(axis=xdim), (vp*tp).mean(axis=xdim), (up*wp).mean(axis=xdim)
+
+def main(nt):
+    lat = np.linspace(-90, 90, 73)
+    lev = np.array([1000., 925, 850, 700, 600, 500, 400, 300, 250, 200, 150, 100, 70, 50, 30, 20, 10])
+    rs = np.random.RandomState(0)
+    shape = (nt, len(lev), len(lat), 144)
+    u = 10. + 5.*rs.randn(*shape)
+    v = 2.*rs.randn(*shape)
+    t = 250. + 10.*rs.randn(*shape)
+    omega = 0.1*rs.randn(*shape)
+    args = (lat, lev, 3, 2, 1)
+    cases = [('naive covariances', lambda: naive(u, v, t, omega, 3)),
+             ('epflux',            lambda: dynamics.epflux(u, v, t, omega, *args)),
+             ('epflux chunk=10',   lambda: dynamics.epflux(u, v, t, omega, *args, chunk=10)),
+             ('epflux chunk=1',    lambda: dynamics.epflux(u, v, t, omega, *args, chunk=1))]
+    print "shape={0}, {1:.0f} MB per variable".format(shape, u.nbytes/2.**20)
+    for name, func in cases:
+        print "{0:20s}{1:>8.3f}s".format(name, measure(func))
+
+if __name__ == '__main__':
+    nt = 60
+    if len(sys.argv) == 2:
+        nt = int(sys.argv[1])
+    main(nt)
@@ -0,0 +1,43 @@
+# coding:utf-8
+u"""
+pymet.stats.lancoz と butterworth のベンチマーク。
+
+(nt, 73, 144) の日々のデータに、項数を変えたLanczosフィルタを直接の畳み込みとFFTでかけた
+時間と、method='auto'で選ばれた方法の時間、同じカットオフ周期のButterworthフィルタの時間を
+表示する。
+
+ $ python benchmarks/bench_lancoz.py [nt]
+
+デフォルトは 3650 。
+"""
+import sys
+import time
+import numpy as np
+import pymet.stats as stats
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def main(nt):
+    rs = np.random.RandomState(0)
+    var = rs.randn(nt, 73, 144).astype(np.float32)
+    cases = [(10, None, 'lowpass'), (30, None, 'lowpass'), (20, 100, 'bandpass')]
+    print "shape={0}, {1}".format(var.shape, var.dtype)
+    print "{0:24s}{1:>10s}{2:>10s}{3:>10s}{4:>12s}".format('filter', 'direct', 'fft', 'auto', 'butterworth')
+    for cutoff, cutoff2, mode in cases:
+        times = [measure(lambda: stats.lancoz(var, cutoff, cutoff2=cutoff2, mode=mode, method=method))
+                 for method in ['direct', 'fft', 'auto']]
+        times.append(measure(lambda: stats.butterworth(var, cutoff, cutoff2=cutoff2, mode=mode)))
+        name = '{0} {1}'.format(mode, cutoff if cutoff2 is None else '{0}-{1}'.format(cutoff, cutoff2))
+        print "{0:24s}{1:>9.3f}s{2:>9.3f}s{3:>9.3f}s{4:>11.3f}s".format(name, *times)
+
+if __name__ == '__main__':
+    nt = 3650
+    if len(sys.argv) == 2:
+        nt = int(sys.argv[1])
+    main(nt)
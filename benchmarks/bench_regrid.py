@@ -0,0 +1,57 @@
+# coding:utf-8
+u"""
+pymet.regrid の重みの計算、保存した重みの読み込み、変換の実行時間のベンチマーク。
+
+0.25度、1度、2.5度の等間隔格子の間で、各方法について重みを計算する時間(build)、
+cachedirに保存した重みを読み込む時間(load)、(nt, nz)個の2次元場を変換する時間(apply)を表示する。
+
+ $ python benchmarks/bench_regrid.py [nt nz]
+
+デフォルトは (4, 8)。
+"""
+import sys
+import time
+import glob
+import os
+import shutil
+import tempfile
+import numpy as np
+import pymet.regrid as regrid
+
+def latlon(d):
+    return np.arange(0, 360, d), np.linspace(-90, 90, int(round(180/d))+1)
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def main(nt, nz):
+    cases = [(1., 2.5), (0.25, 1.), (2.5, 0.25)]
+    rs = np.random.RandomState(0)
+    print "{0:12s}{1:14s}{2:>10s}{3:>10s}{4:>10s}".format('grid', 'method', 'build', 'load', 'apply')
+    for din, dout in cases:
+        lonin, latin = latlon(din)
+        lonout, latout = latlon(dout)
+        var = rs.randn(nt, nz, len(latin), len(lonin)).astype(np.float32)
+        for method in ['bilinear', 'nearest', 'conservative']:
+            cachedir = tempfile.mkdtemp()
+            try:
+                tb = measure(lambda: regrid.Regridder(lonin, latin, lonout, latout, method=method), 1)
+                rg = regrid.getregridder(lonin, latin, lonout, latout, method=method, cachedir=cachedir)
+                path, = glob.glob(os.path.join(cachedir, '*.npz'))
+                tl = measure(lambda: regrid.loadregridder(path))
+                ta = measure(lambda: rg(var))
+            finally:
+                shutil.rmtree(cachedir)
+            print "{0:12s}{1:14s}{2:>9.3f}s{3:>9.3f}s{4:>9.3f}s".format(
+                '{0}->{1}'.format(din, dout), method, tb, tl, ta)
+
+if __name__ == '__main__':
+    nt, nz = 4, 8
+    if len(sys.argv) == 3:
+        nt, nz = int(sys.argv[1]), int(sys.argv[2])
+    main(nt, nz)
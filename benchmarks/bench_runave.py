@@ -0,0 +1,39 @@
+# coding:utf-8
+u"""
+pymet.stats.runave と runcum のベンチマーク。
+
+(nt, 73, 144) の日々のデータについて、項数を変えたときの実行時間を表示する。累積和で計算する
+ので、実行時間は項数によらない。
+
+ $ python benchmarks/bench_runave.py [nt]
+
+デフォルトは 3650 。
+"""
+import sys
+import time
+import numpy as np
+import pymet.stats as stats
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def main(nt):
+    rs = np.random.RandomState(0)
+    for dtype in [np.float64, np.float32]:
+        var = rs.randn(nt, 73, 144).astype(dtype)
+        print "shape={0}, {1}".format(var.shape, np.dtype(dtype).name)
+        for length in [5, 30, 31, 90]:
+            ta = measure(lambda: stats.runave(var, length))
+            tc = measure(lambda: stats.runcum(var, length))
+            print "length={0:<4d} runave{1:>8.3f}s  runcum{2:>8.3f}s".format(length, ta, tc)
+
+if __name__ == '__main__':
+    nt = 3650
+    if len(sys.argv) == 2:
+        nt = int(sys.argv[1])
+    main(nt)
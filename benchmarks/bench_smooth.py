@@ -0,0 +1,48 @@
+# coding:utf-8
+u"""
+pymet.smooth の水平フィルタのベンチマーク。
+
+1度格子の (nt, nz, 181, 360) の配列に各フィルタをかけた時間と、入力と出力の大きさから求めた
+実効的な転送速度を、配列のコピーと比べて表示する。
+
+ $ python benchmarks/bench_smooth.py [nt nz]
+
+デフォルトは (8, 17)。
+"""
+import sys
+import time
+import numpy as np
+import pymet.smooth as smooth
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def main(nt, nz):
+    lon = np.arange(0, 360, 1.)
+    lat = np.linspace(-90, 90, 181)
+    rs = np.random.RandomState(0)
+    for dtype in [np.float64, np.float32]:
+        var = rs.randn(nt, nz, len(lat), len(lon)).astype(dtype)
+        masked = np.ma.array(var, mask=rs.rand(*var.shape) < 0.01)
+        cases = [('copy',         lambda: var.copy()),
+                 ('smooth 9pt',   lambda: smooth.smooth(var, 3, 2)),
+                 ('smooth 5pt',   lambda: smooth.smooth(var, 3, 2, npoint=5)),
+                 ('smooth masked', lambda: smooth.smooth(masked, 3, 2)),
+                 ('gaussfilter',  lambda: smooth.gaussfilter(var, lon, lat, 3, 2, 300.e3)),
+                 ('zonaltrunc',   lambda: smooth.zonaltrunc(var, 3, 20)),
+                 ('lanczos2d',    lambda: smooth.lanczos2d(var, 3, 2, 10))]
+        print "shape={0}, {1}, {2:.0f} MB".format(var.shape, np.dtype(dtype).name, var.nbytes/2.**20)
+        for name, func in cases:
+            t = measure(func)
+            print "{0:16s}{1:>8.3f}s{2:>8.2f} GB/s".format(name, t, 2*var.nbytes/t/2.**30)
+
+if __name__ == '__main__':
+    nt, nz = 8, 17
+    if len(sys.argv) == 3:
+        nt, nz = int(sys.argv[1]), int(sys.argv[2])
+    main(nt, nz)
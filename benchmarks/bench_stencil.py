@@ -0,0 +1,140 @@
+# coding:utf-8
+u"""
+pymet.grid の差分計算のベンチマーク。
+
+従来の rollaxis + concatenate による実装と、出力配列に直接書き込む現在の実装について、
+実行時間と計算中に増加したメモリのピーク(ru_maxrss)を比較する。また、欠損値を考慮する
+mask= を与えた場合の実行時間を、与えない場合と比較する。
+
+ $ python benchmarks/bench_stencil.py [nt nz ny nx]
+
+デフォルトは 0.5度格子の多層データ (4, 17, 361, 720) を想定。
+"""
+import sys
+import time
+import resource
+import multiprocessing
+import numpy as np
+import pymet.grid as grid
+import pymet.tools as tools
+
+NA = np.newaxis
+a0 = grid.a0
+PI = grid.PI
+d2r = grid.d2r
+
+#--- 従来の実装 --------------------------------------------------------------------------------
+def legacy_dvardx(var, lon, lat, xdim, ydim):
+    var = np.array(var)
+    ndim = var.ndim
+    var = np.rollaxis(var,xdim,ndim)
+    dvar = np.concatenate(((var[...,1]-var[...,-1])[...,NA],
+                           (var[...,2:]-var[...,:-2]),
+                           (var[...,0]-var[...,-2])[...,NA]), axis=-1)
+    dx   = np.r_[(lon[1]+360-lon[-1]), (lon[2:]-lon[:-2]), (lon[0]+360-lon[-2])]
+    dvar = np.rollaxis(dvar,ndim-1,xdim)
+    dx = a0*PI/180.*tools.expand(dx,ndim,xdim) * tools.expand(np.cos(lat*d2r),ndim,ydim)
+    return dvar/dx
+
+def legacy_dvardy(var, lat, ydim):
+    var = np.array(var)
+    ndim = var.ndim
+    var = np.rollaxis(var,ydim,ndim)
+    dvar = np.concatenate([(var[...,1] -var[...,0])[...,NA],
+                           (var[...,2:]-var[...,:-2]),
+                           (var[...,-1]-var[...,-2])[...,NA]], axis=-1)
+    dy   = np.r_[(lat[1]-lat[0]), (lat[2:]-lat[:-2]), (lat[-1]-lat[-2])]
+    out = dvar/(a0*PI/180.*dy)
+    return np.rollaxis(out,ndim-1,ydim)
+
+def legacy_dvardp(var, lev, zdim, punit=100.):
+    var = np.array(var)
+    ndim = var.ndim
+    lev = lev * punit
+    var = np.rollaxis(var,zdim,ndim)
+    dvar = np.concatenate([(var[...,1] -var[...,0])[...,NA],
+                           (var[...,2:]-var[...,:-2]),
+                           (var[...,-1]-var[...,-2])[...,NA]], axis=-1)
+    dp   = np.r_[np.log(lev[1]/lev[0])*lev[0], np.log(lev[2:]/lev[:-2])*lev[1:-1],
+                 np.log(lev[-1]/lev[-2])*lev[-1]]
+    return np.rollaxis(dvar/dp,ndim-1,zdim)
+
+def legacy_d2vardx2(var, lon, lat, xdim, ydim):
+    var = np.array(var)
+    ndim = var.ndim
+    var = np.rollaxis(var,xdim,ndim)
+    dvar = np.concatenate(((var[...,1]-2*var[...,0]+var[...,-1])[...,NA],
+                           (var[...,2:]-2*var[...,1:-1]+var[...,:-2]),
+                           (var[...,0]-2*var[...,-1]+var[...,-2])[...,NA]), axis=-1)
+    dx   = np.r_[(lon[1]+360-lon[-1]), (lon[2:]-lon[:-2]), (lon[0]+360-lon[-2])]
+    dvar = np.rollaxis(dvar,ndim-1,xdim)
+    dx2  = a0**2 * (PI/180.)**2 * tools.expand(dx**2,ndim,xdim) * tools.expand(np.cos(lat*d2r)**2,ndim,ydim)
+    return 4.*dvar/dx2
+
+#--- 計測 ---------------------------------------------------------------------------------------
+def _measure(func, args, kwargs, nrepeat, queue):
+    u"""
+    子プロセスで実行し、最短の実行時間と増加したメモリのピーク[MB]を返す。
+    """
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        result = func(*args, **kwargs)
+        times.append(time.time() - t0)
+        del result
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((min(times), (peak - base)/1024.))
+
+def measure(func, args, kwargs={}, nrepeat=3):
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_measure, args=(func, args, kwargs, nrepeat, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+def main(shape):
+    nt, nz, ny, nx = shape
+    lon = np.linspace(0, 360, nx, endpoint=False)
+    lat = np.linspace(-90, 90, ny)
+    lev = np.linspace(1000, 100, nz)
+    var = np.random.RandomState(0).randn(*shape).astype(np.float32)
+    out = np.empty(shape, dtype=np.float64)
+
+    print "shape={0}, input {1:.0f} MB (float32), output {2:.0f} MB (float64)".format(
+        shape, var.nbytes/2.**20, out.nbytes/2.**20)
+    print "{0:10s} {1:>22s} {2:>22s} {3:>22s}".format('', 'legacy [s / MB]', 'new [s / MB]', 'new, out= [s / MB]')
+    cases = [('dvardx',   legacy_dvardx,   grid.dvardx,   (var, lon, lat, 3, 2), {}),
+             ('dvardy',   legacy_dvardy,   grid.dvardy,   (var, lat, 2), {}),
+             ('dvardp',   legacy_dvardp,   grid.dvardp,   (var, lev, 1), {}),
+             ('d2vardx2', legacy_d2vardx2, grid.d2vardx2, (var, lon, lat, 3, 2), {})]
+    for name, legacy, new, args, kwargs in cases:
+        t1, m1 = measure(legacy, args, kwargs)
+        t2, m2 = measure(new, args, kwargs)
+        kwargs = dict(kwargs, out=out)
+        t3, m3 = measure(new, args, kwargs)
+        print "{0:10s} {1:>11.3f} / {2:>8.1f} {3:>11.3f} / {4:>8.1f} {5:>11.3f} / {6:>8.1f}".format(
+            name, t1, m1, t2, m2, t3, m3)
+
+    # 地形を模した欠損値(下層の一部の領域)がある場合の mask= による計算
+    mask = np.zeros(shape, dtype=bool)
+    mask[:, :nz//4, ny//3:ny//2, nx//4:nx//2] = True
+    print
+    print "{0:10s} {1:>22s} {2:>22s} {3:>22s}".format('', 'no mask [s / MB]', 'mask= [s / MB]', 'mask=, out= [s / MB]')
+    cases = [('dvardx',   grid.dvardx,   (var, lon, lat, 3, 2)),
+             ('dvardy',   grid.dvardy,   (var, lat, 2)),
+             ('dvardp',   grid.dvardp,   (var, lev, 1))]
+    for name, new, args in cases:
+        t1, m1 = measure(new, args, {})
+        t2, m2 = measure(new, args, {'mask':mask})
+        t3, m3 = measure(new, args, {'mask':mask, 'out':out})
+        print "{0:10s} {1:>11.3f} / {2:>8.1f} {3:>11.3f} / {4:>8.1f} {5:>11.3f} / {6:>8.1f}".format(
+            name, t1, m1, t2, m2, t3, m3)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5:
+        shape = tuple(int(n) for n in sys.argv[1:])
+    else:
+        shape = (4, 17, 361, 720)
+    main(shape)
@@ -0,0 +1,51 @@
+# coding:utf-8
+u"""
+pymet.thermo の相当温位、気塊の持ち上げ、CAPE/CINのベンチマーク。
+
+1度格子、17層の (nt, 17, 181, 360) の気温と比湿について、各関数の実行時間と1秒あたりに
+処理した鉛直柱の数を、chunkを変えて表示する。
+
+ $ python benchmarks/bench_thermo.py [nt]
+
+デフォルトは 1 。
+"""
+import sys
+import time
+import numpy as np
+import pymet.thermo as thermo
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def main(nt):
+    lev = np.array([1000., 925, 850, 700, 600, 500, 400, 300, 250, 200, 150, 100, 70, 50, 30, 20, 10])
+    nlat, nlon = 181, 360
+    rs = np.random.RandomState(0)
+    shape = (nt, len(lev), nlat, nlon)
+    p = lev[:, None, None]
+    temp = (290. + 10.*rs.rand(nt, 1, nlat, nlon))*(p/1000.)**0.19
+    temp = np.maximum(temp, 200.) + 0.5*rs.randn(*shape)
+    rh = np.clip(0.9 - 0.7*(1. - p/1000.) + 0.1*rs.randn(*shape), 0.05, 1.)
+    e = rh*thermo.satvap(temp)
+    q = 0.622*e/(p*100. - 0.378*e)
+    ncol = nt*nlat*nlon
+    cases = [('eptemp',           lambda: thermo.eptemp(temp, q, lev, 1)),
+             ('parcel',           lambda: thermo.parcel(temp, q, lev, 1)),
+             ('cape',             lambda: thermo.cape(temp, q, lev, 1)),
+             ('cape chunk=4096',  lambda: thermo.cape(temp, q, lev, 1, chunk=4096)),
+             ('cape mostunstable', lambda: thermo.cape(temp, q, lev, 1, start='mostunstable'))]
+    print "shape={0}".format(shape)
+    for name, func in cases:
+        t = measure(func)
+        print "{0:20s}{1:>8.3f}s{2:>12.0f} columns/s".format(name, t, ncol/t)
+
+if __name__ == '__main__':
+    nt = 1
+    if len(sys.argv) == 2:
+        nt = int(sys.argv[1])
+    main(nt)
@@ -0,0 +1,81 @@
+# coding:utf-8
+u"""
+pymet のスレッド並列(workers=)のスケーリングのベンチマーク。
+
+core.testgrid と同じ形式の格子を実際の解析データ程度の大きさに広げ、workers を
+1 から CPU のコア数まで変えたときの実行時間と、1スレッドに対する速度向上率を表示する。
+
+ $ python benchmarks/bench_threads.py [nt nz ny nx [maxworkers]]
+
+デフォルトは 1度格子の (8, 8, 181, 360)、最大スレッド数はCPUのコア数。
+"""
+import sys
+import time
+import multiprocessing
+from datetime import datetime, timedelta
+import numpy as np
+import pymet.grid as grid
+import pymet.dynamics as dynamics
+from pymet.field import McGrid, McField
+import pymet.field as field
+
+def testgrid(shape):
+    nt, nz, ny, nx = shape
+    lon = np.linspace(0, 360, nx, endpoint=False)
+    lat = np.linspace(-90, 90, ny)
+    lev = np.linspace(1000, 100, nz)
+    time = [datetime(2009,10,1) + timedelta(hours=6*i) for i in range(nt)]
+    return McGrid(name='bench_grid', lon=lon, lat=lat, lev=lev, time=time)
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def main(shape, maxworkers=None):
+    g = testgrid(shape)
+    rs = np.random.RandomState(0)
+    u = rs.randn(*shape)*10 + 10
+    v = rs.randn(*shape)*10
+    t = rs.randn(*shape) + 280
+    lon, lat, lev = g.lon, g.lat, g.lev
+    uf, vf, tf = McField(u, grid=g.copy()), McField(v, grid=g.copy()), McField(t, grid=g.copy())
+
+    cases = [('dvardx',     lambda w: grid.dvardx(u, lon, lat, 3, 2, workers=w)),
+             ('dvardp',     lambda w: grid.dvardp(u, lev, 1, workers=w)),
+             ('laplacian',  lambda w: grid.laplacian(u, lon, lat, 3, 2, workers=w)),
+             ('kinematics', lambda w: grid.kinematics(u, v, lon, lat, 3, 2, workers=w)),
+             ('ertelpv',    lambda w: dynamics.ertelpv(u, v, t, lon, lat, lev, 3, 2, 1, workers=w)),
+             ('field.div',  lambda w: field.div(uf, vf, workers=w)),
+             ('field.ertelpv', lambda w: field.ertelpv(uf, vf, tf, workers=w))]
+
+    ncpu = multiprocessing.cpu_count()
+    maxworkers = maxworkers or ncpu
+    workers = [1]
+    while workers[-1]*2 <= maxworkers:
+        workers.append(workers[-1]*2)
+    if workers[-1] != maxworkers:
+        workers.append(maxworkers)
+
+    print "shape={0}, {1:.0f} MB per float64 field, {2} CPUs".format(shape, u.nbytes/2.**20, ncpu)
+    print "{0:14s}".format('') + "".join("{0:>16s}".format('workers={0}'.format(w)) for w in workers)
+    for name, func in cases:
+        line = "{0:14s}".format(name)
+        t1 = None
+        for w in workers:
+            tw = measure(lambda: func(w))
+            t1 = t1 or tw
+            line += "{0:>8.3f}s ({1:>4.1f}x)".format(tw, t1/tw)
+        print line
+
+if __name__ == '__main__':
+    shape = (8, 8, 181, 360)
+    maxworkers = None
+    if len(sys.argv) >= 5:
+        shape = tuple(int(n) for n in sys.argv[1:5])
+    if len(sys.argv) == 6:
+        maxworkers = int(sys.argv[5])
+    main(shape, maxworkers)
@@ -0,0 +1,48 @@
+# coding:utf-8
+u"""
+pymet.dynamics.tnflux3d と TNFlux3D のベンチマーク。
+
+2.5度格子、17層の気候値の基本場と (nt, 17, 73, 144) の流線関数偏差について、tnflux3d で一度に
+計算する時間と、TNFlux3D.stream で時間方向に1ステップずつ計算する時間を表示する。
+
+ $ python benchmarks/bench_tnflux.py [nt]
+
+デフォルトは 8 。
+"""
+import sys
+import time
+import numpy as np
+import pymet.dynamics as dynamics
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def main(nt):
+    lon = np.arange(0, 360, 2.5)
+    lat = np.linspace(-90, 90, 73)
+    lev = np.array([1000., 925, 850, 700, 600, 500, 400, 300, 250, 200, 150, 100, 70, 50, 30, 20, 10])
+    rs = np.random.RandomState(0)
+    shape = (1, len(lev), len(lat), len(lon))
+    U = 10. + 5.*rs.randn(*shape)
+    V = 2.*rs.randn(*shape)
+    T = 300.*(lev[:, None, None]/1000.)**0.2 + rs.randn(*shape)
+    strm = 1.e6*rs.randn(nt, len(lev), len(lat), len(lon))
+    args = (lon, lat, lev, 3, 2, 1)
+    tn = dynamics.TNFlux3D(U, V, T, *args)
+    cases = [('tnflux3d',        lambda: dynamics.tnflux3d(U, V, T, strm, *args)),
+             ('TNFlux3D',        lambda: dynamics.TNFlux3D(U, V, T, *args)(strm)),
+             ('stream chunk=1',  lambda: tn.stream(strm, chunk=1))]
+    print "shape={0}".format(strm.shape)
+    for name, func in cases:
+        print "{0:16s}{1:>8.3f}s".format(name, measure(func))
+
+if __name__ == '__main__':
+    nt = 8
+    if len(sys.argv) == 2:
+        nt = int(sys.argv[1])
+    main(nt)
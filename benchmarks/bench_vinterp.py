@@ -0,0 +1,95 @@
+# coding:utf-8
+u"""
+格子点ごとに鉛直座標が異なる場合の pymet.grid.vinterp のベンチマーク。
+
+モデル面(既定は137層)の気圧を座標として等圧面に内挿する場合について、従来の
+_internal.linear_interp (単精度、線形探索)による実装と、現在の二分探索による実装の
+実行時間を比較する。現在の実装は倍精度、単精度、およびスレッド数を変えて計測する。
+
+ $ python benchmarks/bench_vinterp.py [nt nz ny nx [maxworkers]]
+
+デフォルトは (4, 137, 181, 360) から37の等圧面への内挿。従来の実装の計測には
+f2pyでコンパイルした pymet/_internal が必要で、なければ省略する。
+"""
+import sys
+import time
+import multiprocessing
+import numpy as np
+import pymet.grid as grid
+
+try:
+    import pymet._internal as _internal
+except ImportError:
+    _internal = None
+
+PLEVS = np.array([1000, 975, 950, 925, 900, 875, 850, 825, 800, 775, 750, 700, 650, 600, 550,
+                  500, 450, 400, 350, 300, 250, 225, 200, 175, 150, 125, 100, 70, 50, 30,
+                  20, 10, 7, 5, 3, 2, 1], dtype=np.float64)
+
+#--- 従来の実装 --------------------------------------------------------------------------------
+def legacy_vinterp(var, oldz, newz, zdim):
+    ndim = var.ndim
+    old_zn = var.shape[zdim]
+    old_z = np.log(oldz)
+    new_z = np.log(newz)
+    var = np.rollaxis(var,zdim,ndim)
+    new_shape = list(var.shape)
+    new_shape[-1] = len(new_z)
+    var = var.reshape(-1,old_zn)
+    old_z = np.rollaxis(old_z,zdim,ndim).reshape(-1,old_zn)
+    out = _internal.linear_interp(var, old_z, new_z)
+    out = out.reshape(new_shape)
+    return np.rollaxis(out,ndim-1,zdim)
+
+#--- 計測 ---------------------------------------------------------------------------------------
+def modellevels(shape, rs):
+    u"""
+    地表気圧が場所ごとに異なるハイブリッド面の気圧 [hPa] を作る。
+    """
+    nt, nz, ny, nx = shape
+    eta = np.linspace(0., 1., nz)**1.5
+    ps = 1013. - 80.*rs.rand(nt, 1, ny, nx)
+    return 0.01 + eta[np.newaxis, :, np.newaxis, np.newaxis]*ps
+
+def measure(func, nrepeat=3):
+    times = []
+    for i in range(nrepeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def main(shape, maxworkers=None):
+    rs = np.random.RandomState(0)
+    p = modellevels(shape, rs)
+    var = rs.randn(*shape)
+    var32, p32 = var.astype(np.float32), p.astype(np.float32)
+
+    ncpu = multiprocessing.cpu_count()
+    maxworkers = maxworkers or ncpu
+    workers = [1]
+    while workers[-1]*2 <= maxworkers:
+        workers.append(workers[-1]*2)
+    if workers[-1] != maxworkers:
+        workers.append(maxworkers)
+
+    print "shape={0} -> {1} levels, {2:.0f} MB per float64 field, {3} CPUs".format(
+        shape, len(PLEVS), var.nbytes/2.**20, ncpu)
+    if _internal is not None:
+        t = measure(lambda: legacy_vinterp(var32, p32, PLEVS, 1))
+        print "{0:28s}{1:>8.3f}s".format('legacy (float32)', t)
+    else:
+        print "legacy: pymet._internal is not available"
+    for name, v, z in [('float64', var, p), ('float32', var32, p32)]:
+        for w in workers:
+            t = measure(lambda: grid.vinterp(v, z, PLEVS, 1, workers=w))
+            print "{0:28s}{1:>8.3f}s".format('new ({0}, workers={1})'.format(name, w), t)
+
+if __name__ == '__main__':
+    shape = (4, 137, 181, 360)
+    maxworkers = None
+    if len(sys.argv) >= 5:
+        shape = tuple(int(n) for n in sys.argv[1:5])
+    if len(sys.argv) == 6:
+        maxworkers = int(sys.argv[5])
+    main(shape, maxworkers)
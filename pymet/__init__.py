@@ -1 +1,2 @@
 # coding: utf-8
+from tools import set_num_threads, get_num_threads
@@ -7,18 +7,25 @@ u"""
 .. autosummary::
 
    pottemp
+   isentropic
    ertelpv
    stability
    tnflux2d
    tnflux3d
+   TNFlux3D
+   epflux
+   DiagnosticsSession
 
 -------------------   
 """
 import numpy as np
+import collections
 import constants, tools
 from grid import *
+from grid import _threadapply, _useworkers
 
-__all__ = ['pottemp', 'ertelpv', 'tnflux2d', 'tnflux3d', 'stability', 'absvrt', 'rhmd']
+__all__ = ['pottemp', 'isentropic', 'ertelpv', 'tnflux2d', 'tnflux3d', 'stability', 'absvrt', 'rhmd',
+           'TNFlux3D', 'epflux', 'DiagnosticsSession']
 
 NA=np.newaxis
 kappa = constants.air_kappa
@@ -64,7 +71,74 @@ def pottemp(temp, lev, zdim, punit=100., p0=100000.):
 
     return out
     
-def ertelpv(uwnd, vwnd, temp, lon, lat, lev, xdim, ydim, zdim, cyclic=True, punit=100., sphere=True):
+def isentropic(temp, lev, zdim, thlev, variables=None, punit=100., p0=100000., extrapolate='nan', workers=None):
+    ur"""
+    等圧面(もしくはモデル面)のデータを等温位面に内挿する。
+
+    温位を一度だけ計算し、各鉛直柱で指定した温位を挟むレベルと重みを求めて、気圧と
+    すべての変数を同じ重みで内挿する。
+
+    :Arguments:
+     **temp**  : array_like
+      気温 [K]
+     **lev**   : array_like
+      気圧 [punit*Pa]。1次元の配列か、モデル面の場合はtempと同じ形状の配列。
+     **zdim**  : int
+      鉛直次元の軸
+     **thlev** : array_like
+      内挿する温位 [K]
+     **variables** : dict, optional
+      内挿する変数の名前をキー、tempと同じ形状の配列を値とする辞書。
+     **punit** : float, optional
+      levをPaに換算するための定数。デフォルトは100.。
+     **p0**    : float, optional
+      基準気圧 [Pa]。デフォルトは1000hPa。
+     **extrapolate** : {'error', 'nan', 'constant', 'linear'}, optional
+      温位の範囲外(地面の下など)の扱い。:py:class:`pymet.grid.VerticalInterpolator` を参照。
+      デフォルトは'nan'。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **result** : dict
+      'pres' (気圧 [punit*Pa])、'temp' (気温 [K])と、variablesのキーをキーとする辞書。
+      各値の形状は、tempのzdimの長さをlen(thlev)にしたもの。
+
+    .. note::
+       各変数は温位について線形に、気圧はlog(p)を温位について線形に内挿する。
+       気温は内挿した気圧から :math:`T = \theta (p/p_{0})^{R_d/C_p}` で求める。
+       温位が鉛直方向に単調でない柱(超断熱層)では、二分探索で見つかった一つの層を用いる。
+
+    **Examples**
+     >>> pv = ertelpv(u, v, t, lon, lat, lev, 3, 2, 1)
+     >>> isen = isentropic(t, lev, 1, [300., 315., 330.], variables={'u':u, 'v':v, 'pv':pv})
+     >>> isen['pres'], isen['pv']
+    """
+    variables = variables or {}
+    for name in variables:
+        if name in ('pres', 'temp'):
+            raise ValueError, "variable name '{0}' is reserved".format(name)
+    if not isinstance(temp, np.ma.MaskedArray):
+        temp = np.asarray(temp)
+    ndim = temp.ndim
+    thlev = np.atleast_1d(np.asarray(thlev, dtype=np.float64))
+    p = np.asarray(lev) if np.ndim(lev) == ndim else tools.expand(lev, ndim, axis=zdim)
+    theta = temp * ((p0/p/punit)**kappa)
+    if not _useworkers(workers):
+        workers = 1
+    interp = ColumnInterpolator(theta, thlev, zdim, logintrp=False, extrapolate=extrapolate, workers=workers)
+    del theta
+
+    result = {}
+    result['pres'] = np.exp(interp(np.broadcast_to(np.log(p), temp.shape)))
+    result['temp'] = tools.expand(thlev, ndim, axis=zdim) * ((result['pres']*punit/p0)**kappa)
+    for name, var in variables.items():
+        result[name] = interp(var)
+
+    return result
+    
+def ertelpv(uwnd, vwnd, temp, lon, lat, lev, xdim, ydim, zdim, cyclic=True, punit=100., sphere=True,
+            metrics=None, workers=None):
     ur"""
     エルテルのポテンシャル渦度を計算する。
 
@@ -83,6 +157,10 @@ def ertelpv(uwnd, vwnd, temp, lon, lat, lev, xdim, ydim, zdim, cyclic=True, puni
       東西境界を周期境界で扱うか。デフォルトはTrue。
      **punit**  : float, optional
       Paに換算するための定数。デフォルトは100、すなわちlevはhPaで与えられると解釈する。
+     **metrics** : GridMetrics, optional
+      格子の計量因子。:py:func:`pymet.grid.getmetrics` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
       
     :Returns:
       **out** : ndarray
@@ -102,36 +180,20 @@ def ertelpv(uwnd, vwnd, temp, lon, lat, lev, xdim, ydim, zdim, cyclic=True, puni
     **Examples**   
      >>>
     """
-    u, v, t = np.ma.getdata(uwnd), np.ma.getdata(vwnd), np.ma.getdata(temp)
-    mask    = np.ma.getmask(uwnd) | np.ma.getmask(vwnd) | np.ma.getmask(temp)
-    ndim    = u.ndim
+    ndim    = np.ndim(uwnd)
+    if metrics is None:
+        metrics = getmetrics(ndim, lon=lon, lat=lat, lev=lev, xdim=xdim, ydim=ydim, zdim=zdim,
+                             sphere=sphere, punit=punit)
+    if _useworkers(workers):
+        func = lambda uwnd, vwnd, temp: ertelpv(uwnd, vwnd, temp, lon, lat, lev, xdim, ydim, zdim, cyclic=cyclic,
+                                                punit=punit, metrics=metrics, workers=1)
+        return _threadapply(func, (uwnd, vwnd, temp), (xdim, ydim, zdim), workers=workers, masked=True)
 
-    # potential temperature
-    theta = pottemp(t, lev, zdim, punit=punit)
-    #
-    dthdp = dvardp(theta, lev, zdim, punit=punit)
-    dudp  = dvardp(u, lev, zdim, punit=punit)
-    dvdp  = dvardp(v, lev, zdim, punit=punit)
+    session = DiagnosticsSession(uwnd, vwnd, temp, lon, lat, lev, xdim, ydim, zdim, cyclic=cyclic, punit=punit,
+                                 metrics=metrics, workers=1)
+    return session.get('pv')
 
-    dthdx = dvardx(theta, lon, lat, xdim, ydim, cyclic=cyclic, sphere=sphere)
-    dthdy = dvardy(theta, lat, ydim, sphere=sphere)
-
-    # absolute vorticity
-    vor  = rot(u, v, lon, lat, xdim, ydim, cyclic=cyclic, sphere=sphere)
-    f    = tools.expand(constants.earth_f(lat), ndim, axis=ydim)
-    avor = f + vor
-
-    out = -g * (avor*dthdp - (dthdx*dvdp-dthdy*dudp))
-
-    out = np.ma.array(out, mask=mask)
-    out = tools.mrollaxis(out, ydim, 0)
-    out[0,...]  = np.ma.masked
-    out[-1,...] = np.ma.masked
-    out = tools.mrollaxis(out, 0, ydim+1)
-
-    return out
-
-def stability(temp, lev, zdim, punit=100.):
+def stability(temp, lev, zdim, punit=100., metrics=None, workers=None):
     ur"""
     p座標系での静的安定度(Brunt-Vaisala振動数)を計算する。
 
@@ -144,6 +206,10 @@ def stability(temp, lev, zdim, punit=100.):
        鉛直次元の位置
      **punit** : float, optional
        Paに変換するためのファクター。デフォルトは100.。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。:py:func:`pymet.grid.getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
     :Returns:
      **N** : ndarray
       静的安定度
@@ -160,15 +226,14 @@ def stability(temp, lev, zdim, punit=100.):
     
     """
     temp = np.asarray(temp)
-    ndim = temp.ndim
-    p = tools.expand(lev, ndim, axis=zdim)*punit
-    theta = pottemp(temp, lev, zdim, punit=punit)
-    alpha = rd*temp/p
-    N = -alpha * dvardp(np.log(theta), lev, zdim, punit=punit)
+    if _useworkers(workers):
+        func = lambda temp: stability(temp, lev, zdim, punit=punit, metrics=metrics, workers=1)
+        return _threadapply(func, (temp,), (zdim,), workers=workers)
 
-    return N
+    session = DiagnosticsSession(t=temp, lev=lev, zdim=zdim, punit=punit, metrics=metrics, workers=1)
+    return session.get('stability')
 
-def tnflux2d(U, V, strm, lon, lat, xdim, ydim, cyclic=True, limit=100):
+def tnflux2d(U, V, strm, lon, lat, xdim, ydim, cyclic=True, limit=100, metrics=None, workers=None):
     ur"""
     Takaya & Nakamura (2001) の波活動度フラックスの水平成分をp面上で計算する。
 
@@ -185,6 +250,10 @@ def tnflux2d(U, V, strm, lon, lat, xdim, ydim, cyclic=True, limit=100):
       東西境界を周期境界で扱うか。デフォルトはTrue。
      **limit** : float, optional
       デフォルトは100.
+     **metrics** : GridMetrics, optional
+      格子の計量因子。:py:func:`pymet.grid.getmetrics` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
      
     :Returns:
      **tnx, tny** : MaskedArray
@@ -210,31 +279,20 @@ def tnflux2d(U, V, strm, lon, lat, xdim, ydim, cyclic=True, limit=100):
     """
     U, V = np.asarray(U), np.asarray(V)
     ndim=U.ndim
+    if metrics is None:
+        metrics = getmetrics(ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim)
+    if _useworkers(workers):
+        func = lambda U, V, strm: tnflux2d(U, V, strm, lon, lat, xdim, ydim, cyclic=cyclic, limit=limit,
+                                           metrics=metrics, workers=1)
+        return _threadapply(func, (U, V, np.asarray(strm)), (xdim, ydim), workers=workers, masked=True, nout=2)
 
-    dstrmdx    = dvardx(strm, lon, lat, xdim, ydim, cyclic=cyclic)
-    dstrmdy    = dvardy(strm, lat, ydim)
-    d2strmdx2  = d2vardx2(strm, lon, lat, xdim, ydim, cyclic=cyclic)
-    d2strmdy2  = d2vardy2(strm, lat, ydim)
-    d2strmdxdy = dvardy(dvardx(strm,lon,lat,xdim,ydim,cyclic=cyclic),lat,ydim)
-
-    tnx = U * (dstrmdx**2 - strm*d2strmdx2) + V*(dstrmdx*dstrmdy - strm*d2strmdxdy)
-    tny = U * (dstrmdx*dstrmdy - strm*d2strmdxdy) + V * (dstrmdy**2 - strm*d2strmdy2)
-
-    tnx = 0.5*tnx/np.abs(U + 1j*V)
-    tny = 0.5*tny/np.abs(U + 1j*V)
-
-    # 大きさがlimit以上のグリッドと東風領域をマスクする。
-    tnxy = np.sqrt(tnx**2 + tny**2)
-    tnx = np.ma.asarray(tnx)
-    tny = np.ma.asarray(tny)
-    tnx[tnxy>limit] = np.ma.masked
-    tny[tnxy>limit] = np.ma.masked
-    tnx[U<0] = np.ma.masked
-    tny[U<0] = np.ma.masked
-    
-    return tnx, tny
+    session = DiagnosticsSession(U, V, strm=strm, lon=lon, lat=lat, xdim=xdim, ydim=ydim, cyclic=cyclic,
+                                 limit=limit, metrics=metrics, workers=1)
+    result = session.compute('tnx', 'tny')
+    return result['tnx'], result['tny']
 
-def tnflux3d(U, V, T, strm, lon, lat, lev, xdim, ydim, zdim, cyclic=True, limit=100, punit=100.):
+def tnflux3d(U, V, T, strm, lon, lat, lev, xdim, ydim, zdim, cyclic=True, limit=100, punit=100.,
+             metrics=None, workers=None):
     ur"""
     Takaya & Nakamura (2001) の波活動度フラックスをp面上で計算する。
 
@@ -257,6 +315,10 @@ def tnflux3d(U, V, T, strm, lon, lat, lev, xdim, ydim, zdim, cyclic=True, limit=
       デフォルトは100.
      **punit** : float, optional
       等圧面の気圧levをPaに変換するファクター。デフォルトは100.、すなわちhPaからPaへ変換。
+     **metrics** : GridMetrics, optional
+      格子の計量因子。:py:func:`pymet.grid.getmetrics` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
      
     :Returns:
      **tnx, tny, tnz** : MaskedArray
@@ -285,55 +347,244 @@ def tnflux3d(U, V, T, strm, lon, lat, lev, xdim, ydim, zdim, cyclic=True, limit=
     """
     U, V, T = np.asarray(U), np.asarray(V), np.asarray(T)
     ndim=U.ndim
-    S = stability(T, lev, zdim, punit=punit)
-    f = tools.expand(constants.const_f(lat), ndim, axis=ydim)
-
-    dstrmdx    = dvardx(strm, lon, lat, xdim, ydim, cyclic=cyclic)
-    dstrmdy    = dvardy(strm, lat, ydim)
-    dstrmdp    = dvardp(strm, lev, zdim, punit=punit)
-    d2strmdx2  = d2vardx2(strm, lon, lat, xdim, ydim, cyclic=cyclic)
-    d2strmdy2  = d2vardy2(strm, lat, ydim)
-    d2strmdxdy = dvardy(dstrmdx, lat, ydim)
-    d2strmdxdp = dvardx(dstrmdp, lon, lat, xdim, ydim, cyclic=True)
-    d2strmdydp = dvardy(dstrmdp, lat, ydim)             
-
-    tnx = U * (dstrmdx**2 - strm*d2strmdx2) + V * (dstrmdx*dstrmdy - strm*d2strmdxdy)
-    tny = U * (dstrmdx*dstrmdy - strm*d2strmdxdy) + V * (dstrmdy**2 - strm*d2strmdy2)
-    tnz = f**2/S**2 * ( U*(dstrmdx*dstrmdp - strm*d2strmdxdp) - V*(dstrmdy*dstrmdp - strm*d2strmdydp) )
-    
-    tnx = 0.5*tnx/np.abs(U + 1j*V)
-    tny = 0.5*tny/np.abs(U + 1j*V)
-
-    # 水平成分の大きさがlimit以上のグリッドと東風領域をマスクする。
-    tnxy = np.sqrt(tnx**2 + tny**2)
-    tnx = np.ma.asarray(tnx)
-    tny = np.ma.asarray(tny)
-    tnz = np.ma.asarray(tnz)
-    tnx[(U<0) | (tnxy>limit)] = np.ma.masked
-    tny[(U<0) | (tnxy>limit)] = np.ma.masked
-    tnz[(U<0) | (tnxy>limit)] = np.ma.masked
-    
-    return tnx, tny, tnz
+    if metrics is None:
+        metrics = getmetrics(ndim, lon=lon, lat=lat, lev=lev, xdim=xdim, ydim=ydim, zdim=zdim, punit=punit)
+    if _useworkers(workers):
+        func = lambda U, V, T, strm: tnflux3d(U, V, T, strm, lon, lat, lev, xdim, ydim, zdim, cyclic=cyclic,
+                                              limit=limit, punit=punit, metrics=metrics, workers=1)
+        return _threadapply(func, (U, V, T, np.asarray(strm)), (xdim, ydim, zdim), workers=workers,
+                            masked=True, nout=3)
 
-def absvrt(uwnd, vwnd, lon, lat, xdim, ydim, cyclic=True, sphere=True):
+    tn = TNFlux3D(U, V, T, lon, lat, lev, xdim, ydim, zdim, cyclic=cyclic, limit=limit, punit=punit,
+                  metrics=metrics, workers=1)
+    return tn(strm)
+
+def _tnhorizontal(U, V, speed, strm, dsdx, dsdy, deriv, work=None):
     u"""
-    
+    TNフラックスの水平成分。deriv(name, out)は流線関数の2階微分 'd2sdx2', 'd2sdy2', 'd2sdxdy' を
+    返す関数で、作業配列outに書き込んでもよい。
+    """
+    if work is None:
+        work = np.empty(strm.shape, dtype=np.result_type(strm, dsdx))
+    np.multiply(strm, deriv('d2sdxdy', work), out=work)
+    cross = dsdx*dsdy
+    cross -= work                                                # dsdx*dsdy - strm*d2strmdxdy
+    np.multiply(strm, deriv('d2sdx2', work), out=work)
+    tnx = dsdx**2
+    tnx -= work
+    tnx *= U
+    tnx += V*cross
+    np.multiply(strm, deriv('d2sdy2', work), out=work)
+    tny = U*cross
+    del cross
+    tmp = dsdy**2
+    tmp -= work
+    tmp *= V
+    tny += tmp
+    tnx *= 0.5
+    tnx /= speed
+    tny *= 0.5
+    tny /= speed
+    return tnx, tny
+
+def _tnvertical(U, V, ftos, strm, dsdx, dsdy, dsdp, deriv, work=None):
+    u"""
+    TNフラックスの鉛直成分。deriv(name, out)は流線関数の2階微分 'd2sdxdp', 'd2sdydp' を返す関数。
     """
-    u, v    = np.ma.getdata(uwnd), np.ma.getdata(vwnd)
-    mask    = np.ma.getmask(uwnd) | np.ma.getmask(vwnd)
-    ndim    = u.ndim
-
-    vor  = rot(u, v, lon, lat, xdim, ydim, cyclic=cyclic, sphere=sphere)
-    f    = tools.expand(constants.earth_f(lat), ndim, axis=ydim)
-    out = f + vor
-
-    out = np.ma.array(out, mask=mask)
-    out = tools.mrollaxis(out, ydim, 0)
-    out[0,...]  = np.ma.masked
-    out[-1,...] = np.ma.masked
-    out = tools.mrollaxis(out, 0, ydim+1)
+    if work is None:
+        work = np.empty(strm.shape, dtype=np.result_type(strm, dsdx))
+    np.multiply(strm, deriv('d2sdxdp', work), out=work)
+    tnz = dsdx*dsdp
+    tnz -= work
+    tnz *= U
+    np.multiply(strm, deriv('d2sdydp', work), out=work)
+    tmp = dsdy*dsdp
+    tmp -= work
+    tmp *= V
+    tnz -= tmp
+    del tmp
+    return np.multiply(ftos, tnz, out=tnz if tnz.shape == np.broadcast(ftos, tnz).shape else None)
+
+def _tnmask(easterly, tnx, tny, limit):
+    u"""
+    水平成分の大きさがlimit以上のグリッドと東風領域のマスク。
+    """
+    return (np.hypot(tnx, tny) > limit) | easterly
+
+class TNFlux3D(object):
+    ur"""
+    基本場を固定して、流線関数偏差のブロックごとに Takaya & Nakamura (2001) の波活動度フラックスを
+    計算する。
+
+    基本場から決まる :math:`|\mathbf{U}|` 、 :math:`f^2/S^2` 、東風域のマスクは最初に一度だけ
+    計算する。 :py:meth:`stream` は流線関数偏差を時間などの先頭の次元に沿ってブロックに分けて
+    計算し、事前に確保した配列(netCDF4の変数などスライスで代入できるもの)に書き込むので、
+    長期間の日々の偏差でも1ブロック分のメモリで計算できる。
+
+    :Arguments:
+     **U, V** : ndarray
+      気候値東西風、南北風 [m/s]
+     **T** : ndarray
+      気候値気温 [K]
+     **lon, lat** : array_like
+      経度、緯度 [degrees]
+     **lev** : array_like
+      等圧面の気圧
+     **xdim, ydim, zdim** : int
+      流線関数偏差の東西、南北、鉛直次元の軸
+     **cyclic** : bool, optional
+      東西境界を周期境界で扱うか。デフォルトはTrue。
+     **limit** : float, optional
+      水平成分の大きさの上限。デフォルトは100.
+     **punit** : float, optional
+      等圧面の気圧levをPaに変換するファクター。デフォルトは100.。
+     **metrics** : GridMetrics, optional
+      格子の計量因子。:py:func:`pymet.grid.getmetrics` を参照。
+     **workers** : int, optional
+      各微分の並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    .. note::
+       U, V, T は流線関数偏差と同じ次元数で、長さ1の次元は流線関数偏差に合わせてブロードキャスト
+       される。次元数が少ない場合は先頭に長さ1の次元を補う。
+
+    **Examples**
+     気候値(12, 73, 144)と日々の流線関数偏差(nt, 12, 73, 144)から、100日ずつ計算してnetCDFに書き込む。
+      >>> tn = TNFlux3D(U, V, T, lon, lat, lev, 3, 2, 1)
+      >>> tn.stream(nc.variables['psi'], axis=0, chunk=100,
+      ...           out=(nc.variables['tnx'], nc.variables['tny'], nc.variables['tnz']))
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        tnflux3d
+    """
+    def __init__(self, U, V, T, lon, lat, lev, xdim, ydim, zdim, cyclic=True, limit=100., punit=100.,
+                 metrics=None, workers=None):
+        U, V, T = np.asarray(U), np.asarray(V), np.asarray(T)
+        ndim = max(U.ndim, V.ndim, T.ndim, max(xdim, ydim, zdim) + 1)
+        U, V, T = [a.reshape((1,)*(ndim - a.ndim) + a.shape) for a in (U, V, T)]
+        if metrics is None:
+            metrics = getmetrics(ndim, lon=lon, lat=lat, lev=lev, xdim=xdim, ydim=ydim, zdim=zdim, punit=punit)
+        self.lon, self.lat, self.lev = lon, lat, lev
+        self.xdim, self.ydim, self.zdim = xdim, ydim, zdim
+        self.cyclic = cyclic
+        self.limit = limit
+        self.metrics = metrics
+        self.workers = workers
+        self.ndim = ndim
+        S = stability(T, lev, zdim, punit=punit, metrics=metrics, workers=workers)
+        self.U, self.V = U, V
+        self.speed = np.hypot(U, V)
+        self.ftos = metrics.f**2/S**2
+        self.easterly = U < 0
+
+    def _basic(self, sl):
+        u"""
+        ブロックslに対応する基本場の項。長さ1の次元はそのまま用いる。
+        """
+        def take(a):
+            return a[tuple(s if n > 1 else slice(None) for s, n in zip(sl, a.shape))]
+        return [take(a) for a in (self.U, self.V, self.speed, self.ftos, self.easterly)]
+
+    def __call__(self, strm, sl=None):
+        u"""
+        流線関数偏差strmに対するフラックスを返す。
+
+        :Arguments:
+         **strm** : ndarray
+          流線関数偏差 [m^2/s]
+         **sl** : tuple of slice, optional
+          strmが全体のどの部分かを表すスライス。基本場が長さ1でない次元で分割する場合に与える。
+
+        :Returns:
+         **tnx, tny, tnz** : MaskedArray
+        """
+        strm = np.asarray(strm)
+        if strm.ndim != self.ndim:
+            raise ValueError, "strm must have {0} dimensions, not {1}".format(self.ndim, strm.ndim)
+        U, V, speed, ftos, easterly = self._basic(sl or (slice(None),)*self.ndim)
+        lon, lat, lev, xdim, ydim, zdim = self.lon, self.lat, self.lev, self.xdim, self.ydim, self.zdim
+        kw = dict(metrics=self.metrics, workers=self.workers)
+        kwx = dict(kw, cyclic=self.cyclic)
+
+        # 2階微分は作業配列に書き込み、同時に確保する配列がブロックの大きさの数個で済むようにする
+        dsdx = dvardx(strm, lon, lat, xdim, ydim, **kwx)
+        dsdy = dvardy(strm, lat, ydim, **kw)
+        dsdp = None
+        def deriv(name, out):
+            if name == 'd2sdxdy':
+                return dvardy(dsdx, lat, ydim, out=out, **kw)
+            elif name == 'd2sdx2':
+                return d2vardx2(strm, lon, lat, xdim, ydim, out=out, **kwx)
+            elif name == 'd2sdy2':
+                return d2vardy2(strm, lat, ydim, out=out, **kw)
+            elif name == 'd2sdxdp':
+                return dvardx(dsdp, lon, lat, xdim, ydim, out=out, **kwx)
+            else:
+                return dvardy(dsdp, lat, ydim, out=out, **kw)
+        work = np.empty(strm.shape, dtype=np.result_type(strm, dsdx))
+        tnx, tny = _tnhorizontal(U, V, speed, strm, dsdx, dsdy, deriv, work=work)
+        dsdp = dvardp(strm, lev, zdim, **kw)
+        tnz = _tnvertical(U, V, ftos, strm, dsdx, dsdy, dsdp, deriv, work=work)
+        dsdx = dsdy = dsdp = work = None
+
+        mask = _tnmask(easterly, tnx, tny, self.limit)
+        return (np.ma.array(tnx, mask=mask), np.ma.array(tny, mask=mask.copy()),
+                np.ma.array(tnz, mask=mask.copy()))
+
+    def stream(self, strm, axis=0, chunk=None, max_memory=None, out=None):
+        u"""
+        流線関数偏差をaxisに沿ってブロックに分けて計算する。
+
+        :Arguments:
+         **strm** : array_like
+          流線関数偏差。スライスでndarrayを返すもの(netCDF4の変数など)でもよい。
+         **axis** : int, optional
+          分割する軸。デフォルトは0。
+         **chunk** : int, optional
+          1ブロックの長さ。
+         **max_memory** : int, optional
+          1ブロックの計算に使うメモリの上限の目安 [byte]。chunkもmax_memoryも与えない場合は
+          長さ1のブロックで計算する。
+         **out** : tuple, optional
+          結果を書き込む3つの配列(東西、南北、鉛直成分)。スライスで代入できればよい。
+          与えない場合はMaskedArrayを確保して返す。
+
+        :Returns:
+         **tnx, tny, tnz** : MaskedArray or out
+        """
+        shape = tuple(strm.shape)
+        axis = axis % len(shape)
+        if axis in (self.xdim % self.ndim, self.ydim % self.ndim, self.zdim % self.ndim):
+            raise ValueError, "cannot split along the horizontal or vertical dimension"
+        if chunk is None and max_memory is None:
+            chunk = 1
+        slices = tools.chunkslices(shape, [axis], chunks=None if chunk is None else {axis:chunk},
+                                   max_memory=max_memory, nbuffers=10)
+        if out is None:
+            out = tuple(np.ma.array(np.empty(shape), mask=np.zeros(shape, dtype=bool)) for i in range(3))
+        for sl in slices:
+            result = self(np.asarray(strm[sl]), sl)
+            for o, r in zip(out, result):
+                o[sl] = r
+        return out
+
+def absvrt(uwnd, vwnd, lon, lat, xdim, ydim, cyclic=True, sphere=True, metrics=None, workers=None):
+    u"""
     
-    return out
+    """
+    ndim    = np.ndim(uwnd)
+    if metrics is None:
+        metrics = getmetrics(ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim, sphere=sphere)
+    if _useworkers(workers):
+        func = lambda uwnd, vwnd: absvrt(uwnd, vwnd, lon, lat, xdim, ydim, cyclic=cyclic, metrics=metrics, workers=1)
+        return _threadapply(func, (uwnd, vwnd), (xdim, ydim), workers=workers, masked=True)
+
+    session = DiagnosticsSession(uwnd, vwnd, lon=lon, lat=lat, xdim=xdim, ydim=ydim, cyclic=cyclic,
+                                 metrics=metrics, workers=1)
+    return session.get('absvrt')
 
 def rhmd(temp, qval, lev, zdim, punit=100., qtyp='q'):
     u"""
@@ -352,3 +603,455 @@ def rhmd(temp, qval, lev, zdim, punit=100., qtyp='q'):
         raise TypeError, "qtyp '{0}' is incorrect".format(qtyp)
 
     return rh
+
+#=== 帯状平均の波の診断 ============================================================================
+
+def _zonalstats(u, v, t, omega, xdim):
+    u"""
+    東西平均 [u], [v], [T], [omega] と、共分散 [u'v'], [v'T'], [u'omega'] を経度方向の1回の
+    走査で計算する。偏差の配列は作らず、積の東西平均から平均の積を引く。
+    欠損値は4変数のいずれかが欠損している格子点を除いて平均する。
+    """
+    ndim = np.ndim(u)
+    xdim = xdim % ndim
+    sub = 'abcdefghij'[:ndim]
+    prod = '{0},{0}->{1}'.format(sub, sub[:xdim] + sub[xdim+1:])
+    arrays = [np.ma.getdata(a) for a in (u, v, t, omega)]
+    mask = np.ma.getmask(u) | np.ma.getmask(v) | np.ma.getmask(t) | np.ma.getmask(omega)
+    if mask is np.ma.nomask or not mask.any():
+        n = float(np.shape(u)[xdim])
+    else:
+        valid = ~mask
+        n = valid.sum(axis=xdim).astype(np.float64)
+        arrays = [np.where(valid, a, 0.) for a in arrays]
+    # 有効な格子点がない場合はNaNとする
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ub, vb, tb, wb = [a.sum(axis=xdim, dtype=np.float64)/n for a in arrays]
+        uv = np.einsum(prod, arrays[0], arrays[1], dtype=np.float64)/n - ub*vb
+        vt = np.einsum(prod, arrays[1], arrays[2], dtype=np.float64)/n - vb*tb
+        uw = np.einsum(prod, arrays[0], arrays[3], dtype=np.float64)/n - ub*wb
+    return ub, vb, tb, wb, uv, vt, uw
+
+def _tem(ub, vb, tb, wb, uv, vt, uw, lat, lev, ydim, zdim, punit, p0):
+    u"""
+    東西平均と共分散(東西次元を除いた配列)からEPフラックスとTEM残差循環を計算する。
+    """
+    ndim = ub.ndim
+    pfac = tools.expand((p0/(np.asarray(lev, dtype=np.float64)*punit))**kappa, ndim, axis=zdim)
+    phi = np.deg2rad(np.asarray(lat, dtype=np.float64))
+    # 極ではcosが丸め誤差で0にならないので、NaNとして欠損扱いにする
+    pole = tools.expand(np.abs(np.asarray(lat, dtype=np.float64)) >= 90., ndim, axis=ydim)
+    cos = np.where(pole, np.nan, tools.expand(np.cos(phi), ndim, axis=ydim))
+    f = tools.expand(constants.earth_f(np.asarray(lat, dtype=np.float64)), ndim, axis=ydim)
+    acos = constants.earth_radius*cos
+    mask = ~(np.isfinite(ub) & np.isfinite(tb) & np.isfinite(vt)) | pole
+    mask = mask if mask.any() else None
+    dvardy_ = lambda a: dvardy(a, lat, ydim, mask=mask)
+    dvardp_ = lambda a: dvardp(a, lev, zdim, punit=punit, mask=mask)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        psi = vt*pfac/dvardp_(tb*pfac)
+        fy = acos*(dvardp_(ub)*psi - uv)
+        fz = acos*((f - dvardy_(ub*cos)/cos)*psi - uw)
+        div = dvardy_(fy*cos)/cos + dvardp_(fz)
+        vstar = vb - dvardp_(psi)
+        wstar = wb + dvardy_(psi*cos)/cos
+    return tuple(np.ma.masked_invalid(a, copy=False) for a in (fy, fz, div, vstar, wstar))
+
+def epflux(u, v, t, omega, lat, lev, xdim, ydim, zdim, punit=100., p0=100000., axis=0, chunk=None,
+           max_memory=None, out=None):
+    ur"""
+    Eliassen-Palmフラックスとその収束、TEM(Transformed Eulerian Mean)の残差循環を計算する。
+
+    東西平均と渦の共分散は経度方向の1回の走査で求め、偏差の配列は作らない。入力をaxis
+    (時間など)に沿ってブロックに分けて読み込み、ブロックごとに東西平均した結果をoutに
+    書き込むので、長期間の日々のデータでもブロック分のメモリで計算できる。
+
+    :Arguments:
+     **u, v** : array_like
+      東西風、南北風 [m/s]。スライスでndarrayを返すもの(netCDF4の変数など)でもよい。
+     **t** : array_like
+      気温 [K]
+     **omega** : array_like
+      鉛直p速度 [Pa/s]
+     **lat** : array_like
+      緯度 [degrees]
+     **lev** : array_like
+      気圧 [punit*Pa]
+     **xdim, ydim, zdim** : int
+      東西、南北、鉛直次元の軸
+     **punit** : float, optional
+      levをPaに換算するための定数。デフォルトは100.。
+     **p0** : float, optional
+      温位の基準気圧 [Pa]。デフォルトは1000hPa。
+     **axis** : int, optional
+      分割する軸。デフォルトは0。東西、南北、鉛直次元の軸は指定できない。
+     **chunk** : int, optional
+      1ブロックの長さ。
+     **max_memory** : int, optional
+      1ブロックの計算に使うメモリの上限の目安 [byte]。chunkもmax_memoryも与えない場合は
+      分割しない。
+     **out** : tuple, optional
+      結果を書き込む5つの配列。東西次元を除いた形状で、スライスで代入できればよい。
+      与えない場合はMaskedArrayを確保して返す。
+
+    :Returns:
+     **fy, fz, div, vstar, omegastar** : MaskedArray or out
+      東西次元を除いた形状の配列。EPフラックスの南北成分 [m^3/s^2] 、鉛直成分 [m^2 Pa/s^2] 、
+      EPフラックス収束 [m^2/s^2] 、残差南北流 [m/s] 、残差鉛直p速度 [Pa/s] 。
+
+    .. note::
+       気圧座標、球面上で次のように計算する(Andrews et al. 1987)。[ ]は東西平均、'は偏差。
+
+       .. math:: F_{\phi} = a\cos\phi\left(\frac{\partial [u]}{\partial p}\psi - [u'v']\right),
+                 \hspace{2em}
+                 F_{p} = a\cos\phi\left[\left(f - \frac{1}{a\cos\phi}
+                         \frac{\partial [u]\cos\phi}{\partial\phi}\right)\psi - [u'\omega']\right]
+
+       .. math:: \nabla\cdot\mathbf{F} = \frac{1}{a\cos\phi}\frac{\partial F_{\phi}\cos\phi}{\partial\phi}
+                 + \frac{\partial F_{p}}{\partial p}, \hspace{2em}
+                 v^{*} = [v] - \frac{\partial\psi}{\partial p}, \hspace{2em}
+                 \omega^{*} = [\omega] + \frac{1}{a\cos\phi}\frac{\partial \psi\cos\phi}{\partial\phi}
+
+       ここで :math:`\psi = [v'\theta']/(\partial[\theta]/\partial p)` 。EPフラックス収束による
+       東西風の加速は :math:`\nabla\cdot\mathbf{F}/(a\cos\phi)` [m/s^2] 。極の値はマスクされる。
+
+    **Examples**
+     >>> fy, fz, div, vstar, wstar = epflux(u, v, t, omega, lat, lev, 3, 2, 1, chunk=30)
+    """
+    shape = tuple(u.shape)
+    ndim = len(shape)
+    xdim, ydim, zdim = xdim % ndim, ydim % ndim, zdim % ndim
+    # 東西平均した配列での軸
+    rydim, rzdim = [d - (d > xdim) for d in (ydim, zdim)]
+    rshape = shape[:xdim] + shape[xdim+1:]
+    if chunk is None and max_memory is None:
+        slices = [(slice(None),)*ndim]
+    else:
+        axis = axis % ndim
+        if axis in (xdim, ydim, zdim):
+            raise ValueError, "cannot split along the horizontal or vertical dimension"
+        slices = tools.chunkslices(shape, [axis], chunks=None if chunk is None else {axis:chunk},
+                                   max_memory=max_memory, nbuffers=6)
+    if out is None:
+        out = tuple(np.ma.array(np.empty(rshape), mask=np.zeros(rshape, dtype=bool)) for i in range(5))
+    for sl in slices:
+        stats = _zonalstats(u[sl], v[sl], t[sl], omega[sl], xdim)
+        result = _tem(*(stats + (lat, lev, rydim, rzdim, punit, p0)))
+        rsl = sl[:xdim] + sl[xdim+1:]
+        for o, r in zip(out, result):
+            o[rsl] = r
+    return out
+
+#=== 診断量の共通計算 ==============================================================================
+
+class DiagnosticsSession(object):
+    ur"""
+    中間量を共有して複数の診断量を計算する。
+
+    温位やその微分、相対渦度、コリオリパラメータなどの中間量を名前で保持し、要求された量を
+    必要になったときに計算する。:py:meth:`request` で予約した量(未計算の出力)がもう使わない
+    中間量は、その時点で解放する。 :py:func:`ertelpv` 、 :py:func:`stability` 、
+    :py:func:`tnflux2d` 、 :py:func:`tnflux3d` 、 :py:func:`absvrt` はこのクラスで計算している。
+
+    :Arguments:
+     **u, v** : ndarray, optional
+      東西風、南北風 [m/s]。TNフラックスでは気候値。
+     **t** : ndarray, optional
+      気温 [K]。TNフラックスでは気候値。
+     **lon, lat** : array_like, optional
+      経度、緯度 [degrees]
+     **lev** : array_like, optional
+      気圧 [punit*Pa]
+     **xdim, ydim, zdim** : int, optional
+      東西、南北、鉛直次元の軸
+     **strm** : ndarray, optional
+      流線関数偏差 [m^2/s]。TNフラックスを計算する場合に与える。
+     **cyclic** : bool, optional
+      東西境界を周期境界で扱うか。デフォルトはTrue。
+     **punit** : float, optional
+      levをPaに換算するための定数。デフォルトは100.。
+     **sphere** : bool, optional
+      球面緯度経度座標かどうか。デフォルトはTrue。
+     **limit** : float, optional
+      TNフラックスの水平成分の大きさの上限。デフォルトは100.。
+     **metrics** : GridMetrics, optional
+      格子の計量因子。:py:func:`pymet.grid.getmetrics` を参照。
+     **workers** : int, optional
+      各微分の並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    **計算できる量**
+
+    ========= ======================================= ==================
+    pv        エルテルのポテンシャル渦度              u, v, t
+    absvrt    絶対渦度                                u, v
+    stability 静的安定度                              t
+    tnx, tny  TNフラックスの東西、南北成分            u, v, strm
+    tnz       TNフラックスの鉛直成分                  u, v, t, strm
+    theta     温位                                    t
+    ========= ======================================= ==================
+
+    このほか、中間量として vor (相対渦度)、avor (絶対渦度)、f (コリオリパラメータ)、
+    dthdx, dthdy, dthdp (温位の微分)、dudp, dvdp、dlnthdp (log(温位)のp微分)、
+    dsdx, dsdy, dsdp, d2sdx2, d2sdy2, d2sdxdy, d2sdxdp, d2sdydp (流線関数の微分)、speed (風速) を
+    取り出せる。
+
+    **Examples**
+     >>> ds = DiagnosticsSession(u, v, t, lon, lat, lev, 3, 2, 1, strm=psi)
+     >>> ds.request('pv', 'stability', 'tnz')
+     >>> pv = ds['pv']           # theta, dthdp などは stability, tnz のために保持される
+     >>> N2 = ds['stability']
+     >>> tnz = ds['tnz']         # すべての中間量が解放される
+
+     まとめて計算する場合は
+     >>> result = ds.compute('pv', 'stability', 'tnx', 'tny', 'tnz')
+    """
+    # 量の名前: 計算に用いる量
+    _graph = {'theta':     ('t',),
+              'dthdp':     ('theta',),
+              'dthdx':     ('theta',),
+              'dthdy':     ('theta',),
+              'dlnthdp':   ('theta',),
+              'dudp':      ('u',),
+              'dvdp':      ('v',),
+              'f':         (),
+              'vor':       ('u', 'v'),
+              'avor':      ('f', 'vor'),
+              'pv':        ('avor', 'dthdp', 'dthdx', 'dthdy', 'dudp', 'dvdp'),
+              'absvrt':    ('avor',),
+              'stability': ('t', 'dlnthdp'),
+              'dsdx':      ('strm',),
+              'dsdy':      ('strm',),
+              'dsdp':      ('strm',),
+              'd2sdx2':    ('strm',),
+              'd2sdy2':    ('strm',),
+              'd2sdxdy':   ('dsdx',),
+              'd2sdxdp':   ('dsdp',),
+              'd2sdydp':   ('dsdp',),
+              'speed':     ('u', 'v'),
+              'tnraw':     ('u', 'v', 'speed', 'strm', 'dsdx', 'dsdy', 'd2sdx2', 'd2sdy2', 'd2sdxdy'),
+              'tnmask':    ('u', 'tnraw'),
+              'tnx':       ('tnraw', 'tnmask'),
+              'tny':       ('tnraw', 'tnmask'),
+              'tnz':       ('u', 'v', 'strm', 'f', 'stability', 'dsdx', 'dsdy', 'dsdp', 'd2sdxdp', 'd2sdydp',
+                            'tnmask')}
+    _inputs = ('u', 'v', 't', 'strm')
+
+    def __init__(self, u=None, v=None, t=None, lon=None, lat=None, lev=None, xdim=None, ydim=None, zdim=None,
+                 strm=None, cyclic=True, punit=100., sphere=True, limit=100., metrics=None, workers=None):
+        self._values = {}
+        self._masks = {}
+        for name, var in zip(self._inputs, (u, v, t, strm)):
+            if var is not None:
+                self._values[name] = np.ma.getdata(var)
+                self._masks[name] = np.ma.getmask(var)
+        if not self._values:
+            raise ValueError, "at least one of u, v, t and strm is required"
+        ndim = self._values.values()[0].ndim
+        if metrics is None:
+            metrics = getmetrics(ndim, lon=lon, lat=lat, lev=lev, xdim=xdim, ydim=ydim, zdim=zdim,
+                                 sphere=sphere, punit=punit)
+        self.lon, self.lat, self.lev = lon, lat, lev
+        self.xdim, self.ydim, self.zdim = xdim, ydim, zdim
+        self.cyclic = cyclic
+        self.punit = punit
+        self.limit = limit
+        self.metrics = metrics
+        self.workers = workers
+        self._pending = []
+
+    #--- 評価 --------------------------------------------------------------------------------------
+
+    def _check(self, name):
+        if not name in self._graph and not name in self._inputs:
+            raise ValueError, "unknown quantity '{0}'".format(name)
+
+    def _needed(self, names):
+        u"""
+        namesの計算に必要な(namesを含む)量の集合。計算済みの量の依存先はたどらない。
+        """
+        needed = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in needed:
+                continue
+            needed.add(name)
+            if not name in self._values:
+                stack.extend(self._graph.get(name, ()))
+        return needed
+
+    def _order(self, name):
+        u"""
+        nameを得るために計算する量を、依存関係の順に並べたリスト。
+        """
+        order = []
+        def visit(n):
+            if n in self._values or n in order:
+                return
+            if n in self._inputs:
+                raise ValueError, "'{0}' requires input '{1}'".format(name, n)
+            for dep in self._graph[n]:
+                visit(dep)
+            order.append(n)
+        visit(name)
+        return order
+
+    def _release(self, name, keep):
+        if not name in keep and not name in self._inputs:
+            self._values.pop(name, None)
+
+    def request(self, *names):
+        u"""
+        これから取り出す量を予約する。予約した量の計算に必要な中間量は、取り出されるまで保持する。
+        """
+        for name in names:
+            self._check(name)
+        self._pending.extend(names)
+
+    def get(self, name):
+        u"""
+        nameの量を計算して返す。予約されていれば予約を取り消し、残りの予約に不要な中間量を解放する。
+        """
+        self._check(name)
+        if name in self._pending:
+            self._pending.remove(name)
+        order = self._order(name)
+        uses = collections.Counter(dep for n in order for dep in self._graph[n])
+        for n in order:
+            deps = self._graph[n]
+            self._values[n] = getattr(self, '_calc_' + n)(*[self._values[dep] for dep in deps])
+            # 計算済みの量が増えると、予約された量に必要な中間量は減る
+            keep = self._needed(self._pending)
+            for dep in deps:
+                uses[dep] -= 1
+                if uses[dep] == 0 and dep != name:
+                    self._release(dep, keep)
+        value = self._values[name]
+        keep = self._needed(self._pending)
+        for n in self._values.keys():
+            self._release(n, keep)
+        return value
+
+    __getitem__ = get
+
+    def compute(self, *names):
+        u"""
+        namesの量をまとめて計算し、名前をキーとする辞書で返す。
+        """
+        self.request(*names)
+        return dict((name, self.get(name)) for name in names)
+
+    @property
+    def cached(self):
+        u"""
+        保持している中間量の名前のリスト。
+        """
+        return sorted(n for n in self._values if not n in self._inputs)
+
+    #--- 各量の計算 --------------------------------------------------------------------------------
+
+    def _mask(self, *names):
+        mask = np.ma.nomask
+        for name in names:
+            mask = mask | self._masks.get(name, np.ma.nomask)
+        return mask
+
+    def _maskpoles(self, out, mask):
+        out = np.ma.array(out, mask=mask)
+        out = tools.mrollaxis(out, self.ydim, 0)
+        out[0,...]  = np.ma.masked
+        out[-1,...] = np.ma.masked
+        return tools.mrollaxis(out, 0, self.ydim+1)
+
+    def _calc_theta(self, t):
+        return pottemp(t, self.lev, self.zdim, punit=self.punit)
+
+    def _calc_dthdp(self, theta):
+        return dvardp(theta, self.lev, self.zdim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_dthdx(self, theta):
+        return dvardx(theta, self.lon, self.lat, self.xdim, self.ydim, cyclic=self.cyclic, metrics=self.metrics,
+                      workers=self.workers)
+
+    def _calc_dthdy(self, theta):
+        return dvardy(theta, self.lat, self.ydim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_dlnthdp(self, theta):
+        return dvardp(np.log(theta), self.lev, self.zdim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_dudp(self, u):
+        return dvardp(u, self.lev, self.zdim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_dvdp(self, v):
+        return dvardp(v, self.lev, self.zdim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_f(self):
+        return self.metrics.f
+
+    def _calc_vor(self, u, v):
+        return kinematics(u, v, self.lon, self.lat, self.xdim, self.ydim, cyclic=self.cyclic, names='rot',
+                          metrics=self.metrics, workers=self.workers)['rot']
+
+    def _calc_avor(self, f, vor):
+        return f + vor
+
+    def _calc_pv(self, avor, dthdp, dthdx, dthdy, dudp, dvdp):
+        out = -g * (avor*dthdp - (dthdx*dvdp-dthdy*dudp))
+        return self._maskpoles(out, self._mask('u', 'v', 't'))
+
+    def _calc_absvrt(self, avor):
+        return self._maskpoles(avor.copy(), self._mask('u', 'v'))
+
+    def _calc_stability(self, t, dlnthdp):
+        p = tools.expand(self.lev, t.ndim, axis=self.zdim)*self.punit
+        alpha = rd*t/p
+        return -alpha * dlnthdp
+
+    def _calc_dsdx(self, strm):
+        return dvardx(strm, self.lon, self.lat, self.xdim, self.ydim, cyclic=self.cyclic, metrics=self.metrics,
+                      workers=self.workers)
+
+    def _calc_dsdy(self, strm):
+        return dvardy(strm, self.lat, self.ydim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_dsdp(self, strm):
+        return dvardp(strm, self.lev, self.zdim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_d2sdx2(self, strm):
+        return d2vardx2(strm, self.lon, self.lat, self.xdim, self.ydim, cyclic=self.cyclic, metrics=self.metrics,
+                        workers=self.workers)
+
+    def _calc_d2sdy2(self, strm):
+        return d2vardy2(strm, self.lat, self.ydim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_d2sdxdy(self, dsdx):
+        return dvardy(dsdx, self.lat, self.ydim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_d2sdxdp(self, dsdp):
+        return dvardx(dsdp, self.lon, self.lat, self.xdim, self.ydim, cyclic=self.cyclic, metrics=self.metrics,
+                      workers=self.workers)
+
+    def _calc_d2sdydp(self, dsdp):
+        return dvardy(dsdp, self.lat, self.ydim, metrics=self.metrics, workers=self.workers)
+
+    def _calc_speed(self, U, V):
+        return np.hypot(U, V)
+
+    def _calc_tnraw(self, U, V, speed, strm, dsdx, dsdy, d2sdx2, d2sdy2, d2sdxdy):
+        derivs = {'d2sdx2':d2sdx2, 'd2sdy2':d2sdy2, 'd2sdxdy':d2sdxdy}
+        return _tnhorizontal(U, V, speed, strm, dsdx, dsdy, lambda name, out: derivs[name])
+
+    def _calc_tnmask(self, U, tnraw):
+        return _tnmask(U < 0, tnraw[0], tnraw[1], self.limit)
+
+    def _calc_tnx(self, tnraw, tnmask):
+        return np.ma.array(tnraw[0], mask=tnmask.copy())
+
+    def _calc_tny(self, tnraw, tnmask):
+        return np.ma.array(tnraw[1], mask=tnmask.copy())
+
+    def _calc_tnz(self, U, V, strm, f, S, dsdx, dsdy, dsdp, d2sdxdp, d2sdydp, tnmask):
+        derivs = {'d2sdxdp':d2sdxdp, 'd2sdydp':d2sdydp}
+        tnz = _tnvertical(U, V, f**2/S**2, strm, dsdx, dsdy, dsdp, lambda name, out: derivs[name])
+        return np.ma.array(tnz, mask=tnmask.copy())
@@ -1,13 +1,21 @@
 # coding:utf-8
 from info import __doc__
 import core
-import wrapgrid, wrapdynamics
+import wrapgrid, wrapdynamics, wrapspharm, wrapregrid, wrapsmooth, wrapthermo
 from core import *
 from wrapgrid import *
 from wrapdynamics import *
+from wrapspharm import *
+from wrapregrid import *
+from wrapsmooth import *
+from wrapthermo import *
 
 __all__ = []
 __all__ += core.__all__
 __all__ += wrapgrid.__all__
 __all__ += wrapdynamics.__all__
+__all__ += wrapspharm.__all__
+__all__ += wrapregrid.__all__
+__all__ += wrapsmooth.__all__
+__all__ += wrapthermo.__all__
 
@@ -3,6 +3,8 @@ import numpy as np
 import copy
 from datetime import datetime
 import pymet.stats as stats
+import pymet.grid
+import pymet.tools as tools
 
 __all__ = ['McGrid', 'McField', 'join']
 
@@ -30,6 +32,9 @@ class McGrid:
      **lon**
 
      **lat**
+      lon, latに同じ形状(緯度次元の長さ, 経度次元の長さ)の2次元配列を与えると、
+      回転極座標などの曲線座標格子となる。この場合、lat、lonの次元は格子の添字の次元で、
+      微分などの計算には :py:class:`pymet.grid.GridMetrics` の曲線座標格子の計量を用いる。
 
      **lev**
 
@@ -64,6 +69,7 @@ class McGrid:
     ydim
     zdim
     tdim
+    curvilinear
     ======= ======================
 
     **Methods**
@@ -78,6 +84,8 @@ class McGrid:
         dimshape    
         gridmask
         getgrid
+        getmetrics
+        chunkslices
     
     """
     def __init__(self,name=None,lon=None,lat=None,lev=None,time=None,ens=None,punit=100.,sphere=True):
@@ -157,10 +165,10 @@ class McGrid:
                 return self.dims.index('ens')
             elif name == 'xn':
                 dname = 'lon'
-                return len(self.lon)
+                return np.shape(self.lon)[-1]
             elif name == 'yn':
                 dname = 'lat'                
-                return len(self.lat)
+                return np.shape(self.lat)[0]
             elif name == 'zn':
                 dname = 'lev'                
                 return len(self.lev)
@@ -170,7 +178,9 @@ class McGrid:
             elif name == 'en':
                 dname = 'ens'                
                 return len(self.ens)
-        except ValueError:
+            elif name == 'curvilinear':
+                return np.ndim(self.lon) == 2 or np.ndim(self.lat) == 2
+        except (ValueError, IndexError):
             raise AttributeError, "McGrid instance has no dimension '{0}'".format(dname)
         raise AttributeError, "McGrid instance has no attribute '{0}'".format(name)
 
@@ -195,6 +205,8 @@ class McGrid:
         """
         if np.size(self.lon) < 2 or np.size(self.lat) < 2:
             raise ValueError, "McGrid instance does not have enogh length of 'lon' and 'lat' dimension" 
+        if self.curvilinear:
+            return self.lat, self.lon
 
         lon, lat = np.meshgrid(self.lon, self.lat)
         return lat, lon
@@ -227,7 +239,8 @@ class McGrid:
         shape = ()
         for dim in ['ens','time','lev','lat','lon']:
             dn = getattr(self, dim)
-            if dn != None: dn = np.size(dn)
+            if dn is not None:
+                dn = getattr(self, {'lon':'xn', 'lat':'yn'}[dim]) if dim in ('lon','lat') else np.size(dn)
             shape += (dn,)
 
         return shape
@@ -294,6 +307,8 @@ class McGrid:
         for kwd in kwargs:
             if not kwd in self.dims:
                 raise ValueError, "McGrid instance has no dimension {0}".format(kwd)
+            if kwd in ('lon', 'lat') and self.curvilinear:
+                raise ValueError, "cannot select '{0}' by value on a curvilinear grid".format(kwd)
         mask = []
         for dim in self.dims:
             dimvalue = self.__dict__[dim]
@@ -340,6 +355,8 @@ class McGrid:
         for kwd in kwargs:
             if not kwd in self.dims:
                 raise ValueError, "McGrid instance has no dimension {0}".format(kwd)
+            if kwd in ('lon', 'lat') and self.curvilinear:
+                raise ValueError, "cannot select '{0}' by value on a curvilinear grid".format(kwd)
         grid = self.copy()
         for key, value in kwargs.items():
             dimvalue = getattr(self, key)
@@ -367,6 +384,131 @@ class McGrid:
                 setattr(grid, key, new_dimvalue)
                 
             return grid
+
+    def getmetrics(self):
+        u"""
+        微分計算に用いる格子の計量因子を返す。
+
+        同じ座標を持つMcGridに対しては計算済みのものを再利用する。
+
+        :Returns:
+         **metrics** : pymet.grid.GridMetrics
+
+        .. seealso::
+
+           .. autosummary::
+              :nosignatures:
+
+              pymet.grid.getmetrics
+        """
+        xdim = getattr(self, 'xdim', None)
+        ydim = getattr(self, 'ydim', None)
+        zdim = getattr(self, 'zdim', None)
+        lon = self.lon if xdim is not None else None
+        lat = self.lat if ydim is not None else None
+        lev = self.lev if zdim is not None else None
+        return pymet.grid.getmetrics(len(self.dims), lon=lon, lat=lat, lev=lev,
+                                     xdim=xdim, ydim=ydim, zdim=zdim,
+                                     sphere=self.sphere, punit=self.punit)
+
+    def sphereindex(self):
+        u"""
+        格子点の球面上の位置に対する空間インデックスを返す。
+
+        同じ座標を持つMcGridに対しては構築済みのものを再利用する。返すインデックスは
+        (lat, lon) の2次元格子に対するもの。
+
+        :Returns:
+         **index** : pymet.grid.SphereIndex
+
+        **Examples**
+         >>> dist, (j, i) = field.grid.sphereindex().queryradius(140., 35., 500.e3)
+
+        .. seealso::
+
+           .. autosummary::
+              :nosignatures:
+
+              pymet.grid.SphereIndex
+              pymet.grid.getsphereindex
+        """
+        if getattr(self, 'xdim', None) is None or getattr(self, 'ydim', None) is None:
+            raise ValueError, "grid must have both lon and lat dimensions"
+        return pymet.grid.getsphereindex(self.lon, self.lat)
+
+    def chunkslices(self, chunks=None, max_memory=None, keep=(), itemsize=8, nbuffers=1):
+        u"""
+        データをアンサンブル、時間、鉛直次元のブロックに分けて処理するためのインデックスを返す。
+
+        :Arguments:
+         **chunks** : dict, optional
+          次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} 。
+         **max_memory** : int, optional
+          1ブロックあたりに使うメモリの上限 [byte]。外側の次元から順に分割する。
+         **keep** : sequence of str, optional
+          分割しない次元名。鉛直微分を行う場合は 'lev' を与える。
+         **itemsize** : int, optional
+          1要素あたりのバイト数。デフォルトは8(倍精度)。
+         **nbuffers** : int, optional
+          1ブロックの処理中に同時に確保される配列の数の目安。デフォルトは1。
+
+        :Returns:
+         **slices** : list of tuple
+          chunks, max_memoryともにNoneの場合は全体を表すスライス1つのみ。
+
+        .. seealso::
+
+           .. autosummary::
+              :nosignatures:
+
+              pymet.tools.chunkslices
+        """
+        axes = [self.dims.index(d) for d in ['ens','time','lev'] if d in self.dims and not d in keep]
+        shape = tuple(n for n in self.dimshape() if n is not None)
+        chunkaxes = {}
+        for name, n in (chunks or {}).items():
+            if not name in self.dims:
+                raise ValueError, "McGrid instance has no dimension '{0}'".format(name)
+            if not self.dims.index(name) in axes:
+                raise ValueError, "dimension '{0}' cannot be chunked".format(name)
+            chunkaxes[self.dims.index(name)] = n
+        return tools.chunkslices(shape, axes, chunks=chunkaxes, max_memory=max_memory,
+                                 itemsize=itemsize, nbuffers=nbuffers)
+
+def _chunkapply(func, arrays, grid, chunks=None, max_memory=None, keep=(), nbuffers=1, nout=1, useout=True,
+                outshape=None):
+    u"""
+    arraysをgrid.chunkslicesのブロックごとにfuncへ渡し、事前に確保した配列に結果を書き込む。
+
+    useoutがTrueの場合はfunc(*blocks, out=...)の形で出力先のブロックを渡す。Falseの場合は
+    funcの返り値(MaskedArrayでもよい)を代入する。chunks, max_memoryともにNoneの場合は
+    分割せずにfuncを呼ぶ。結果の形状が入力と異なる場合(keepで分割しない次元の長さが変わる
+    場合)はoutshapeで与える。
+    """
+    if chunks is None and max_memory is None:
+        return func(*arrays, out=None) if useout else func(*arrays)
+    shape = arrays[0].shape if outshape is None else outshape
+    slices = grid.chunkslices(chunks=chunks, max_memory=max_memory, keep=keep, nbuffers=nbuffers)
+    results = None
+    for sl in slices:
+        blocks = [a[sl] for a in arrays]
+        if useout:
+            if results is None:
+                dtype = np.result_type(arrays[0].dtype, np.float64)
+                results = [np.empty(shape, dtype=dtype) for i in range(nout)]
+            outs = [r[sl] for r in results]
+            func(*blocks, out=outs[0] if nout == 1 else tuple(outs))
+        else:
+            res = func(*blocks)
+            if nout == 1:
+                res = (res,)
+            if results is None:
+                results = [np.ma.empty(shape, dtype=r.dtype) for r in res]
+            for r, rblock in zip(results, res):
+                r[sl] = rblock
+    if nout == 1:
+        return results[0]
+    return tuple(results)
     
 class McField(np.ma.MaskedArray):
     u"""
@@ -464,8 +606,19 @@ class McField(np.ma.MaskedArray):
             ind = np.indices(self.shape)
             dimidx = [np.unique(ind[i][keys]) for i in range(self.ndim)]
             # 各次元の値のスライスを求めて、変更する。
+            # 曲線座標格子の2次元のlon, latは緯度、経度両方のインデックスでスライスする。
+            curvilinear = self.grid.curvilinear
             for dimname, idx in zip(self.grid.dims, dimidx):
+                if curvilinear and dimname in ('lon', 'lat'):
+                    continue
                 setattr(grid, dimname, getattr(grid, dimname)[idx])
+            if curvilinear:
+                lon, lat = self.grid.lon, self.grid.lat
+                if np.ndim(lon) == 1: lon = lon[np.newaxis,:]
+                if np.ndim(lat) == 1: lat = lat[:,np.newaxis]
+                lon, lat = np.broadcast_arrays(lon, lat)
+                ix = np.ix_(dimidx[self.grid.ydim], dimidx[self.grid.xdim])
+                grid.lon, grid.lat = lon[ix], lat[ix]
                 
             return McField(data, name=self.name, grid=grid, mask=data.mask)                
         except:            
@@ -542,17 +695,29 @@ class McField(np.ma.MaskedArray):
             grid.time = grid.time[length/2:-length/2]
         return McField(result, name='runave', grid=grid, mask=mask)
 
-    def timefilter(self, cut1, cut2=None, mode='lowpass', bound='mask'):
+    def timefilter(self, cut1, cut2=None, mode='lowpass', bound='mask', method='lanczos', order=4):
         u"""
-        Lanczosフィルターをかけた成分を返す。
+        Lanczosフィルター、もしくはButterworthフィルターをかけた成分を返す。
+
+        method='lanczos'の場合は時間次元に沿って :py:func:`pymet.stats.lancoz` をかける。項数は
+        2*max(cut1, cut2)+1 で、項数が長い場合はFFTで計算する。method='butterworth'の場合は
+        :py:func:`pymet.stats.butterworth` をかける。計算量がカットオフ周期によらず、両端の値も
+        失われないので、長い周期のフィルターに向く。
 
         :Arguments:
          **cut1** : int
           カットオフ(イン)周波数。''日数''で指定する。
          **cut2** : int
           bandpassフィルター時のカットイン周波数。''日数''で指定する。
+         **mode** : {'lowpass', 'highpass', 'bandpass'}, optional
+          フィルターの種類。デフォルトはlowpass。
          **bound** : {'mask', 'valid'}, optional
-          境界の扱い方。デフォルトはmask。
+          境界の扱い方。デフォルトはmask。method='butterworth'の場合は用いない。
+         **method** : {'lanczos', 'butterworth'}, optional
+          フィルターの方法。デフォルトはlanczos。'butterworth'の場合、欠損値を含む格子点は
+          時系列全体をマスクする。
+         **order** : int, optional
+          method='butterworth'の場合のフィルターの次数。デフォルトは4。
         :Returns:
          **out** : McField object
         """
@@ -565,22 +730,29 @@ class McField(np.ma.MaskedArray):
         if not np.all(np.diff(grid.time) == dt):
             raise ValueError, "time step must be same"
         
+        if method == 'butterworth':
+            steps = 3600.*24 / dt.total_seconds()
+            result = stats.butterworth(np.ma.asarray(self), cut1*steps, cutoff2=cut2 and cut2*steps, order=order,
+                                       axis=grid.tdim, mode=mode)
+            return McField(result, name=self.name + '_' + mode, grid=grid, mask=np.ma.getmask(result))
+        elif method != 'lanczos':
+            raise ValueError, "method must be 'lanczos' or 'butterworth', not '{0}'".format(method)
+
         cut1 = int(cut1*3600.*24 / dt.total_seconds())
         if cut2:
             cut2 = int(cut2*3600.*24 / dt.total_seconds())
             
-        length = 2*max(cut1, cut2) + 1
-        result = stats.lanczos_filter(data, cut1, cut2=cut2, length=length,
-                                      tdim=grid.tdim, bound=bound, mode=mode)
+        length = 2*max(cut1, cut2 or 0) + 1
+        result = stats.lancoz(data, cut1, cutoff2=cut2, length=length, axis=grid.tdim, bound=bound, mode=mode)
         if np.size(result) < 2:
             return result
         if bound == 'valid':
-            grid.time = grid.time[length/2:-length/2]
-            mask = tools.mrollaxis(mask, grid.tdim, 0)
-            mask = mask[length/2:-length/2,...]
-            mask = tools.mrollaxis(mask, 0, grid.tdim+1)
+            k = length//2
+            grid.time = grid.time[k:-k]
+            if mask is not np.ma.nomask:
+                mask = mask[(slice(None),)*grid.tdim + (slice(k, -k),)]
 
-        mask = mask | result.mask
+        mask = mask | np.ma.getmask(result)
         return McField(result, name=self.name + '_' + mode, grid=grid, mask=mask)
 
     #-------------------------------------------------------------
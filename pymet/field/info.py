@@ -19,6 +19,9 @@ u"""
    McGrid.dimshape
    McGrid.gridmask
    McGrid.getgrid
+   McGrid.getmetrics
+   McGrid.sphereindex
+   McGrid.chunkslices
    
 
 ------------------------
@@ -53,7 +56,54 @@ pymet.gridへのラッパー
    div
    rot
    grad
-   skgrad   
+   skgrad
+   kinematics
+   invlaplacian
+   helmholtz
+   vinterp
+
+-----------------------------
+pymet.spharmへのラッパー
+-----------------------------
+
+.. autosummary::
+
+   spdiv
+   sprot
+   spgrad
+   splaplacian
+   spinvlaplacian
+   sptrunc
+
+-----------------------------
+pymet.regridへのラッパー
+-----------------------------
+
+.. autosummary::
+
+   regrid
+
+-----------------------------
+pymet.smoothへのラッパー
+-----------------------------
+
+.. autosummary::
+
+   smooth
+   gaussfilter
+   zonaltrunc
+   lanczos2d
+
+-----------------------------
+pymet.thermoへのラッパー
+-----------------------------
+
+.. autosummary::
+
+   eptemp
+   lcl
+   parcel
+   cape
 
 ---------------------------   
 pymet.dynamicsへのラッパー
@@ -62,10 +112,13 @@ pymet.dynamicsへのラッパー
 .. autosummary::
 
    pottemp
+   to_isentropic
    ertelpv
    stability
    tnflux2d
    tnflux3d
+   epflux
+   diagnostics
 
 ----------------------------
 
@@ -5,10 +5,12 @@
 import pymet.dynamics as dynamics
 import numpy as np
 from core import *
+from core import _chunkapply
 
-__all__ = ['pottemp', 'ertelpv', 'stability', 'tnflux2d', 'tnflux3d', 'absvrt', 'rhmd']
+__all__ = ['pottemp', 'to_isentropic', 'ertelpv', 'stability', 'tnflux2d', 'tnflux3d', 'absvrt', 'rhmd',
+           'epflux', 'diagnostics']
 
-def pottemp(tfield, p0=1000000.):
+def pottemp(tfield, p0=100000.):
     u"""
     温位を気温から計算する。
 
@@ -36,7 +38,75 @@ def pottemp(tfield, p0=1000000.):
 
     return McField(result, name='theta', grid=grid, mask=mask)
 
-def ertelpv(ufield, vfield, tfield, cyclic=True):
+def to_isentropic(tfield, thlev, fields=(), extrapolate='nan', chunks=None, max_memory=None, workers=None):
+    u"""
+    気温と各変数を等温位面に内挿する。
+
+    温位と内挿の重みは一度だけ計算し、気圧とすべての変数に共通に用いる。
+
+    :Arguments:
+     **tfield** : McField object
+      気温 [K]
+     **thlev** : array_like
+      内挿する温位 [K]
+     **fields** : sequence of McField object, optional
+      内挿する変数。tfieldと同じ格子で、名前(name属性)が互いに異なること。
+     **extrapolate** : {'error', 'nan', 'constant', 'linear'}, optional
+      温位の範囲外(地面の下など)の扱い。デフォルトは'nan'で、その点はマスクされる。
+     **chunks** : dict, optional
+      次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+      事前に確保した配列に書き込む。鉛直方向には分割しない。
+     **max_memory** : int, optional
+      1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **result** : dict
+      'pres' (気圧)、'temp' (気温)と、各変数の名前をキーとするMcField objectの辞書。
+      格子のlevは温位になる。
+
+    **Examples**
+     >>> pv = ertelpv(ufield, vfield, tfield)
+     >>> isen = to_isentropic(tfield, [300., 315., 330.], fields=[ufield, vfield, pv], chunks={'time':10})
+     >>> isen['pres'], isen['pv']
+
+    .. seealso::
+
+       .. autosummary::
+          :nosignatures:
+
+          pymet.dynamics.isentropic
+    """
+    fields = list(fields)
+    if not all(isinstance(f, McField) for f in [tfield] + fields):
+        raise TypeError, "input must be McField instance"
+    names = [f.name for f in fields]
+    if len(set(names)) != len(names):
+        raise ValueError, "fields must have distinct names"
+    grid = tfield.grid.copy()
+    zdim = grid.zdim
+    thlev = np.atleast_1d(thlev)
+    outnames = ['pres', 'temp'] + names
+
+    def func(t, *vars):
+        isen = dynamics.isentropic(t, grid.lev, zdim, thlev, variables=dict(zip(names, vars)),
+                                   punit=grid.punit, extrapolate=extrapolate, workers=workers)
+        return tuple(isen[name] for name in outnames)
+    outshape = tfield.shape[:zdim] + (len(thlev),) + tfield.shape[zdim+1:]
+    # 温位と気圧の作業配列に加え、内挿の重みと結果がlen(thlev)/zn層分ずつ必要
+    nbuffers = 4 + int(np.ceil((2 + len(outnames)) * len(thlev) / float(grid.zn)))
+    values = _chunkapply(func, [np.ma.asarray(f) for f in [tfield] + fields], grid, chunks=chunks,
+                         max_memory=max_memory, keep=['lev'], nbuffers=nbuffers,
+                         nout=len(outnames), useout=False, outshape=outshape)
+
+    grid.lev = thlev
+    result = {}
+    for name, value in zip(outnames, values):
+        result[name] = McField(np.ma.masked_invalid(value, copy=False), name=name, grid=grid.copy())
+    return result
+
+def ertelpv(ufield, vfield, tfield, cyclic=True, chunks=None, max_memory=None, workers=None):
     u"""
     エルテルのポテンシャル渦度を計算する。
 
@@ -47,6 +117,13 @@ def ertelpv(ufield, vfield, tfield, cyclic=True):
       気温 [K]
      **cyclic** : bool, optional
       東西境界を周期境界で扱うか。デフォルトはTrue
+     **chunks** : dict, optional
+      次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+      事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+      1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
       
     :Returns:
       **out** : McField object
@@ -67,19 +144,30 @@ def ertelpv(ufield, vfield, tfield, cyclic=True):
     temp = np.ma.getdata(tfield, subok=False)
     mask = np.ma.getmask(ufield) | np.ma.getmask(vfield) | np.ma.getmask(tfield) 
 
-    result = dynamics.ertelpv(uwnd, vwnd, temp, grid.lon, grid.lat, grid.lev,
-                              grid.xdim, grid.ydim, grid.zdim,
-                              cyclic=cyclic, punit=grid.punit, sphere=grid.sphere)
+    metrics = grid.getmetrics()
+    func = lambda uwnd, vwnd, temp: dynamics.ertelpv(uwnd, vwnd, temp, grid.lon, grid.lat, grid.lev,
+                                                     grid.xdim, grid.ydim, grid.zdim,
+                                                     cyclic=cyclic, punit=grid.punit, sphere=grid.sphere,
+                                                     metrics=metrics, workers=workers)
+    result = _chunkapply(func, (uwnd, vwnd, temp), grid, chunks=chunks, max_memory=max_memory,
+                         keep=['lev'], nbuffers=16, useout=False)
 
     return McField(result, name='ertelpv', grid=grid, mask=mask)
 
-def stability(tfield):
+def stability(tfield, chunks=None, max_memory=None, workers=None):
     u"""
     p座標系での静的安定度(Brunt-Vaisala振動数)を計算する。
 
     :Arguments:
      **tfield** : McField object
       気温 [K]
+     **chunks** : dict, optional
+      次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+      事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+      1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
       
     :Returns:
       **out** : McField object
@@ -94,15 +182,18 @@ def stability(tfield):
     """
     if not isinstance(tfield, McField):
         raise TypeError, "input must be McField instance"
-    grid = ufield.grid.copy()
+    grid = tfield.grid.copy()
     temp = np.ma.getdata(tfield, subok=False)
     mask = np.ma.getmask(tfield)
 
-    result = dynamics.stability(temp, grid.lev, grid.zdim, punit=grid.punit)
+    metrics = grid.getmetrics()
+    func = lambda temp: dynamics.stability(temp, grid.lev, grid.zdim, punit=grid.punit, metrics=metrics, workers=workers)
+    result = _chunkapply(func, (temp,), grid, chunks=chunks, max_memory=max_memory,
+                         keep=['lev'], nbuffers=5, useout=False)
 
     return McField(result, name='stability', grid=grid, mask=mask)
 
-def tnflux2d(Ufield, Vfield, strmfield, cyclic=True, limit=100.):
+def tnflux2d(Ufield, Vfield, strmfield, cyclic=True, limit=100., chunks=None, max_memory=None, workers=None):
     u"""
     Takaya & Nakamura (2001) の波活動度フラックスの水平成分をp面上で計算する。
 
@@ -115,6 +206,13 @@ def tnflux2d(Ufield, Vfield, strmfield, cyclic=True, limit=100.):
       東西境界を周期境界で扱うか。デフォルトはTrue。
      **limit** : float, optional
       デフォルトは100.
+     **chunks** : dict, optional
+      次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+      事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+      1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
      
     :Returns:
      **tnx, tny** : McField object
@@ -136,13 +234,16 @@ def tnflux2d(Ufield, Vfield, strmfield, cyclic=True, limit=100.):
     strm = np.ma.getdata(strmfield, subok=False)
     mask = np.ma.getmask(Ufield) | np.ma.getmask(Vfield) | np.ma.getmask(strmfield) 
 
-    tnx, tny = dynamics.tnflux2d(U, V, strm, grid.lon, grid.lat, grid.xdim, grid.ydim,
-                               cyclic=cyclic, limit=limit)
+    metrics = grid.getmetrics()
+    func = lambda U, V, strm: dynamics.tnflux2d(U, V, strm, grid.lon, grid.lat, grid.xdim, grid.ydim,
+                                                cyclic=cyclic, limit=limit, metrics=metrics, workers=workers)
+    tnx, tny = _chunkapply(func, (U, V, strm), grid, chunks=chunks, max_memory=max_memory,
+                           nbuffers=14, nout=2, useout=False)
     tnx = McField(tnx, name='tnflux_x', grid=grid.copy(), mask=mask)
     tny = McField(tny, name='tnflux_y', grid=grid.copy(), mask=mask)
     return tnx, tny
 
-def tnflux3d(Ufield, Vfield, Tfield, strmfield, cyclic=True, limit=100.):
+def tnflux3d(Ufield, Vfield, Tfield, strmfield, cyclic=True, limit=100., chunks=None, max_memory=None, workers=None):
     u"""
     Takaya & Nakamura (2001) の波活動度フラックスをp面上で計算する。
 
@@ -157,6 +258,13 @@ def tnflux3d(Ufield, Vfield, Tfield, strmfield, cyclic=True, limit=100.):
       東西境界を周期境界で扱うか。デフォルトはTrue。
      **limit** : float, optional
       デフォルトは100.
+     **chunks** : dict, optional
+      次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+      事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+      1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
      
     :Returns:
      **tnx, tny, tnz** : McField object
@@ -179,15 +287,51 @@ def tnflux3d(Ufield, Vfield, Tfield, strmfield, cyclic=True, limit=100.):
     strm = np.ma.getdata(strmfield, subok=False)
     mask = np.ma.getmask(Ufield) | np.ma.getmask(Vfield) | np.ma.getmask(Tfield) | np.ma.getmask(strmfield) 
 
-    tnx, tny, tnz = dynamics.tnflux3d(U, V, T, strm, grid.lon, grid.lat, grid.lev, grid.xdim, grid.ydim,
-                                      grid.zdim, cyclic=cyclic, limit=limit, punit=grid.punit)
+    metrics = grid.getmetrics()
+    if chunks is None and max_memory is None:
+        func = lambda U, V, T, strm: dynamics.tnflux3d(U, V, T, strm, grid.lon, grid.lat, grid.lev, grid.xdim,
+                                                       grid.ydim, grid.zdim, cyclic=cyclic, limit=limit,
+                                                       punit=grid.punit, metrics=metrics, workers=workers)
+        tnx, tny, tnz = func(U, V, T, strm)
+    else:
+        # 基本場から決まる項は一度だけ計算し、流線関数偏差をブロックごとに計算する
+        tn = dynamics.TNFlux3D(U, V, T, grid.lon, grid.lat, grid.lev, grid.xdim, grid.ydim, grid.zdim,
+                               cyclic=cyclic, limit=limit, punit=grid.punit, metrics=metrics, workers=workers)
+        tnx, tny, tnz = [np.ma.array(np.empty(strm.shape), mask=np.zeros(strm.shape, dtype=bool)) for i in range(3)]
+        for sl in grid.chunkslices(chunks=chunks, max_memory=max_memory, keep=['lev'], nbuffers=10):
+            for out, result in zip((tnx, tny, tnz), tn(strm[sl], sl)):
+                out[sl] = result
     tnx = McField(tnx, name='tnflux_x', grid=grid.copy(), mask=mask)
     tny = McField(tny, name='tnflux_y', grid=grid.copy(), mask=mask)
     tnz = McField(tnz, name='tnflux_z', grid=grid.copy(), mask=mask)
     return tnx, tny, tnz
 
-def absvrt(ufield, vfield, cyclic=True):
+def absvrt(ufield, vfield, cyclic=True, chunks=None, max_memory=None, workers=None):
     u"""
+    絶対渦度を計算する。
+
+    :Arguments:
+     **ufield, vfield** : McField object
+      東西風、南北風 [m/s]
+     **cyclic** : bool, optional
+      東西境界を周期境界で扱うか。デフォルトはTrue
+     **chunks** : dict, optional
+      次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+      事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+      1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+      **out** : McField object
+
+    .. seealso::
+    
+       .. autosummary::
+          :nosignatures:
+
+          pymet.dynamics.absvrt
     """
     if not isinstance(ufield, McField) or not isinstance(vfield, McField):
         raise TypeError, "input must be McField instance"
@@ -196,11 +340,151 @@ def absvrt(ufield, vfield, cyclic=True):
     vwnd = np.ma.getdata(vfield, subok=False)
     mask = np.ma.getmask(ufield) | np.ma.getmask(vfield)
 
-    result = dynamics.absvrt(uwnd, vwnd, grid.lon, grid.lat,
-                             grid.xdim, grid.ydim, cyclic=cyclic, sphere=grid.sphere)
+    metrics = grid.getmetrics()
+    func = lambda uwnd, vwnd: dynamics.absvrt(uwnd, vwnd, grid.lon, grid.lat,
+                                              grid.xdim, grid.ydim, cyclic=cyclic, sphere=grid.sphere,
+                                              metrics=metrics, workers=workers)
+    result = _chunkapply(func, (uwnd, vwnd), grid, chunks=chunks, max_memory=max_memory,
+                         nbuffers=6, useout=False)
 
     return McField(result, name='absvrt', grid=grid, mask=mask)
 
+# 結果のMcFieldの名前
+_diagnames = {'pv':'ertelpv', 'tnx':'tnflux_x', 'tny':'tnflux_y', 'tnz':'tnflux_z'}
+
+def epflux(ufield, vfield, tfield, wfield, chunks=None, max_memory=None):
+    u"""
+    Eliassen-Palmフラックスとその収束、TEMの残差循環を計算する。
+
+    :Arguments:
+     **ufield, vfield** : McField object
+      東西風、南北風 [m/s]
+     **tfield** : McField object
+      気温 [K]
+     **wfield** : McField object
+      鉛直p速度 [Pa/s]
+     **chunks** : dict, optional
+      分割する次元名(1つ)をキー、ブロックの長さを値とする辞書。例えば {'time':365} とすると
+      365時刻ずつ東西平均する。
+     **max_memory** : int, optional
+      1ブロックの計算に使うメモリの上限の目安 [byte]。経度、緯度、鉛直以外の最も外側の次元で
+      分割する。
+
+    :Returns:
+     **fy, fz, div, vstar, wstar** : McField object
+      東西平均した格子のデータ。EPフラックスの南北成分、鉛直成分、EPフラックス収束、
+      残差南北流、残差鉛直p速度。
+
+    **Examples**
+     >>> fy, fz, div, vstar, wstar = epflux(u, v, t, omega, chunks={'time':365})
+
+    .. seealso::
+
+       .. autosummary::
+          :nosignatures:
+
+          pymet.dynamics.epflux
+    """
+    fields = (ufield, vfield, tfield, wfield)
+    for field in fields:
+        if not isinstance(field, McField):
+            raise TypeError, "input must be McField instance"
+    grid = ufield.grid.copy()
+    if not 'lon' in grid.dims or not 'lat' in grid.dims or not 'lev' in grid.dims:
+        raise ValueError, "fields must have 'lon', 'lat' and 'lev' dimensions"
+    axis, chunk = 0, None
+    if chunks:
+        if len(chunks) != 1:
+            raise ValueError, "epflux can split along only one dimension"
+        (dimname, chunk), = chunks.items()
+        axis = grid.dims.index(dimname)
+    elif max_memory is not None:
+        outer = [i for i, dim in enumerate(grid.dims) if not dim in ('lon', 'lat', 'lev')]
+        if not outer:
+            max_memory = None
+        else:
+            axis = outer[0]
+    result = dynamics.epflux(*[np.ma.asarray(field) for field in fields] +
+                             [grid.lat, grid.lev, grid.xdim, grid.ydim, grid.zdim],
+                             punit=grid.punit, axis=axis, chunk=chunk, max_memory=max_memory)
+    grid.lon = None
+    names = ['epfy', 'epfz', 'epdiv', 'vstar', 'wstar']
+    return tuple(McField(r, name=name, grid=grid.copy()) for r, name in zip(result, names))
+
+def diagnostics(names, ufield=None, vfield=None, tfield=None, strmfield=None, cyclic=True, limit=100.,
+                chunks=None, max_memory=None, workers=None):
+    u"""
+    複数の診断量を、温位やその微分などの中間量を共有して計算する。
+
+    :Arguments:
+     **names** : sequence of str
+      計算する量の名前。'pv', 'absvrt', 'stability', 'tnx', 'tny', 'tnz', 'theta' など。
+      :py:class:`pymet.dynamics.DiagnosticsSession` を参照。
+     **ufield, vfield** : McField object, optional
+      東西風、南北風 [m/s]。TNフラックスでは気候値。
+     **tfield** : McField object, optional
+      気温 [K]。TNフラックスでは気候値。
+     **strmfield** : McField object, optional
+      流線関数偏差 [m^2/s]
+     **cyclic** : bool, optional
+      東西境界を周期境界で扱うか。デフォルトはTrue。
+     **limit** : float, optional
+      TNフラックスの水平成分の大きさの上限。デフォルトは100.。
+     **chunks** : dict, optional
+      次元名をキー、ブロックの長さを値とする辞書。鉛直方向には分割しない。
+     **max_memory** : int, optional
+      1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **result** : dict
+      namesの各要素をキーとするMcField objectの辞書。欠損値は与えた入力の欠損値の和。
+
+    **Examples**
+     >>> d = diagnostics(['pv', 'stability', 'tnx', 'tny', 'tnz'], ufield=u, vfield=v, tfield=t,
+                         strmfield=psi, chunks={'time':10})
+     >>> d['pv'], d['tnz']
+
+    .. seealso::
+
+       .. autosummary::
+          :nosignatures:
+
+          pymet.dynamics.DiagnosticsSession
+    """
+    names = list(names)
+    inputs = [(key, f) for key, f in zip(['u', 'v', 't', 'strm'], [ufield, vfield, tfield, strmfield])
+              if f is not None]
+    if not inputs:
+        raise ValueError, "at least one input field is required"
+    if not all(isinstance(f, McField) for key, f in inputs):
+        raise TypeError, "input must be McField instance"
+    keys = [key for key, f in inputs]
+    grid = inputs[0][1].grid.copy()
+    mask = np.ma.nomask
+    for key, f in inputs:
+        mask = mask | np.ma.getmask(f)
+
+    metrics = grid.getmetrics()
+    def func(*blocks):
+        session = dynamics.DiagnosticsSession(lon=grid.lon, lat=grid.lat, lev=grid.lev, xdim=grid.xdim,
+                                              ydim=grid.ydim, zdim=grid.zdim, cyclic=cyclic,
+                                              punit=grid.punit, limit=limit, metrics=metrics, workers=workers,
+                                              **dict(zip(keys, blocks)))
+        result = session.compute(*names)
+        return result[names[0]] if len(names) == 1 else tuple(result[name] for name in names)
+    keep = ['lev'] if 'lev' in grid.dims else []
+    values = _chunkapply(func, [np.ma.getdata(f, subok=False) for key, f in inputs], grid, chunks=chunks,
+                         max_memory=max_memory, keep=keep, nbuffers=22, nout=len(names), useout=False)
+    if len(names) == 1:
+        values = (values,)
+
+    result = {}
+    for name, value in zip(names, values):
+        result[name] = McField(value, name=_diagnames.get(name, name), grid=grid.copy(), mask=mask)
+    return result
+
 def rhmd(tfield, qvalfield, qtyp='q'):
     u"""
     """
@@ -2,12 +2,22 @@
 import pymet.grid
 import numpy as np
 from core import *
+from core import _chunkapply
 import pymet.tools as tools
 
 __all__ = ['dvardx', 'dvardy', 'dvardp', 'div', 'rot', 'd2vardx2', 'd2vardy2', 'grad', 'skgrad',
-           'vint', 'dvardt', 'vmean']
+           'kinematics', 'invlaplacian', 'helmholtz', 'vint', 'dvardt', 'vmean', 'vinterp']
 
-def dvardx(field, cyclic=True):
+def _maskfunc(func, field):
+    u"""
+    欠損値を考慮した差分を計算する関数func(var, mask, out)を、fieldがマスクをもたない場合は
+    maskを用いずに呼ぶようにする。
+    """
+    if np.ma.getmask(field) is np.ma.nomask:
+        return lambda var, mask, out: func(var, None, out)
+    return func
+
+def dvardx(field, cyclic=True, chunks=None, max_memory=None, workers=None, onesided=True):
     u"""
     経度方向の微分を中央差分で計算。
 
@@ -17,6 +27,16 @@ def dvardx(field, cyclic=True):
      **cyclic** : bool, optional
        東西の境界を周期境界として扱うかどうか。False の場合は周期境界を用いずに
        前方、後方差分で計算する。デフォルトは True。
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+     **onesided** : bool, optional
+       欠損値の扱い。Trueの場合は、片側の隣接点だけが欠損している点を片側差分で計算する。
+       Falseの場合は、隣接点のいずれかが欠損している点を欠損とする。デフォルトはTrue。
        
     :Returns:
      **result** : McField object
@@ -34,20 +54,35 @@ def dvardx(field, cyclic=True):
     data = np.ma.getdata(field, subok=False)
     mask = np.ma.getmaskarray(field)
 
-    result = pymet.grid.dvardx(data, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=True, sphere=grid.sphere)
+    metrics = grid.getmetrics()
+    func = lambda var, mask, out: pymet.grid.dvardx(var, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=cyclic,
+                                                    out=out, metrics=metrics, workers=workers,
+                                                    mask=mask, onesided=onesided)
+    result = _chunkapply(_maskfunc(func, field), (data, mask), grid, chunks=chunks, max_memory=max_memory,
+                         nbuffers=2)
     if np.size(result)<2:
         return result
 
     mask = mask | np.isnan(result)
     return McField(result, name=field.name, grid=grid, mask=mask)
 
-def dvardy(field):
+def dvardy(field, chunks=None, max_memory=None, workers=None, onesided=True):
     u"""
     緯度方向の微分を中央差分で計算。
 
     :Arguments:
      **field** : McField object
-
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+     **onesided** : bool, optional
+       欠損値の扱い。Trueの場合は、片側の隣接点だけが欠損している点を片側差分で計算する。
+       Falseの場合は、隣接点のいずれかが欠損している点を欠損とする。デフォルトはTrue。
+       
     :Returns:
      **result** : McField object
 
@@ -64,19 +99,33 @@ def dvardy(field):
     data = np.ma.getdata(field, subok=False)
     mask = np.ma.getmaskarray(field)
 
-    result = pymet.grid.dvardy(data, grid.lat, grid.ydim, sphere=grid.sphere)
+    metrics = grid.getmetrics()
+    func = lambda var, mask, out: pymet.grid.dvardy(var, grid.lat, grid.ydim, out=out, metrics=metrics,
+                                                    workers=workers, mask=mask, onesided=onesided)
+    result = _chunkapply(_maskfunc(func, field), (data, mask), grid, chunks=chunks, max_memory=max_memory,
+                         nbuffers=2)
     if np.size(result)<2:
         return result
 
     mask = mask | np.isnan(result)    
     return McField(result, name=field.name, grid=grid, mask=mask)
 
-def dvardp(field):
+def dvardp(field, chunks=None, max_memory=None, workers=None, onesided=True):
     u"""
     鉛直方向の微分をlog(p)の中央差分で計算。
 
     :Arguments:
      **field** : McField object
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+     **onesided** : bool, optional
+       欠損値の扱い。Trueの場合は、片側の隣接点だけが欠損している点を片側差分で計算する。
+       Falseの場合は、隣接点のいずれかが欠損している点を欠損とする。デフォルトはTrue。
        
     :Returns:
      **result** : McField object
@@ -92,14 +141,20 @@ def dvardp(field):
         raise TypeError, "field must be McField instance"
     grid = field.grid.copy()
     data = np.ma.getdata(field, subok=False)
-    mask = np.ma.getmask(field)
+    mask = np.ma.getmaskarray(field)
 
-    result = pymet.grid.dvardp(data, grid.lev, grid.zdim, grid.punit)
+    metrics = grid.getmetrics()
+    func = lambda var, mask, out: pymet.grid.dvardp(var, grid.lev, grid.zdim, out=out, metrics=metrics,
+                                                    workers=workers, mask=mask, onesided=onesided)
+    result = _chunkapply(_maskfunc(func, field), (data, mask), grid, chunks=chunks, max_memory=max_memory,
+                         keep=['lev'], nbuffers=2)
     if np.size(result) < 2:
         return result
+
+    mask = mask | np.isnan(result)
     return McField(result, name=field.name, grid=grid, mask=mask)
 
-def d2vardx2(field, cyclic=True):
+def d2vardx2(field, cyclic=True, chunks=None, max_memory=None, workers=None):
     u"""
     経度方向の2階微分を中央差分で計算。
 
@@ -109,6 +164,13 @@ def d2vardx2(field, cyclic=True):
      **cyclic** : bool, optional
        東西の境界を周期境界として扱うかどうか。False の場合は周期境界を用いずに
        前方、後方差分で計算する。デフォルトは True。
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
        
     :Returns:
      **result** : McField object
@@ -126,19 +188,29 @@ def d2vardx2(field, cyclic=True):
     data = np.ma.getdata(field, subok=False)
     mask = np.ma.getmask(field)
 
-    result = pymet.grid.d2vardx2(data, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=True)
+    metrics = grid.getmetrics()
+    func = lambda var, out: pymet.grid.d2vardx2(var, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=cyclic,
+                                                out=out, metrics=metrics, workers=workers)
+    result = _chunkapply(func, (data,), grid, chunks=chunks, max_memory=max_memory, nbuffers=2)
     if np.size(result) < 2:
         return result
 
     mask = mask | np.isnan(result)    
     return McField(result, name=field.name, grid=grid, mask=mask)
 
-def d2vardy2(field):
+def d2vardy2(field, chunks=None, max_memory=None, workers=None):
     u"""
     緯度方向の微分を中央差分で計算。
 
     :Arguments:
      **field** : McField object
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
        
     :Returns:
      **result** : McField object
@@ -156,14 +228,16 @@ def d2vardy2(field):
     data = np.ma.getdata(field, subok=False)
     mask = np.ma.getmask(field)
 
-    result = grid.d2vardy2(data, grid.lat, grid.ydim)
+    metrics = grid.getmetrics()
+    func = lambda var, out: pymet.grid.d2vardy2(var, grid.lat, grid.ydim, out=out, metrics=metrics, workers=workers)
+    result = _chunkapply(func, (data,), grid, chunks=chunks, max_memory=max_memory, nbuffers=2)
     if np.size(result) < 2:
         return result
 
     mask = mask | np.isnan(result)    
     return McField(result, name=field.name, grid=grid, mask=mask)
 
-def div(ufield, vfield, cyclic=True):
+def div(ufield, vfield, cyclic=True, chunks=None, max_memory=None, workers=None):
     u"""
     水平発散を計算する。
 
@@ -174,6 +248,13 @@ def div(ufield, vfield, cyclic=True):
      **cyclic** : bool, optional
        東西の境界を周期境界として扱うかどうか。False の場合は周期境界を用いずに
        前方、後方差分で計算する。デフォルトは True。
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
        
     :Returns:
      **result** : McField object
@@ -192,14 +273,17 @@ def div(ufield, vfield, cyclic=True):
     v = np.ma.getdata(vfield, subok=False)
     mask = np.ma.getmask(ufield) | np.ma.getmask(vfield)
 
-    result = pymet.grid.div(u, v, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=True, sphere=grid.sphere)
+    metrics = grid.getmetrics()
+    func = lambda u, v, out: pymet.grid.kinematics(u, v, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=cyclic,
+                                                   names='div', out={'div':out}, metrics=metrics, workers=workers)['div']
+    result = _chunkapply(func, (u, v), grid, chunks=chunks, max_memory=max_memory, nbuffers=5)
     if np.size(result) < 2:
         return result
 
     mask = mask | np.isnan(result)    
     return McField(result, name='div', grid=grid, mask=mask)
 
-def rot(ufield, vfield, cyclic=True):
+def rot(ufield, vfield, cyclic=True, chunks=None, max_memory=None, workers=None):
     u"""
     回転の鉛直成分を計算する。
 
@@ -209,6 +293,13 @@ def rot(ufield, vfield, cyclic=True):
      **cyclic** : bool, optional
        東西の境界を周期境界として扱うかどうか。False の場合は周期境界を用いずに
        前方、後方差分で計算する。デフォルトは True。
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
        
     :Returns:
      **result** : McField object
@@ -227,14 +318,83 @@ def rot(ufield, vfield, cyclic=True):
     v = np.ma.getdata(vfield, subok=False)
     mask = np.ma.getmask(ufield) | np.ma.getmask(vfield)
 
-    result = pymet.grid.rot(u, v, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=True, sphere=grid.sphere)
+    metrics = grid.getmetrics()
+    func = lambda u, v, out: pymet.grid.kinematics(u, v, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=cyclic,
+                                                   names='rot', out={'rot':out}, metrics=metrics, workers=workers)['rot']
+    result = _chunkapply(func, (u, v), grid, chunks=chunks, max_memory=max_memory, nbuffers=5)
     if np.size(result) < 2:
         return result
     
     mask = mask | np.isnan(result)
     return McField(result, name='rot', grid=grid, mask=mask)
 
-def grad(field, cyclic=True):
+def kinematics(ufield, vfield, cyclic=True, names=None, chunks=None, max_memory=None, workers=None):
+    u"""
+    発散、渦度、変形、速度勾配をまとめて計算する。
+
+    :Arguments:
+     **ufield, vfield** : McField object
+       ベクトルの東西、南北成分。
+     **cyclic** : bool, optional
+       東西の境界を周期境界として扱うかどうか。False の場合は周期境界を用いずに
+       前方、後方差分で計算する。デフォルトは True。
+     **names** : str or sequence of str, optional
+       計算する量の名前。'div', 'rot', 'stretch', 'shear', 'dudx', 'dudy', 'dvdx', 'dvdy' から選ぶ。
+       デフォルトはすべて。
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+       
+    :Returns:
+     **result** : dict
+       量の名前をキーとするMcField objectの辞書。
+
+    **Examples**
+     >>> kin = kinematics(ufield, vfield, names=['div', 'rot'])
+     >>> kin['div']
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+     
+        pymet.grid.kinematics
+    """
+    if not isinstance(ufield, McField) or not isinstance(vfield, McField):
+        raise TypeError, "input must be McField instance"
+    grid = ufield.grid.copy()
+    u = np.ma.getdata(ufield, subok=False)
+    v = np.ma.getdata(vfield, subok=False)
+    mask = np.ma.getmask(ufield) | np.ma.getmask(vfield)
+
+    if names is None:
+        names = pymet.grid._KINEMATICS
+    elif isinstance(names, basestring):
+        names = (names,)
+    metrics = grid.getmetrics()
+    nout = len(names)
+    def func(u, v, out):
+        if nout == 1:
+            out = (out,)
+        kin = pymet.grid.kinematics(u, v, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=cyclic,
+                                    names=names, out=dict(zip(names, out or ())), metrics=metrics, workers=workers)
+        values = tuple(kin[name] for name in names)
+        return values[0] if nout == 1 else values
+    values = _chunkapply(func, (u, v), grid, chunks=chunks, max_memory=max_memory,
+                         nbuffers=nout+6, nout=nout)
+    if nout == 1:
+        values = (values,)
+    result = dict(zip(names, values))
+    for name, value in result.items():
+        result[name] = McField(value, name=name, grid=grid.copy(), mask=mask | np.isnan(value))
+
+    return result
+
+def grad(field, cyclic=True, chunks=None, max_memory=None, workers=None):
     u"""
     水平勾配を計算する。
 
@@ -245,6 +405,13 @@ def grad(field, cyclic=True):
      **cyclic** : bool, optional
        東西の境界を周期境界として扱うかどうか。False の場合は周期境界を用いずに
        前方、後方差分で計算する。デフォルトは True。
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
        
     :Returns:
      **resultu, resultv** : McField object
@@ -263,7 +430,10 @@ def grad(field, cyclic=True):
     data = np.ma.getdata(field, subok=False)    
     mask = np.ma.getmask(field)
 
-    resultu, resultv = pymet.grid.grad(data, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=True, sphere=grid.sphere)
+    metrics = grid.getmetrics()
+    func = lambda var, out: pymet.grid.grad(var, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=cyclic,
+                                            out=out, metrics=metrics, workers=workers)
+    resultu, resultv = _chunkapply(func, (data,), grid, chunks=chunks, max_memory=max_memory, nbuffers=3, nout=2)
     if np.size(resultu) < 2:
         return resultu, resultv
 
@@ -271,7 +441,7 @@ def grad(field, cyclic=True):
         
     return McField(resultu, name='gradu', grid=grid, mask=mask), McField(resultv, name='gradv', grid=grid, mask=mask)
 
-def skgrad(field, cyclic=True):
+def skgrad(field, cyclic=True, chunks=None, max_memory=None, workers=None):
     u"""
     skew-gradientを計算する。
 
@@ -282,6 +452,13 @@ def skgrad(field, cyclic=True):
      **cyclic** : bool, optional
        東西の境界を周期境界として扱うかどうか。False の場合は周期境界を用いずに
        前方、後方差分で計算する。デフォルトは True。
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
        
     :Returns:
      **resultu, resultv** : McField object
@@ -300,7 +477,10 @@ def skgrad(field, cyclic=True):
     data = np.ma.getdata(field, subok=False)    
     mask = np.ma.getmask(field)
 
-    resultu, resultv = pymet.grid.skgrad(data, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=True, sphere=grid.sphere)
+    metrics = grid.getmetrics()
+    func = lambda var, out: pymet.grid.skgrad(var, grid.lon, grid.lat, grid.xdim, grid.ydim, cyclic=cyclic,
+                                              out=out, metrics=metrics, workers=workers)
+    resultu, resultv = _chunkapply(func, (data,), grid, chunks=chunks, max_memory=max_memory, nbuffers=3, nout=2)
     if np.size(resultu) < 2:
         return resultu, resultv
 
@@ -308,7 +488,101 @@ def skgrad(field, cyclic=True):
      
     return McField(resultu, name='gradu', grid=grid, mask=mask), McField(resultv, name='gradv', grid=grid, mask=mask)
 
-def vint(field, bottom, top):
+def invlaplacian(field, chunks=None, max_memory=None, workers=None):
+    u"""
+    球面上の2次元ラプラシアンの逆演算を計算する。
+
+    :Arguments:
+     **field** : McField object
+      スカラー場。経度は等間隔で全球を覆い、欠損値を含まないこと。
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **result** : McField object
+
+    **Examples**
+     >>> strm = invlaplacian(rot(ufield, vfield))
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.grid.invlaplacian
+    """
+    if not isinstance(field, McField):
+        raise TypeError, "input must be McField instance"
+    if np.ma.getmask(field).any():
+        raise ValueError, "invlaplacian cannot handle masked values"
+    grid = field.grid.copy()
+    data = np.ma.getdata(field, subok=False)
+
+    metrics = grid.getmetrics()
+    func = lambda var, out: pymet.grid.invlaplacian(var, grid.lon, grid.lat, grid.xdim, grid.ydim,
+                                                    out=out, metrics=metrics, workers=workers)
+    result = _chunkapply(func, (data,), grid, chunks=chunks, max_memory=max_memory, nbuffers=3)
+
+    return McField(result, name=field.name, grid=grid)
+
+def helmholtz(ufield, vfield, chunks=None, max_memory=None, workers=None):
+    u"""
+    水平風をヘルムホルツ分解し、流線関数、速度ポテンシャル、回転風、発散風を計算する。
+
+    :Arguments:
+     **ufield, vfield** : McField object
+       ベクトルの東西、南北成分。経度は等間隔で全球を覆い、欠損値を含まないこと。
+     **chunks** : dict, optional
+       次元名をキー、ブロックの長さを値とする辞書。例えば {'time':10} とすると10時刻ずつ計算し、
+       事前に確保した配列に書き込む。
+     **max_memory** : int, optional
+       1ブロックの計算に使うメモリの上限の目安 [byte]。:py:meth:`McGrid.chunkslices` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **result** : dict
+       'strm', 'vpot', 'urot', 'vrot', 'udiv', 'vdiv' をキーとするMcField objectの辞書。
+
+    **Examples**
+     >>> hel = helmholtz(ufield, vfield, chunks={'time':100})
+     >>> fx, fy = tnflux2d(ufield, vfield, hel['strm'])
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.grid.helmholtz
+    """
+    if not isinstance(ufield, McField) or not isinstance(vfield, McField):
+        raise TypeError, "input must be McField instance"
+    if np.ma.getmask(ufield).any() or np.ma.getmask(vfield).any():
+        raise ValueError, "helmholtz cannot handle masked values"
+    grid = ufield.grid.copy()
+    u = np.ma.getdata(ufield, subok=False)
+    v = np.ma.getdata(vfield, subok=False)
+
+    names = pymet.grid._HELMHOLTZ
+    metrics = grid.getmetrics()
+    def func(u, v, out):
+        hel = pymet.grid.helmholtz(u, v, grid.lon, grid.lat, grid.xdim, grid.ydim,
+                                   out=dict(zip(names, out or ())), metrics=metrics, workers=workers)
+        return tuple(hel[name] for name in names)
+    values = _chunkapply(func, (u, v), grid, chunks=chunks, max_memory=max_memory,
+                         nbuffers=len(names)+6, nout=len(names))
+    result = {}
+    for name, value in zip(names, values):
+        result[name] = McField(value, name=name, grid=grid.copy())
+
+    return result
+
+def vint(field, bottom, top, ps=None):
     u"""
     質量重み付き鉛直積分。
 
@@ -319,9 +593,22 @@ def vint(field, bottom, top):
       下端
      **top** : float
       上端
+     **ps** : McField object or array_like, optional
+      地表気圧 [grid.punit*Pa]。fieldから鉛直次元を除いた形状(もしくはそれに
+      ブロードキャストできる形状)。与えた場合は地表面より下の層を除いて積分する。
 
     :Returns:
      **result** : McField object     
+
+    **Examples**
+     >>> pw = vint(qfield, 1000., 300., ps=psfield)
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.grid.vint
     """
     if not isinstance(field, McField):
         raise TypeError, "input must be McField instance"
@@ -330,7 +617,10 @@ def vint(field, bottom, top):
 #    var = np.ma.getdata(field, subok=False)
 #    mask = np.ma.getmask(field)
 
-    result = pymet.grid.vint(var, bottom, top, lev=grid.lev, zdim=grid.zdim, punit=grid.punit)
+    if ps is not None:
+        ps = np.ma.getdata(ps, subok=False)
+    result = pymet.grid.vint(var, bottom, top, lev=grid.lev, zdim=grid.zdim, punit=grid.punit,
+                              ps=ps)
 
     if np.size(result) < 2:
         return result
@@ -338,7 +628,7 @@ def vint(field, bottom, top):
     grid.lev = None
     return McField(result, name=grid.name, grid=grid)
 
-def vmean(field, bottom, top):
+def vmean(field, bottom, top, ps=None):
     u"""
     質量重み付き鉛直平均。
 
@@ -349,16 +639,32 @@ def vmean(field, bottom, top):
       下端
      **top** : float
       上端
+     **ps** : McField object or array_like, optional
+      地表気圧 [grid.punit*Pa]。fieldから鉛直次元を除いた形状(もしくはそれに
+      ブロードキャストできる形状)。与えた場合は地表面より下の層を除いて平均する。
 
     :Returns:
      **result** : McField object     
+
+    **Examples**
+     >>> pw = vmean(qfield, 1000., 300., ps=psfield)
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.grid.vmean
     """
     if not isinstance(field, McField):
         raise TypeError, "input must be McField instance"
     var = np.ma.asarray(field)
     grid = field.grid.copy()
 
-    result = pymet.grid.vmean(var, bottom, top, lev=grid.lev, zdim=grid.zdim, punit=grid.punit)
+    if ps is not None:
+        ps = np.ma.getdata(ps, subok=False)
+    result = pymet.grid.vmean(var, bottom, top, lev=grid.lev, zdim=grid.zdim, punit=grid.punit,
+                              ps=ps)
 
     if np.size(result) < 2:
         return result
@@ -366,6 +672,49 @@ def vmean(field, bottom, top):
     grid.lev = None
     return McField(result, name=grid.name, grid=grid)
 
+def vinterp(field, newz, logintrp=True, extrapolate='error'):
+    u"""
+    指定した鉛直レベルへの線形内挿。
+
+    :Argument:
+     **field** : McField object
+      入力データ。マスクされた値は、それを用いて内挿したレベルでマスクされる。
+     **newz** : float or array_like
+      内挿するレベル。
+     **logintrp** : bool, optional
+      log(z)で線形内挿するかどうか。デフォルトはTrue
+     **extrapolate** : {'error', 'nan', 'constant', 'linear'}, optional
+      元のレベルの範囲外のレベルの扱い。:py:class:`pymet.grid.VerticalInterpolator` を参照。
+
+    :Returns:
+     **result** : McField object
+      newzが1つの場合は鉛直次元をもたない。
+
+    **Examples**
+     >>> t500 = vinterp(tfield, 500.)
+     >>> tlow = vinterp(tfield, [975., 875.], extrapolate='linear')
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.grid.vinterp
+        pymet.grid.VerticalInterpolator
+    """
+    if not isinstance(field, McField):
+        raise TypeError, "input must be McField instance"
+    grid = field.grid.copy()
+    zdim = grid.zdim
+
+    result = pymet.grid.vinterp(np.ma.asarray(field), grid.lev, newz, zdim,
+                                logintrp=logintrp, extrapolate=extrapolate)
+    result = np.ma.masked_invalid(result, copy=False)
+    if np.size(newz) == 1:
+        result = result.reshape(result.shape[:zdim] + result.shape[zdim+1:])
+    grid.lev = newz
+    return McField(result, name=field.name, grid=grid)
+
 def dvardt(field, bound='mask'):
     grid = field.grid.copy()
     var = np.ma.getdata(field, subok=False)
@@ -0,0 +1,52 @@
+# coding: utf-8
+import pymet.regrid
+import numpy as np
+from core import *
+
+__all__ = ['regrid']
+
+def regrid(field, grid, method='bilinear', extrapolate=False, cachedir=None):
+    u"""
+    McFieldを別の緯度経度格子に変換する。
+
+    :Arguments:
+     **field** : McField object
+      入力データ。緯度、経度の次元をもつこと。
+     **grid** : McGrid object
+      変換先の格子。lon、latのみを用い、その他の次元はfieldの格子のものを引き継ぐ。
+     **method** : {'bilinear', 'nearest', 'conservative'}, optional
+      変換の方法。デフォルトは'bilinear'。
+     **extrapolate** : bool, optional
+      'bilinear'で入力格子の範囲外の点を端の値とするかどうか。デフォルトはFalse。
+     **cachedir** : str, optional
+      重みを保存するディレクトリ。:py:func:`pymet.regrid.getregridder` を参照。
+
+    :Returns:
+     **result** : McField object
+      入力格子の範囲外の格子点や、欠損値のみから計算される格子点は欠損となる。
+
+    **Examples**
+     >>> grid25 = McGrid(lon=np.arange(0, 360, 2.5), lat=np.arange(-90, 90.1, 2.5))
+     >>> t25 = regrid(t, grid25, method='conservative')
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.regrid.regrid
+        pymet.regrid.Regridder
+    """
+    if not isinstance(field, McField):
+        raise TypeError, "input must be McField instance"
+    if not isinstance(grid, McGrid):
+        raise TypeError, "grid must be McGrid instance"
+    ingrid = field.grid
+    if ingrid.dims[-2:] != ['lat', 'lon'] or grid.dims[-2:] != ['lat', 'lon']:
+        raise ValueError, "both grids must have 'lat' and 'lon' dimensions"
+    regridder = pymet.regrid.getregridder(ingrid.lon, ingrid.lat, grid.lon, grid.lat, method=method,
+                                          extrapolate=extrapolate, cachedir=cachedir)
+    result = regridder(np.ma.asarray(field))
+    outgrid = ingrid.copy()
+    outgrid.lon, outgrid.lat = grid.lon, grid.lat
+    return McField(result, name=field.name, grid=outgrid)
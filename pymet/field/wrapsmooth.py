@@ -0,0 +1,129 @@
+# coding: utf-8
+import pymet.smooth
+import numpy as np
+from core import *
+
+__all__ = ['smooth', 'gaussfilter', 'zonaltrunc', 'lanczos2d']
+
+def _check(field):
+    if not isinstance(field, McField):
+        raise TypeError, "input must be McField instance"
+    grid = field.grid
+    if not 'lon' in grid.dims or not 'lat' in grid.dims:
+        raise ValueError, "field must have 'lat' and 'lon' dimensions"
+    return grid.copy()
+
+def smooth(field, npoint=9, weight=0.25, niter=1, cyclic=True):
+    u"""
+    n点平滑化。
+
+    :Arguments:
+     **field** : McField object
+
+     **npoint** : {9, 5}, optional
+      9点平滑化もしくは5点平滑化。デフォルトは9。
+     **weight** : float, optional
+      1方向の隣接点にかける重み。デフォルトは0.25。
+     **niter** : int, optional
+      繰り返しの回数。デフォルトは1。
+     **cyclic** : bool, optional
+      東西の境界を周期境界として扱うかどうか。デフォルトはTrue。
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.smooth.smooth
+    """
+    grid = _check(field)
+    result = pymet.smooth.smooth(np.ma.asarray(field), grid.xdim, grid.ydim, npoint=npoint, weight=weight,
+                                 niter=niter, cyclic=cyclic)
+    return McField(result, name=field.name, grid=grid)
+
+def gaussfilter(field, sigma, cyclic=True, truncate=4.):
+    u"""
+    ガウシアンフィルタ。経度方向の幅は緯度によって変える。
+
+    :Arguments:
+     **field** : McField object
+      緯度経度格子(曲線座標格子でない)のデータ。
+     **sigma** : float
+      ガウス関数の標準偏差 [m]
+     **cyclic** : bool, optional
+      東西の境界を周期境界として扱うかどうか。デフォルトはTrue。
+     **truncate** : float, optional
+      重みを打ち切る距離(sigmaの倍数)。デフォルトは4.。
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.smooth.gaussfilter
+    """
+    grid = _check(field)
+    result = pymet.smooth.gaussfilter(np.ma.asarray(field), grid.lon, grid.lat, grid.xdim, grid.ydim, sigma,
+                                      cyclic=cyclic, truncate=truncate)
+    return McField(result, name=field.name, grid=grid)
+
+def zonaltrunc(field, kmax, kmin=0):
+    u"""
+    東西波数kmin以上kmax以下の成分を取り出す。
+
+    :Arguments:
+     **field** : McField object
+      経度方向に全球を覆うデータ。欠損値を含まないこと。
+     **kmax** : int
+      残す最大の東西波数
+     **kmin** : int, optional
+      残す最小の東西波数。デフォルトは0。
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.smooth.zonaltrunc
+    """
+    grid = _check(field)
+    result = pymet.smooth.zonaltrunc(np.ma.asarray(field), grid.xdim, kmax, kmin=kmin)
+    return McField(result, name=field.name, grid=grid)
+
+def lanczos2d(field, cutoff, length=None, cyclic=True):
+    u"""
+    分離型の2次元Lanczos低周波フィルタ。
+
+    :Arguments:
+     **field** : McField object
+
+     **cutoff** : float or tuple
+      カットオフ波長(格子点数)。(経度方向, 緯度方向)のタプルでもよい。
+     **length** : int or tuple, optional
+      重みの項数(奇数)。デフォルトは 2*cutoff+1 。
+     **cyclic** : bool, optional
+      東西の境界を周期境界として扱うかどうか。デフォルトはTrue。
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.smooth.lanczos2d
+    """
+    grid = _check(field)
+    result = pymet.smooth.lanczos2d(np.ma.asarray(field), grid.xdim, grid.ydim, cutoff, length=length,
+                                    cyclic=cyclic)
+    return McField(result, name=field.name, grid=grid)
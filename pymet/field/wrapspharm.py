@@ -0,0 +1,173 @@
+# coding: utf-8
+import pymet.spharm
+import numpy as np
+from core import *
+
+__all__ = ['spdiv', 'sprot', 'spgrad', 'splaplacian', 'spinvlaplacian', 'sptrunc']
+
+def _getdata(field):
+    u"""
+    欠損値を含まないMcFieldからndarrayを取り出す。
+    """
+    if not isinstance(field, McField):
+        raise TypeError, "input must be McField instance"
+    if np.ma.getmask(field).any():
+        raise ValueError, "spectral transform cannot handle masked values"
+    return np.ma.getdata(field, subok=False)
+
+def spdiv(ufield, vfield, ntrunc=None):
+    u"""
+    水平発散を球面調和関数展開で計算する。
+
+    :Arguments:
+     **ufield, vfield** : McField object
+      ベクトルの東西、南北成分。全球のデータで、欠損値を含まないこと。
+     **ntrunc** : int, optional
+      三角切断の波数。:py:class:`pymet.spharm.Spharmt` を参照。
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.spharm.div
+        div
+    """
+    u, v = _getdata(ufield), _getdata(vfield)
+    grid = ufield.grid.copy()
+    result = pymet.spharm.div(u, v, grid.lon, grid.lat, grid.xdim, grid.ydim, ntrunc=ntrunc)
+    return McField(result, name='div', grid=grid)
+
+def sprot(ufield, vfield, ntrunc=None):
+    u"""
+    回転の鉛直成分(相対渦度)を球面調和関数展開で計算する。
+
+    :Arguments:
+     **ufield, vfield** : McField object
+      ベクトルの東西、南北成分。全球のデータで、欠損値を含まないこと。
+     **ntrunc** : int, optional
+      三角切断の波数。:py:class:`pymet.spharm.Spharmt` を参照。
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.spharm.rot
+        rot
+    """
+    u, v = _getdata(ufield), _getdata(vfield)
+    grid = ufield.grid.copy()
+    result = pymet.spharm.rot(u, v, grid.lon, grid.lat, grid.xdim, grid.ydim, ntrunc=ntrunc)
+    return McField(result, name='rot', grid=grid)
+
+def spgrad(field, ntrunc=None):
+    u"""
+    水平勾配を球面調和関数展開で計算する。
+
+    :Arguments:
+     **field** : McField object
+      スカラー場。全球のデータで、欠損値を含まないこと。
+     **ntrunc** : int, optional
+      三角切断の波数。:py:class:`pymet.spharm.Spharmt` を参照。
+
+    :Returns:
+     **resultu, resultv** : McField object
+     勾配ベクトルのx,y成分
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.spharm.grad
+        grad
+    """
+    data = _getdata(field)
+    grid = field.grid.copy()
+    resultu, resultv = pymet.spharm.grad(data, grid.lon, grid.lat, grid.xdim, grid.ydim, ntrunc=ntrunc)
+    return McField(resultu, name='gradu', grid=grid), McField(resultv, name='gradv', grid=grid)
+
+def splaplacian(field, ntrunc=None):
+    u"""
+    球面上の2次元ラプラシアンを球面調和関数展開で計算する。
+
+    :Arguments:
+     **field** : McField object
+      スカラー場。全球のデータで、欠損値を含まないこと。
+     **ntrunc** : int, optional
+      三角切断の波数。:py:class:`pymet.spharm.Spharmt` を参照。
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.spharm.laplacian
+    """
+    data = _getdata(field)
+    grid = field.grid.copy()
+    result = pymet.spharm.laplacian(data, grid.lon, grid.lat, grid.xdim, grid.ydim, ntrunc=ntrunc)
+    return McField(result, name=field.name, grid=grid)
+
+def spinvlaplacian(field, ntrunc=None):
+    u"""
+    球面上の2次元ラプラシアンの逆演算を球面調和関数展開で計算する。
+
+    :Arguments:
+     **field** : McField object
+      スカラー場。全球のデータで、欠損値を含まないこと。
+     **ntrunc** : int, optional
+      三角切断の波数。:py:class:`pymet.spharm.Spharmt` を参照。
+
+    :Returns:
+     **result** : McField object
+
+    **Examples**
+     >>> strm = spinvlaplacian(sprot(u, v))
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.spharm.invlaplacian
+    """
+    data = _getdata(field)
+    grid = field.grid.copy()
+    result = pymet.spharm.invlaplacian(data, grid.lon, grid.lat, grid.xdim, grid.ydim, ntrunc=ntrunc)
+    return McField(result, name=field.name, grid=grid)
+
+def sptrunc(field, ntrunc):
+    u"""
+    全波数ntruncで三角切断した場を返す。
+
+    :Arguments:
+     **field** : McField object
+      全球のデータで、欠損値を含まないこと。
+     **ntrunc** : int
+      三角切断の波数。
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.spharm.truncate
+    """
+    data = _getdata(field)
+    grid = field.grid.copy()
+    result = pymet.spharm.truncate(data, grid.lon, grid.lat, grid.xdim, grid.ydim, ntrunc)
+    return McField(result, name=field.name, grid=grid)
@@ -0,0 +1,149 @@
+# coding: utf-8
+#--------------------------------------------------------
+# -- thermoへのラッパー
+#--------------------------------------------------------
+import pymet.thermo as thermo
+import pymet.tools as tools
+import numpy as np
+from core import *
+
+__all__ = ['eptemp', 'lcl', 'parcel', 'cape']
+
+def _check(tfield, qfield):
+    for field in (tfield, qfield):
+        if not isinstance(field, McField):
+            raise TypeError, "input must be McField instance"
+    grid = tfield.grid
+    if not 'lev' in grid.dims:
+        raise ValueError, "field must have 'lev' dimension"
+    if np.shape(tfield) != np.shape(qfield):
+        raise ValueError, "tfield and qfield must have the same shape"
+    return grid.copy()
+
+def eptemp(tfield, qfield):
+    u"""
+    相当温位を気温と比湿から計算する。
+
+    :Arguments:
+     **tfield** : McField object
+      気温 [K]
+     **qfield** : McField object
+      比湿 [kg/kg]
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+       .. autosummary::
+          :nosignatures:
+
+          pymet.thermo.eptemp
+    """
+    grid = _check(tfield, qfield)
+    result = thermo.eptemp(np.ma.asarray(tfield), np.ma.asarray(qfield), grid.lev, grid.zdim, punit=grid.punit)
+    return McField(result, name='theta_e', grid=grid)
+
+def lcl(tfield, qfield):
+    u"""
+    各格子点の気塊の持ち上げ凝結高度(LCL)の温度と気圧を計算する。
+
+    :Arguments:
+     **tfield** : McField object
+      気温 [K]
+     **qfield** : McField object
+      比湿 [kg/kg]
+
+    :Returns:
+     **tlcl, plcl** : McField object
+      LCLの温度 [K] と気圧 [punit*Pa]
+
+    .. seealso::
+
+       .. autosummary::
+          :nosignatures:
+
+          pymet.thermo.lcl
+    """
+    grid = _check(tfield, qfield)
+    t, q = np.ma.asarray(tfield), np.ma.asarray(qfield)
+    mask = np.ma.getmask(t) | np.ma.getmask(q)
+    pres = tools.expand(np.asarray(grid.lev, dtype=np.float64), t.ndim, axis=grid.zdim)*grid.punit
+    tl, pl = thermo.lcl(np.ma.getdata(t), np.ma.getdata(q), pres)
+    return (McField(tl, name='tlcl', grid=grid.copy(), mask=mask),
+            McField(pl/grid.punit, name='plcl', grid=grid.copy(), mask=mask))
+
+def parcel(tfield, qfield, start='surface', depth=30000., chunk=32768, workers=None):
+    u"""
+    気塊を偽断熱的に持ち上げたときの各層の温度を計算する。
+
+    :Arguments:
+     **tfield** : McField object
+      気温 [K]。地面より下の層はマスクしておく。
+     **qfield** : McField object
+      比湿 [kg/kg]
+     **start** : {'surface', 'mostunstable'}, optional
+      持ち上げ始める層。デフォルトは'surface'。
+     **depth** : float, optional
+      start='mostunstable'で持ち上げ始める層を探す厚さ [Pa]。デフォルトは300hPa。
+     **chunk** : int, optional
+      一度に計算する鉛直柱の数。デフォルトは32768。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **result** : McField object
+
+    .. seealso::
+
+       .. autosummary::
+          :nosignatures:
+
+          pymet.thermo.parcel
+    """
+    grid = _check(tfield, qfield)
+    result = thermo.parcel(np.ma.asarray(tfield), np.ma.asarray(qfield), grid.lev, grid.zdim, punit=grid.punit,
+                           start=start, depth=depth, chunk=chunk, workers=workers)
+    return McField(result, name='tparcel', grid=grid)
+
+def cape(tfield, qfield, start='surface', depth=30000., virtual=True, chunk=32768, workers=None):
+    u"""
+    対流有効位置エネルギー(CAPE)と対流抑制(CIN)を計算する。
+
+    :Arguments:
+     **tfield** : McField object
+      気温 [K]。地面より下の層はマスクしておく。
+     **qfield** : McField object
+      比湿 [kg/kg]
+     **start** : {'surface', 'mostunstable'}, optional
+      持ち上げ始める層。デフォルトは'surface'。
+     **depth** : float, optional
+      start='mostunstable'で持ち上げ始める層を探す厚さ [Pa]。デフォルトは300hPa。
+     **virtual** : bool, optional
+      浮力を仮温度で計算するかどうか。デフォルトはTrue。
+     **chunk** : int, optional
+      一度に計算する鉛直柱の数。デフォルトは32768。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **cape, cin** : McField object
+      鉛直次元を除いた格子のデータ [J/kg]
+
+    **Examples**
+     >>> cape, cin = cape(tfield, qfield, start='mostunstable')
+
+    .. seealso::
+
+       .. autosummary::
+          :nosignatures:
+
+          pymet.thermo.cape
+    """
+    grid = _check(tfield, qfield)
+    capev, cinv = thermo.cape(np.ma.asarray(tfield), np.ma.asarray(qfield), grid.lev, grid.zdim,
+                              punit=grid.punit, start=start, depth=depth, virtual=virtual, chunk=chunk,
+                              workers=workers)
+    grid.lev = None
+    return (McField(capev, name='cape', grid=grid.copy()),
+            McField(cinv, name='cin', grid=grid.copy()))
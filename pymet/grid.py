@@ -19,6 +19,15 @@ u"""
    grad
    skgrad
    laplacian
+   kinematics
+
+ヘルムホルツ分解
+================
+
+.. autosummary::
+
+   invlaplacian
+   helmholtz
 
 積分
 ====
@@ -33,20 +42,33 @@ u"""
 .. autosummary::
 
    vinterp
+   VerticalInterpolator
+   ColumnInterpolator
 
 その他
 ======
 
 .. autosummary::
    distance
+   SphereIndex
+   getsphereindex
+
+計量因子
+========
+
+.. autosummary::
+
+   GridMetrics
+   getmetrics
    
 -----------------------   
 """
 
 import numpy as np
+import collections
+import threading
+from scipy.spatial import cKDTree
 import constants as constants
-import scipy.interpolate
-import _internal
 import tools
 
 NA=np.newaxis
@@ -56,13 +78,536 @@ PI = constants.pi
 d2r=PI/180.
 
 __all__ = ['dvardx', 'dvardy', 'dvardp', 'd2vardx2', 'd2vardy2', 'div', 'rot', 'grad', 'skgrad', 'laplacian', #'dvardvar',
+           'kinematics', 'invlaplacian', 'helmholtz',
            'vint', 'vmean',
-           'vinterp',
-           'distance']
+           'vinterp', 'VerticalInterpolator', 'ColumnInterpolator',
+           'distance', 'SphereIndex', 'getsphereindex',
+           'GridMetrics', 'getmetrics']
+
+#=== 差分ステンシル ================================================================================
+#
+# 微分の各関数は、軸の入れ替え(rollaxis)や配列の結合(concatenate)をせずに、
+# 指定した軸に沿ったスライスの差を出力配列に直接書き込み、最後に格子間隔で割る。
+
+def _axslice(ndim, axis, sl):
+    u"""
+    axis番目の次元だけをスライスslで切り出すためのインデックスを返す。
+    """
+    idx = [slice(None)]*ndim
+    idx[axis] = sl
+    return tuple(idx)
+
+def _getout(out, var, dtype=None):
+    u"""
+    結果を書き込む配列を返す。outが指定されていない場合は新たに確保する。
+    """
+    if dtype is None:
+        dtype = np.result_type(var.dtype, np.float64)
+    if out is None:
+        return np.empty(var.shape, dtype=dtype)
+    if np.shape(out) != var.shape:
+        raise ValueError, "out must have the same shape as input array {0}, not {1}".format(var.shape, np.shape(out))
+    if np.may_share_memory(out, var):
+        raise ValueError, "out must not share memory with input array"
+    return out
+
+def _diff(var, axis, out, cyclic=False):
+    u"""
+    axisに沿った中央差分 var[i+1] - var[i-1] をoutに書き込む。
+
+    両端は、cyclic=Trueの場合は周期境界で、Falseの場合は前方、後方差分で計算する。
+    """
+    ndim = var.ndim
+    s = lambda start, stop: _axslice(ndim, axis, slice(start, stop))
+    np.subtract(var[s(2,None)], var[s(None,-2)], out=out[s(1,-1)])
+    if cyclic:
+        np.subtract(var[s(1,2)], var[s(-1,None)], out=out[s(0,1)])
+        np.subtract(var[s(0,1)], var[s(-2,-1)], out=out[s(-1,None)])
+    else:
+        np.subtract(var[s(1,2)], var[s(0,1)], out=out[s(0,1)])
+        np.subtract(var[s(-1,None)], var[s(-2,-1)], out=out[s(-1,None)])
+    return out
+
+def _diff2(var, axis, out, cyclic=False):
+    u"""
+    axisに沿った2階中央差分 var[i+1] - 2*var[i] + var[i-1] をoutに書き込む。
+
+    両端は、cyclic=Trueの場合は周期境界で、Falseの場合はゼロとする。
+    """
+    ndim = var.ndim
+    s = lambda start, stop: _axslice(ndim, axis, slice(start, stop))
+    def stencil(center, plus, minus):
+        work = out[center]
+        np.multiply(var[center], 2., out=work)
+        np.subtract(var[plus], work, out=work)
+        work += var[minus]
+
+    stencil(s(1,-1), s(2,None), s(None,-2))
+    if cyclic:
+        stencil(s(0,1), s(1,2), s(-1,None))
+        stencil(s(-1,None), s(0,1), s(-2,-1))
+    else:
+        out[s(0,1)] = 0.
+        out[s(-1,None)] = 0.
+    return out
+
+def _spacing(x, cyclic=False, period=360.):
+    u"""
+    中央差分の分母となる格子間隔 x[i+1] - x[i-1] を返す。両端の扱いは :py:func:`_diff` に準ずる。
+    """
+    x = np.asarray(x)
+    if cyclic:
+        return np.r_[(x[1]+period-x[-1]), (x[2:]-x[:-2]), (x[0]+period-x[-2])]
+    else:
+        return np.r_[(x[1]-x[0]), (x[2:]-x[:-2]), (x[-1]-x[-2])]
+
+def _onesided(x, cyclic=False, period=360.):
+    u"""
+    中央差分の格子間隔に対する前方、後方差分の格子間隔の比 (rf, rb) を返す。
+
+    rf[i] = (x[i+1] - x[i])/(x[i+1] - x[i-1]), rb[i] = (x[i] - x[i-1])/(x[i+1] - x[i-1])。
+    cyclic=Falseの場合、両端は :py:func:`_diff` ですでに片側差分なので1とする。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if cyclic:
+        xp = np.r_[x[1:], x[0]+period]
+        xm = np.r_[x[-1]-period, x[:-1]]
+    else:
+        xp = np.r_[x[1:], x[-1]]
+        xm = np.r_[x[0], x[:-1]]
+    dx = xp - xm
+    rf, rb = (xp - x)/dx, (x - xm)/dx
+    if not cyclic:
+        rf[[0,-1]] = 1.
+        rb[[0,-1]] = 1.
+    return rf, rb
+
+def _maskdiff(var, mask, axis, out, x, cyclic=False, onesided=True, period=360.):
+    u"""
+    :py:func:`_diff` で計算した中央差分outを、欠損値(maskがTrueの点)を使わないように補正する。
+
+    隣接点の有無はbool配列をずらして判定する。onesided=Trueの場合、片側の隣接点だけが
+    欠損している点は残りの側の片側差分に置き換え(格子間隔で割ったときに片側差分となるように
+    :py:func:`_onesided` の比で割っておく)、両側とも欠損している点をNaNとする。
+    onesided=Falseの場合は、隣接点のいずれかが欠損している点をNaNとする。
+    欠損値の点もNaNとなる。片側差分の計算は該当する点だけに対して行う。
+    """
+    ndim = var.ndim
+    n = var.shape[axis]
+    s = lambda start, stop: _axslice(ndim, axis, slice(start, stop))
+    mask = np.broadcast_to(np.asarray(mask, dtype=bool), var.shape)
+    if not mask.any():
+        return out
+    # mp, mm : i+1, i-1 番目の点が欠損しているかどうか
+    mp = np.empty(var.shape, dtype=bool)
+    mm = np.empty(var.shape, dtype=bool)
+    mp[s(None,-1)] = mask[s(1,None)]
+    mm[s(1,None)] = mask[s(None,-1)]
+    if cyclic:
+        mp[s(-1,None)] = mask[s(0,1)]
+        mm[s(0,1)] = mask[s(-1,None)]
+    else:
+        # 両端は片側差分なので、存在する側の隣接点だけで判定する
+        mm[s(0,1)] = mp[s(0,1)]
+        mp[s(-1,None)] = mm[s(-1,None)]
+
+    # 大きな一時配列の確保はそれ自体が遅いので、作業用の配列workを使い回す
+    work = np.empty(var.shape, dtype=bool)
+    if onesided:
+        np.logical_and(mp, mm, out=work)
+    else:
+        np.logical_or(mp, mm, out=work)
+    work |= mask
+    np.copyto(out, np.nan, where=work)
+    if not onesided:
+        return out
+
+    rf, rb = _onesided(x, cyclic=cyclic, period=period)
+    # 前方差分は i-1 番目だけ、後方差分は i+1 番目だけが欠損している点
+    for shift, (other, miss), ratio in ((1, (mp, mm), rf), (-1, (mm, mp), rb)):
+        np.logical_or(other, mask, out=work)
+        np.invert(work, out=work)
+        work &= miss
+        # N次元のnp.nonzeroより1次元のflatnonzeroの方がはるかに速い
+        flat = np.flatnonzero(work)
+        if flat.size == 0:
+            continue
+        idx = np.unravel_index(flat, var.shape)
+        nidx = list(idx)
+        nidx[axis] = (idx[axis] + shift) % n
+        nidx = tuple(nidx)
+        if shift > 0:
+            out[idx] = (var[nidx] - var[idx])/ratio[idx[axis]]
+        else:
+            out[idx] = (var[idx] - var[nidx])/ratio[idx[axis]]
+    return out
+
+def _curvdiff(var, metrics, northward, out, cyclic=False, mask=None, onesided=True):
+    u"""
+    曲線座標格子での東向き(northward=False)、北向き(northward=True)の微分をoutに書き込む。
+
+    添字方向の中央差分を :py:meth:`GridMetrics.curvfactor` の係数で組み合わせる。maskを与えた
+    場合は、添字方向の差分をそれぞれ :py:func:`_maskdiff` で補正する。
+    """
+    xi, xj, yi, yj = metrics.curvfactor(cyclic)
+    ci, cj = (yi, yj) if northward else (xi, xj)
+    xdim, ydim = metrics.xdim, metrics.ydim
+    nx, ny = var.shape[xdim], var.shape[ydim]
+    work = np.empty_like(out)
+    _diff(var, xdim, out, cyclic=cyclic)
+    _diff(var, ydim, work)
+    if mask is not None:
+        _maskdiff(var, mask, xdim, out, np.arange(nx), cyclic=cyclic, onesided=onesided, period=nx)
+        _maskdiff(var, mask, ydim, work, np.arange(ny), onesided=onesided)
+    out *= ci
+    work *= cj
+    out += work
+    return out
+
+#=== スレッド並列 ==================================================================================
+#
+# 微分を取らない次元(時間、アンサンブル、鉛直など)に沿って配列を分け、各部分を
+# tools.threadmapで並列に計算して、結果を出力配列の対応する部分に直接書き込む。
+
+def _useworkers(workers):
+    u"""
+    スレッド並列で計算するかどうかを返す。
+    """
+    workers = tools.get_num_threads() if workers is None else workers
+    return workers > 1 and not tools._inthread()
+
+def _sliceout(out, sl):
+    u"""
+    出力(ndarray, そのタプル, もしくは辞書)の部分配列を返す。
+    """
+    if out is None:
+        return None
+    elif isinstance(out, tuple):
+        return tuple(o[sl] for o in out)
+    elif isinstance(out, dict):
+        return dict((name, o[sl]) for name, o in out.items())
+    else:
+        return out[sl]
+
+def _threadapply(func, arrays, skip, out=None, workers=None, masked=False, nout=1):
+    u"""
+    skip以外の最も長い軸でarraysを分割し、funcを各部分に対してスレッドで並列に呼ぶ。
+
+    outを与えた場合は func(*blocks, out=outの部分配列) の形で呼び、outを返す。outがNoneの
+    場合はfuncの返り値を事前に確保した配列(maskedがTrueならMaskedArray)に書き込んで返す。
+    noutが2以上の場合、funcは配列のタプルを返すものとする。
+    分割できる軸がない場合はそのままfuncを呼ぶ。
+    """
+    workers = tools.get_num_threads() if workers is None else workers
+    shape = arrays[0].shape
+    ndim = len(shape)
+    skip = [ax % ndim for ax in skip]
+    axes = [ax for ax in range(ndim) if not ax in skip and shape[ax] > 1]
+    if workers <= 1 or not axes:
+        return func(*arrays) if out is None else func(*arrays, out=out)
+    axis = max(axes, key=lambda ax: shape[ax])
+    n = -(-shape[axis] // workers)
+    slices = tools.chunkslices(shape, [axis], chunks={axis:n})
+
+    if out is not None:
+        tools.threadmap(lambda sl: func(*[a[sl] for a in arrays], out=_sliceout(out, sl)), slices, workers)
+        return out
+
+    dtype = np.result_type(arrays[0].dtype, np.float64)
+    if masked:
+        results = [np.ma.array(np.empty(shape, dtype=dtype), mask=np.zeros(shape, dtype=bool)) for i in range(nout)]
+    else:
+        results = [np.empty(shape, dtype=dtype) for i in range(nout)]
+    def run(sl):
+        res = func(*[a[sl] for a in arrays])
+        if nout == 1:
+            res = (res,)
+        for r, rblock in zip(results, res):
+            r[sl] = rblock
+    tools.threadmap(run, slices, workers)
+    return results[0] if nout == 1 else tuple(results)
+
+#=== 格子の計量因子 ================================================================================
+
+class GridMetrics(object):
+    ur"""
+    微分計算に用いる格子の計量因子を保持するクラス。
+
+    cos(lat)、tan(lat)、格子間隔、log(p)差分の因子、コリオリパラメータを、入力配列の次元数に
+    合わせてブロードキャストできる形状で保持する。各因子は最初に参照されたときに計算され、
+    以降は計算済みのものを返す。
+
+    lon, latに同じ形状の2次元配列(緯度次元、経度次元の順)を与えると、回転極座標や
+    ランベルト図法などの曲線座標格子として扱う。この場合の経度、緯度次元は格子の添字の次元で、
+    x、y微分は添字方向の差分から :py:meth:`curvfactor` の係数(ヤコビ行列の逆行列)を用いて
+    東向き、北向きの微分に変換する。曲線座標格子で計算できるのは1階微分と、それを用いる
+    :py:func:`dvardx` 、 :py:func:`dvardy` 、 :py:func:`div` 、 :py:func:`rot` 、 :py:func:`grad` 、
+    :py:func:`skgrad` 、 :py:func:`kinematics` である。ベクトルの成分は東西、南北方向の成分
+    (格子に対する成分ではない)として与える。
+
+    通常は :py:func:`getmetrics` もしくは :py:meth:`pymet.field.McGrid.getmetrics` から取得する。
+
+    :Arguments:
+     **ndim** : int
+      計算に用いるデータ配列の次元数。
+     **lon, lat, lev** : array_like, optional
+      経度、緯度、等圧面の気圧。lon, latは1次元の座標軸、もしくは同じ形状の2次元配列。
+     **xdim, ydim, zdim** : int, optional
+      経度、緯度、鉛直次元のインデックス。
+     **sphere** : bool, optional
+      球面緯度経度座標かどうか。デフォルトはTrue。
+     **punit** : float, optional
+      levをPaに換算するための定数。デフォルトは100.。
+
+    **Attributes**
+
+    ============= =====================================================
+    curvilinear   曲線座標格子(lon, latが2次元)かどうか
+    coslat        :math:`\cos\phi`
+    tanlat        :math:`\tan\phi`
+    f             コリオリパラメータ
+    dyfactor      :py:func:`dvardy` の分母
+    dy2factor     :py:func:`d2vardy2` の分母
+    dpfactor      :py:func:`dvardp` の分母
+    ============= =====================================================
+
+    **Methods**
+
+    .. autosummary::
+
+       GridMetrics.dxfactor
+       GridMetrics.dx2factor
+       GridMetrics.curvfactor
+       GridMetrics.poissonsolver
+
+    **Examples**
+     >>> metrics = getmetrics(4, lon=lon, lat=lat, lev=lev, xdim=3, ydim=2, zdim=1)
+     >>> dudx = dvardx(u, lon, lat, 3, 2, metrics=metrics)
+     >>> vor  = rot(u, v, lon, lat, 3, 2, metrics=metrics)
+    """
+    def __init__(self, ndim, lon=None, lat=None, lev=None, xdim=None, ydim=None, zdim=None,
+                 sphere=True, punit=100.):
+        self.ndim = ndim
+        self.lon = None if lon is None else np.asarray(lon)
+        self.lat = None if lat is None else np.asarray(lat)
+        self.lev = None if lev is None else np.asarray(lev)
+        self.xdim, self.ydim, self.zdim = xdim, ydim, zdim
+        self.sphere = sphere
+        self.punit = punit
+        self.curvilinear = np.ndim(lon) == 2 or np.ndim(lat) == 2
+        if self.curvilinear:
+            if np.shape(lon) != np.shape(lat):
+                raise ValueError, "2-D lon and lat must have the same shape"
+            if xdim is None or ydim is None:
+                raise ValueError, "xdim and ydim are required for 2-D lon and lat"
+        self._factors = {}
+
+    def _factor(self, key, func):
+        u"""
+        keyに対応する因子を返す。計算されていなければfuncで計算して保持する。
+        """
+        if not key in self._factors:
+            self._factors[key] = func()
+        return self._factors[key]
+
+    def _expand(self, a, axis):
+        return tools.expand(a, self.ndim, axis)
+
+    def _expand2(self, a):
+        u"""
+        (緯度次元, 経度次元)の2次元配列を、ydim、xdim以外の長さが1の形状にする。
+        """
+        ydim, xdim = self.ydim % self.ndim, self.xdim % self.ndim
+        if ydim > xdim:
+            a = a.T
+        shape = [1]*self.ndim
+        shape[ydim], shape[xdim] = a.shape if ydim < xdim else a.shape[::-1]
+        return np.reshape(a, shape)
+
+    def _expandlat(self, a):
+        if self.curvilinear:
+            return self._expand2(a)
+        return self._expand(a, self.ydim)
+
+    def _rectilinear(self, name):
+        u"""
+        曲線座標格子では計算できない因子を要求された場合にエラーとする。
+        """
+        if self.curvilinear:
+            raise ValueError, "{0} is not supported on curvilinear (2-D lon/lat) grids".format(name)
+
+    def check(self, ndim):
+        u"""
+        データ配列の次元数と一致するかを確認する。
+        """
+        if ndim != self.ndim:
+            raise ValueError, "GridMetrics is built for {0}-dimensional arrays, not {1}".format(self.ndim, ndim)
+
+    @property
+    def coslat(self):
+        return self._factor('coslat', lambda: self._expandlat(np.cos(self.lat*d2r)))
+
+    @property
+    def tanlat(self):
+        return self._factor('tanlat', lambda: self._expandlat(np.tan(self.lat*d2r)))
+
+    @property
+    def f(self):
+        return self._factor('f', lambda: self._expandlat(constants.earth_f(self.lat)))
+
+    def dxfactor(self, cyclic=True):
+        u"""
+        :py:func:`dvardx` の分母 :math:`a\cos\phi_{j}(\lambda_{i+1} - \lambda_{i-1})` を返す。
+        """
+        self._rectilinear('dxfactor')
+        cyclic = cyclic and self.sphere
+        def func():
+            dx = _spacing(self.lon, cyclic=cyclic)
+            if self.sphere:
+                return a0*PI/180.*self._expand(dx,self.xdim) * self.coslat
+            else:
+                return self._expand(dx,self.xdim)
+        return self._factor(('dx', cyclic), func)
+
+    def dx2factor(self, cyclic=True):
+        u"""
+        :py:func:`d2vardx2` の分母 :math:`a^2\cos^2\phi_{j}(\lambda_{i+1} - \lambda_{i-1})^2` を返す。
+        """
+        self._rectilinear('d2vardx2')
+        cyclic = cyclic and self.sphere
+        def func():
+            dx = _spacing(self.lon, cyclic=cyclic)
+            if self.sphere:
+                return a0**2 * (PI/180.)**2 * self._expand(dx**2,self.xdim) * self._expand(np.cos(self.lat*d2r)**2,self.ydim)
+            else:
+                return self._expand(dx**2,self.xdim)
+        return self._factor(('dx2', cyclic), func)
+
+    @property
+    def dyfactor(self):
+        self._rectilinear('dyfactor')
+        def func():
+            dy = _spacing(self.lat)
+            if self.sphere:
+                dy = a0*PI/180.*dy
+            return self._expand(dy,self.ydim)
+        return self._factor('dy', func)
+
+    @property
+    def dy2factor(self):
+        self._rectilinear('d2vardy2')
+        def func():
+            dy = _spacing(self.lat)
+            if self.sphere:
+                return self._expand(a0**2 * (PI/180.)**2 * dy**2,self.ydim)
+            else:
+                return self._expand(dy**2,self.ydim)
+        return self._factor('dy2', func)
+
+    @property
+    def dpfactor(self):
+        def func():
+            lev = self.lev * self.punit
+            dp  = np.r_[ np.log(lev[1]/lev[0])*lev[0] ,\
+                         np.log(lev[2:]/lev[:-2])*lev[1:-1],\
+                         np.log(lev[-1]/lev[-2])*lev[-1] ]
+            return self._expand(dp,self.zdim)
+        return self._factor('dp', func)
+
+    def curvfactor(self, cyclic=False):
+        ur"""
+        曲線座標格子で添字方向の差分を東向き、北向きの微分に変換する係数を返す。
+
+        添字i(経度次元)、j(緯度次元)方向の中央差分を :math:`\delta_i, \delta_j` とすると、
+
+        .. math:: \begin{pmatrix} \delta_i\Phi \\ \delta_j\Phi \end{pmatrix}
+                  = \begin{pmatrix} \delta_i x & \delta_i y \\ \delta_j x & \delta_j y \end{pmatrix}
+                    \begin{pmatrix} \partial\Phi/\partial x \\ \partial\Phi/\partial y \end{pmatrix}
+
+        であり、ここで :math:`\delta x = a\cos\phi\,\delta\lambda,\ \delta y = a\,\delta\phi` 。
+        この行列の逆行列の成分を返す。
+
+        :Returns:
+         **xi, xj, yi, yj** : ndarray
+           :math:`\partial\Phi/\partial x = x_i\delta_i\Phi + x_j\delta_j\Phi`,
+           :math:`\partial\Phi/\partial y = y_i\delta_i\Phi + y_j\delta_j\Phi` となる係数。
+        """
+        if not self.curvilinear:
+            raise ValueError, "curvfactor is only defined for curvilinear (2-D lon/lat) grids"
+        cyclic = cyclic and self.sphere
+        def func():
+            lon = np.asarray(self.lon, dtype=np.float64)
+            lat = np.asarray(self.lat, dtype=np.float64)
+            dlon_i = _diff(lon, 1, np.empty_like(lon), cyclic=cyclic)
+            dlon_j = _diff(lon, 0, np.empty_like(lon))
+            dlat_i = _diff(lat, 1, np.empty_like(lat), cyclic=cyclic)
+            dlat_j = _diff(lat, 0, np.empty_like(lat))
+            if self.sphere:
+                # 経度の差は日付変更線をまたいでも -180～180 度に収める
+                scale = a0*d2r
+                dx_i = scale*np.cos(lat*d2r)*((dlon_i + 180.) % 360. - 180.)
+                dx_j = scale*np.cos(lat*d2r)*((dlon_j + 180.) % 360. - 180.)
+                dy_i = scale*dlat_i
+                dy_j = scale*dlat_j
+            else:
+                dx_i, dx_j, dy_i, dy_j = dlon_i, dlon_j, dlat_i, dlat_j
+            det = dx_i*dy_j - dy_i*dx_j
+            return tuple(self._expand2(c) for c in (dy_j/det, -dy_i/det, -dx_j/det, dx_i/det))
+        return self._factor(('curv', cyclic), func)
+
+    def poissonsolver(self):
+        u"""
+        :py:func:`invlaplacian` 、 :py:func:`helmholtz` で用いる、緯度方向の三重対角行列の分解を返す。
+        """
+        self._rectilinear('poissonsolver')
+        return self._factor('poisson', lambda: _PoissonSolver(self.lon, self.lat))
+
+_metrics_cache = collections.OrderedDict()
+_metrics_lock = threading.Lock()
+_METRICS_CACHESIZE = 16
+
+def _arraykey(a):
+    u"""
+    座標の値からキャッシュのキーを作る。
+    """
+    if a is None:
+        return None
+    a = np.asarray(a)
+    return (a.dtype.str, a.shape, a.tobytes())
+
+def getmetrics(ndim, lon=None, lat=None, lev=None, xdim=None, ydim=None, zdim=None, sphere=True, punit=100.):
+    u"""
+    格子の計量因子 :py:class:`GridMetrics` を返す。
+
+    座標の値と次元のインデックスが同じであれば、計算済みのものを再利用する。最近使われた16個の
+    格子を保持する。
+
+    :Arguments:
+     引数は :py:class:`GridMetrics` と同じ。
+
+    :Returns:
+     **metrics** : GridMetrics
+
+    **Examples**
+     >>> metrics = getmetrics(4, lon=lon, lat=lat, lev=lev, xdim=3, ydim=2, zdim=1)
+     >>> metrics is getmetrics(4, lon=lon, lat=lat, lev=lev, xdim=3, ydim=2, zdim=1)
+     True
+    """
+    key = (ndim, xdim, ydim, zdim, sphere, punit, _arraykey(lon), _arraykey(lat), _arraykey(lev))
+    with _metrics_lock:
+        metrics = _metrics_cache.pop(key, None)
+        if metrics is None:
+            metrics = GridMetrics(ndim, lon=lon, lat=lat, lev=lev, xdim=xdim, ydim=ydim, zdim=zdim,
+                                  sphere=sphere, punit=punit)
+            if len(_metrics_cache) >= _METRICS_CACHESIZE:
+                _metrics_cache.popitem(last=False)
+        _metrics_cache[key] = metrics
+    return metrics
 
 #=== 微分と差分 ====================================================================================
 
-def dvardx(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
+def dvardx(var, lon, lat, xdim, ydim, cyclic=True, sphere=True, out=None, metrics=None, workers=None,
+           mask=None, onesided=True):
     ur"""
     経度方向のx微分を中央差分で計算。
 
@@ -73,6 +618,7 @@ def dvardx(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        経度, もしくはx座標
      **lat** : array_like
        緯度, もしくはy座標
+       lon, latは、曲線座標格子の場合は同じ形状の2次元配列。 :py:class:`GridMetrics` を参照。
      **xdim, ydim**: int
        入力配列の経度、緯度次元のインデックス
      **cyclic** : bool, optional
@@ -80,6 +626,18 @@ def dvardx(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        で計算する。デフォルトは True。
      **sphere** : bool, optional
        球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。
+     **out** : ndarray, optional
+       結果を書き込む配列。varと同じ形状でなければならない。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+     **mask** : ndarray of bool, optional
+       欠損値の位置(Trueが欠損)。varと同じ形状(もしくはそれにブロードキャストできる形状)。
+       与えた場合は欠損値を差分に用いず、結果を計算できない点をNaNとする。
+     **onesided** : bool, optional
+       maskを与えた場合に、片側の隣接点だけが欠損している点を片側差分で計算するかどうか。
+       Falseの場合はそのような点をNaNとする。デフォルトはTrue。
        
     :Returns:
      **result** : ndarray
@@ -129,36 +687,30 @@ def dvardx(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
      >>> result.shape
      (24, 73, 72)
     """ 
-    var = np.array(var)
-    ndim = var.ndim
-    var = np.rollaxis(var,xdim,ndim)
-    if cyclic and sphere:
-        dvar = np.concatenate(\
-                    ((var[...,1]-var[...,-1])[...,NA],\
-                    (var[...,2:]-var[...,:-2]),\
-                    (var[...,0]-var[...,-2])[...,NA]), axis=-1)
-        dx   = np.r_[(lon[1]+360-lon[-1]),\
-                    (lon[2:]-lon[:-2]   ),\
-                    (lon[0]+360-lon[-2] )]
-    else:
-        dvar = np.concatenate(\
-                    ((var[...,1]-var[...,0])[...,NA],\
-                    (var[...,2:]-var[...,:-2]),\
-                    (var[...,-1]-var[...,-2])[...,NA]), axis=-1)
-        dx   = np.r_[(lon[1]-lon[0] ),\
-                    (lon[2:]-lon[:-2]   ),\
-                    (lon[-1]-lon[-2])]
-                    
-    dvar = np.rollaxis(dvar,ndim-1,xdim)
-    if sphere:
-        dx = a0*PI/180.*tools.expand(dx,ndim,xdim) * tools.expand(np.cos(lat*d2r),ndim,ydim)
-    else:
-        dx = tools.expand(dx,ndim,xdim)
-    out = dvar/dx
-    
+    var = np.asarray(var)
+    out = _getout(out, var)
+    if metrics is None:
+        metrics = getmetrics(var.ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim, sphere=sphere)
+    metrics.check(var.ndim)
+    if _useworkers(workers):
+        if mask is None:
+            func = lambda var, out: dvardx(var, lon, lat, xdim, ydim, cyclic=cyclic, out=out, metrics=metrics, workers=1)
+            return _threadapply(func, (var,), (xdim, ydim), out=out, workers=workers)
+        func = lambda var, mask, out: dvardx(var, lon, lat, xdim, ydim, cyclic=cyclic, out=out, metrics=metrics,
+                                             workers=1, mask=mask, onesided=onesided)
+        return _threadapply(func, (var, np.broadcast_to(mask, var.shape)), (xdim, ydim), out=out, workers=workers)
+
+    cyclic = cyclic and metrics.sphere
+    if metrics.curvilinear:
+        return _curvdiff(var, metrics, False, out, cyclic=cyclic, mask=mask, onesided=onesided)
+    _diff(var, xdim, out, cyclic=cyclic)
+    if mask is not None:
+        _maskdiff(var, mask, xdim, out, lon, cyclic=cyclic, onesided=onesided)
+    out /= metrics.dxfactor(cyclic)
+
     return out
 
-def dvardy(var, lat, ydim, sphere=True):
+def dvardy(var, lat, ydim, sphere=True, out=None, metrics=None, workers=None, mask=None, onesided=True):
     ur"""
     緯度方向のy微分を中央差分で計算。南北端は前方、後方差分
 
@@ -167,10 +719,23 @@ def dvardy(var, lat, ydim, sphere=True):
        微分を計算する領域の格子点の値
      **lat** : array_like
        緯度、もしくはy座標
+       曲線座標格子の場合は2次元配列で、lonとxdimを与えたmetricsが必要。 :py:class:`GridMetrics` を参照。
      **ydim**: int
        緯度次元のインデックス。len(var.shape[ydim]) == len(lat)でなければならない。       
      **sphere** : bool, optional
        球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。
+     **out** : ndarray, optional
+       結果を書き込む配列。varと同じ形状でなければならない。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+     **mask** : ndarray of bool, optional
+       欠損値の位置(Trueが欠損)。varと同じ形状(もしくはそれにブロードキャストできる形状)。
+       与えた場合は欠損値を差分に用いず、結果を計算できない点をNaNとする。
+     **onesided** : bool, optional
+       maskを与えた場合に、片側の隣接点だけが欠損している点を片側差分で計算するかどうか。
+       Falseの場合はそのような点をNaNとする。デフォルトはTrue。
 
     :Returns:
      **result** : ndarray
@@ -204,26 +769,32 @@ def dvardy(var, lat, ydim, sphere=True):
      >>> result.shape
      (24, 73, 144)
     """ 
-    var = np.array(var)
-    ndim = var.ndim
-    var = np.rollaxis(var,ydim,ndim)
-
-    dvar = np.concatenate(\
-              [(var[...,1] -var[...,0]  )[...,NA],\
-               (var[...,2:]-var[...,:-2]),\
-               (var[...,-1]-var[...,-2] )[...,NA]], axis=-1) 
-    dy   = np.r_[(lat[1]-lat[0]),\
-                 (lat[2:]-lat[:-2]),\
-                 (lat[-1]-lat[-2])]
-
-    if sphere:
-        dy = a0*PI/180.*dy
-    out = dvar/dy
-    out = np.rollaxis(out,ndim-1,ydim)
+    var = np.asarray(var)
+    out = _getout(out, var)
+    if metrics is None:
+        if np.ndim(lat) == 2:
+            raise ValueError, "dvardy on a curvilinear grid needs metrics built with lon and xdim"
+        metrics = getmetrics(var.ndim, lat=lat, ydim=ydim, sphere=sphere)
+    metrics.check(var.ndim)
+    if _useworkers(workers):
+        skip = (metrics.xdim, ydim) if metrics.curvilinear else (ydim,)
+        if mask is None:
+            func = lambda var, out: dvardy(var, lat, ydim, out=out, metrics=metrics, workers=1)
+            return _threadapply(func, (var,), skip, out=out, workers=workers)
+        func = lambda var, mask, out: dvardy(var, lat, ydim, out=out, metrics=metrics, workers=1,
+                                             mask=mask, onesided=onesided)
+        return _threadapply(func, (var, np.broadcast_to(mask, var.shape)), skip, out=out, workers=workers)
+
+    if metrics.curvilinear:
+        return _curvdiff(var, metrics, True, out, mask=mask, onesided=onesided)
+    _diff(var, ydim, out)
+    if mask is not None:
+        _maskdiff(var, mask, ydim, out, lat, onesided=onesided)
+    out /= metrics.dyfactor
 
     return out
 
-def dvardp(var, lev, zdim, punit=100.):
+def dvardp(var, lev, zdim, punit=100., out=None, metrics=None, workers=None, mask=None, onesided=True):
     ur"""
     鉛直方向の微分をlog(p)の中央差分で計算。上下端は前方、後方差分
 
@@ -236,6 +807,18 @@ def dvardp(var, lev, zdim, punit=100.):
        鉛直次元のインデックス。len(var.shape[zdim]) == len(lev)でなければならない。
      **punit** : float, optional
        圧力座標の単位(Pa)。デフォルトは100、すなわちhPaとして扱う。
+     **out** : ndarray, optional
+       結果を書き込む配列。varと同じ形状でなければならない。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+     **mask** : ndarray of bool, optional
+       欠損値の位置(Trueが欠損)。varと同じ形状(もしくはそれにブロードキャストできる形状)。
+       与えた場合は欠損値を差分に用いず、結果を計算できない点をNaNとする。
+     **onesided** : bool, optional
+       maskを与えた場合に、片側の隣接点だけが欠損している点を片側差分で計算するかどうか。
+       Falseの場合はそのような点をNaNとする。デフォルトはTrue。
 
        
     :Returns:
@@ -266,28 +849,29 @@ def dvardp(var, lev, zdim, punit=100.):
      >>>
      >>>
     """ 
-    var = np.array(var)
-    ndim = var.ndim
-    lev = lev * punit
-    #roll lat dim axis to last
-    var = np.rollaxis(var,zdim,ndim)
-    dvar = np.concatenate(\
-              [ (var[...,1] -var[...,0]  )[...,NA],\
-                (var[...,2:]-var[...,:-2]),\
-                (var[...,-1]-var[...,-2] )[...,NA] ], axis=-1) 
-    dp   = np.r_[ np.log(lev[1]/lev[0])*lev[0] ,\
-                  np.log(lev[2:]/lev[:-2])*lev[1:-1],\
-                  np.log(lev[-1]/lev[-2])*lev[-1] ]
-    
-    out = dvar/dp
-    #reroll lat dim axis to original dim
-    out = np.rollaxis(out,ndim-1,zdim)
+    var = np.asarray(var)
+    out = _getout(out, var)
+    if metrics is None:
+        metrics = getmetrics(var.ndim, lev=lev, zdim=zdim, punit=punit)
+    metrics.check(var.ndim)
+    if _useworkers(workers):
+        if mask is None:
+            func = lambda var, out: dvardp(var, lev, zdim, out=out, metrics=metrics, workers=1)
+            return _threadapply(func, (var,), (zdim,), out=out, workers=workers)
+        func = lambda var, mask, out: dvardp(var, lev, zdim, out=out, metrics=metrics, workers=1,
+                                             mask=mask, onesided=onesided)
+        return _threadapply(func, (var, np.broadcast_to(mask, var.shape)), (zdim,), out=out, workers=workers)
+
+    _diff(var, zdim, out)
+    if mask is not None:
+        _maskdiff(var, mask, zdim, out, np.log(lev), onesided=onesided)
+    out /= metrics.dpfactor
 
     return out
 
 # not compleate----------------------------------------------------------------------------------------------------
 
-def d2vardx2(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
+def d2vardx2(var, lon, lat, xdim, ydim, cyclic=True, sphere=True, out=None, metrics=None, workers=None):
     ur"""
     経度方向の2階x微分を中央差分で計算。
 
@@ -304,6 +888,12 @@ def d2vardx2(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        経度方向にはサイクリックとするかどうか。デフォルトではTrue。Falseの場合は東西端はゼロとする。
      **sphere** : bool, optional
        球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。    
+     **out** : ndarray, optional
+       結果を書き込む配列。varと同じ形状でなければならない。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
 
     :Returns:
      **result** : ndarray
@@ -325,43 +915,22 @@ def d2vardx2(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
      >>>
      >>>
     """ 
-    var = np.array(var)
-    ndim = var.ndim
-
-    #roll lon dim axis to last
-    var = np.rollaxis(var,xdim,ndim)
-
-    if cyclic and sphere:
-        dvar = np.concatenate(\
-               ((var[...,1]-2*var[...,0]+var[...,-1])[...,NA],\
-                (var[...,2:]-2*var[...,1:-1]+var[...,:-2]),\
-                (var[...,0]-2*var[...,-1]+var[...,-2])[...,NA]),\
-                axis=-1)
-        dx   = np.r_[(lon[1]+360-lon[-1]),\
-                    (lon[2:]-lon[:-2]   ),\
-                    (lon[0]+360-lon[-2] )]
-    else: #edge is zero
-        dvar = np.concatenate(\
-               ((var[...,0]-var[...,0])[...,NA],\
-                (var[...,2:]-2*var[...,1:-1]+var[...,:-2]),\
-                (var[...,0]-var[...,0])[...,NA]),\
-                axis=-1)
-        dx   = np.r_[(lon[1]-lon[0] ),\
-                    (lon[2:]-lon[:-2]   ),\
-                    (lon[-1]-lon[-2])]
-
-    dvar = np.rollaxis(dvar,ndim-1,xdim)
-    if sphere:
-        dx2   = a0**2 * (PI/180.)**2 * tools.expand(dx**2,ndim,xdim) * tools.expand(np.cos(lat*d2r)**2,ndim,ydim)
-    else:
-        dx2   = tools.expand(dx**2,ndim,xdim)
-    out = 4.*dvar/dx2
-    #reroll lon dim axis to original dim
-    out = np.rollaxis(out,ndim-1,xdim)
+    var = np.asarray(var)
+    out = _getout(out, var)
+    if metrics is None:
+        metrics = getmetrics(var.ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim, sphere=sphere)
+    metrics.check(var.ndim)
+    if _useworkers(workers):
+        func = lambda var, out: d2vardx2(var, lon, lat, xdim, ydim, cyclic=cyclic, out=out, metrics=metrics, workers=1)
+        return _threadapply(func, (var,), (xdim, ydim), out=out, workers=workers)
+
+    _diff2(var, xdim, out, cyclic=cyclic and metrics.sphere) #edge is zero if not cyclic
+    out *= 4.
+    out /= metrics.dx2factor(cyclic)
 
     return out
 
-def d2vardy2(var, lat, ydim, sphere=True):
+def d2vardy2(var, lat, ydim, sphere=True, out=None, metrics=None, workers=None):
     ur"""
     緯度方向の2階微分を中央差分で計算。南北端はゼロとする。
 
@@ -376,6 +945,12 @@ def d2vardy2(var, lat, ydim, sphere=True):
        緯度次元のインデックス。len(var.shape[ydim]) == len(lat)でなければならない。
      **sphere** : bool, optional
        球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。
+     **out** : ndarray, optional
+       結果を書き込む配列。varと同じ形状でなければならない。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
        
     :Returns:
      **result** : ndarray
@@ -389,7 +964,7 @@ def d2vardy2(var, lat, ydim, sphere=True):
        ここで、aは地球半径。これを中央差分で次のように計算する。
        
        .. math:: \left( \frac{\partial^2 \Phi}{\partial y^2} \right)_{i,j}
-                  = \frac{4}{a^2}\frac{\Phi_{i,j+1} - 2\Phi_{i,j} + \Phi_{i,j-1}}{\lambda_{j+1} - \lambda_{j-1}}
+                  = \frac{4}{a^2}\frac{\Phi_{i,j+1} - 2\Phi_{i,j} + \Phi_{i,j-1}}{(\phi_{j+1} - \phi_{j-1})^2}
 
        cyclic=Falseの場合は、両端はゼロとする。
        
@@ -397,32 +972,22 @@ def d2vardy2(var, lat, ydim, sphere=True):
      >>>
      >>>
     """ 
-    var = np.array(var)
-    ndim = var.ndim
-
-    #roll lat dim axis to last
-    var = np.rollaxis(var,ydim,ndim)
-
-    #edge is zero
-    dvar = np.concatenate(\
-              [(var[...,0] -var[...,0]  )[...,NA],\
-               (var[...,2:]-2*var[...,1:-1]+var[...,:-2]),\
-               (var[...,0]-var[...,0] )[...,NA]], axis=-1) 
-    dy   = np.r_[(lat[1]-lat[0]),\
-                 (lat[2:]-lat[:-2]),\
-                 (lat[-1]-lat[-2])]
-
-    if sphere:
-        dy2 = a0**2 * dy**2
-    else:
-        dy2 = dy**2
-    out = 4.*dvar/dy2
-    #reroll lat dim axis to original dim
-    out = np.rollaxis(out,ndim-1,ydim)
+    var = np.asarray(var)
+    out = _getout(out, var)
+    if metrics is None:
+        metrics = getmetrics(var.ndim, lat=lat, ydim=ydim, sphere=sphere)
+    metrics.check(var.ndim)
+    if _useworkers(workers):
+        func = lambda var, out: d2vardy2(var, lat, ydim, out=out, metrics=metrics, workers=1)
+        return _threadapply(func, (var,), (ydim,), out=out, workers=workers)
+
+    _diff2(var, ydim, out) #edge is zero
+    out *= 4.
+    out /= metrics.dy2factor
 
     return out
 
-def div(u, v, lon, lat, xdim, ydim, cyclic=True, sphere=True):
+def div(u, v, lon, lat, xdim, ydim, cyclic=True, sphere=True, out=None, metrics=None, workers=None):
     ur"""
     水平発散を計算する。
 
@@ -437,6 +1002,12 @@ def div(u, v, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        経度微分の際に周境界とするかどうか。デフォルトはTrue
      **sphere** : bool, optional
        球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。
+     **out** : ndarray, optional
+       結果を書き込む配列。u, vと同じ形状でなければならない。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
     
     :Returns:
      **div** : ndarray
@@ -462,21 +1033,30 @@ def div(u, v, lon, lat, xdim, ydim, cyclic=True, sphere=True):
      >>> from pymet.grid import div
      >>> 
     """
-    u, v = np.array(u), np.array(v)
+    u, v = np.asarray(u), np.asarray(v)
     ndim = u.ndim
-    
-    out = dvardx(u,lon,lat,xdim,ydim,cyclic=cyclic,sphere=sphere) + dvardy(v,lat,ydim,sphere=sphere)
-    if sphere:
-       out = out - v*tools.expand(np.tan(lat*d2r),ndim,ydim)/a0
-
-    out = np.rollaxis(out, ydim, 0)
-    out[0,...]  = 0.
-    out[-1,...] = 0.
-    out = np.rollaxis(out, 0, ydim+1)
+    if metrics is None:
+        metrics = getmetrics(ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim, sphere=sphere)
+    if _useworkers(workers):
+        out = _getout(out, u)
+        func = lambda u, v, out: div(u, v, lon, lat, xdim, ydim, cyclic=cyclic, out=out, metrics=metrics, workers=1)
+        return _threadapply(func, (u, v), (xdim, ydim), out=out, workers=workers)
+
+    out  = dvardx(u,lon,lat,xdim,ydim,cyclic=cyclic,out=out,metrics=metrics)
+    work = dvardy(v,lat,ydim,metrics=metrics)
+    out += work
+    if metrics.sphere:
+        np.multiply(v, metrics.tanlat, out=work)
+        work /= a0
+        out -= work
+
+    if not metrics.curvilinear:
+        out[_axslice(ndim,ydim,slice(0,1))]    = 0.
+        out[_axslice(ndim,ydim,slice(-1,None))] = 0.
     
     return out
 
-def rot(u, v, lon, lat, xdim, ydim, cyclic=True, sphere=True):
+def rot(u, v, lon, lat, xdim, ydim, cyclic=True, sphere=True, out=None, metrics=None, workers=None):
     ur"""
     回転の鉛直成分を計算する。
 
@@ -491,6 +1071,12 @@ def rot(u, v, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        経度微分の際に周境界とするかどうか。デフォルトはTrue
      **sphere** : bool, optional
        球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。
+     **out** : ndarray, optional
+       結果を書き込む配列。u, vと同じ形状でなければならない。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
     
     :Returns:
      **div** : ndarray
@@ -513,21 +1099,30 @@ def rot(u, v, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        緯度、経度微分の項は、:py:func:`dvardx`、 :py:func:`dvardy` を内部で呼ぶ。境界の扱いもこれらに準ずる。
     
     """
-    u, v = np.array(u), np.array(v)
+    u, v = np.asarray(u), np.asarray(v)
     ndim = u.ndim
-
-    out = dvardx(v,lon,lat,xdim,ydim,cyclic=cyclic,sphere=sphere) - dvardy(u,lat,ydim,sphere=sphere)
-    if sphere:
-       out = out + u*tools.expand(np.tan(lat*d2r),ndim,ydim)/a0
+    if metrics is None:
+        metrics = getmetrics(ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim, sphere=sphere)
+    if _useworkers(workers):
+        out = _getout(out, u)
+        func = lambda u, v, out: rot(u, v, lon, lat, xdim, ydim, cyclic=cyclic, out=out, metrics=metrics, workers=1)
+        return _threadapply(func, (u, v), (xdim, ydim), out=out, workers=workers)
+
+    out  = dvardx(v,lon,lat,xdim,ydim,cyclic=cyclic,out=out,metrics=metrics)
+    work = dvardy(u,lat,ydim,metrics=metrics)
+    out -= work
+    if metrics.sphere:
+        np.multiply(u, metrics.tanlat, out=work)
+        work /= a0
+        out += work
     
-    out = np.rollaxis(out, ydim, 0)
-    out[0,...]  = 0.
-    out[-1,...] = 0.
-    out = np.rollaxis(out, 0, ydim+1)
+    if not metrics.curvilinear:
+        out[_axslice(ndim,ydim,slice(0,1))]    = 0.
+        out[_axslice(ndim,ydim,slice(-1,None))] = 0.
     
     return out
 
-def laplacian(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
+def laplacian(var, lon, lat, xdim, ydim, cyclic=True, sphere=True, out=None, metrics=None, workers=None):
     ur"""
     球面上での2次元ラプラシアンを計算する。
 
@@ -542,6 +1137,12 @@ def laplacian(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        経度微分の際に周境界とするかどうか。デフォルトはTrue
      **sphere** : bool, optional
        球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。
+     **out** : ndarray, optional
+       結果を書き込む配列。varと同じ形状でなければならない。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
     
     :Returns:
      **out** : ndarray
@@ -566,16 +1167,25 @@ def laplacian(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        緯度、経度微分の項は、:py:func:`d2vardx2`、 :py:func:`d2vardy2` を内部で呼ぶ。境界の扱いもこれらに準ずる。        
     """
     var = np.asarray(var)
-    ndim = var.ndim
-
-    if sphere:
-        out = d2vardx2(var, lon, lat, xdim, ydim, cyclic=cyclic, sphere=sphere) + d2vardy2(var, lat, ydim, sphere=sphere) - tools.expand(np.tan(lat*d2r),ndim,ydim)*dvardy(var, lat, ydim)/a0
-    else:
-        out = d2vardx2(var, lon, lat, xdim, ydim, cyclic=cyclic, sphere=sphere) + d2vardy2(var, lat, ydim, sphere=sphere)
+    if metrics is None:
+        metrics = getmetrics(var.ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim, sphere=sphere)
+    if _useworkers(workers):
+        out = _getout(out, var)
+        func = lambda var, out: laplacian(var, lon, lat, xdim, ydim, cyclic=cyclic, out=out, metrics=metrics, workers=1)
+        return _threadapply(func, (var,), (xdim, ydim), out=out, workers=workers)
+
+    out  = d2vardx2(var, lon, lat, xdim, ydim, cyclic=cyclic, out=out, metrics=metrics)
+    work = d2vardy2(var, lat, ydim, metrics=metrics)
+    out += work
+    if metrics.sphere:
+        dvardy(var, lat, ydim, out=work, metrics=metrics)
+        work *= metrics.tanlat
+        work /= a0
+        out -= work
         
     return out
 
-def grad(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
+def grad(var, lon, lat, xdim, ydim, cyclic=True, sphere=True, out=None, metrics=None, workers=None):
     ur"""
     水平勾配を計算する
     :Arguments:
@@ -589,6 +1199,12 @@ def grad(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        経度微分の際に周境界とするかどうか。デフォルトはTrue
      **sphere** : bool, optional
        球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。
+     **out** : tuple of ndarray, optional
+       結果を書き込む配列のタプル(outu, outv)。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
     
     :Returns:
      **outu, outv** : ndarray
@@ -605,13 +1221,20 @@ def grad(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        
     """
     var = np.asarray(var)
-
-    outu = dvardx(var,lon,lat,xdim,ydim,cyclic=True, sphere=sphere)
-    outv = dvardy(var,lat,ydim, sphere=sphere)    
+    outu, outv = out or (None, None)
+    if metrics is None:
+        metrics = getmetrics(var.ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim, sphere=sphere)
+    if _useworkers(workers):
+        out = (_getout(outu, var), _getout(outv, var))
+        func = lambda var, out: grad(var, lon, lat, xdim, ydim, cyclic=cyclic, out=out, metrics=metrics, workers=1)
+        return _threadapply(func, (var,), (xdim, ydim), out=out, workers=workers)
+
+    outu = dvardx(var,lon,lat,xdim,ydim,cyclic=cyclic, out=outu, metrics=metrics)
+    outv = dvardy(var,lat,ydim, out=outv, metrics=metrics)
     
     return outu, outv
 
-def skgrad(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
+def skgrad(var, lon, lat, xdim, ydim, cyclic=True, sphere=True, out=None, metrics=None, workers=None):
     ur"""
     skew gradient（流線関数からベクトルを求める）を計算する
     :Arguments:
@@ -625,6 +1248,12 @@ def skgrad(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        経度微分の際に周境界とするかどうか。デフォルトはTrue
      **sphere** : bool, optional
        球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。
+     **out** : tuple of ndarray, optional
+       結果を書き込む配列のタプル(outu, outv)。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
     
     :Returns:
      **outu, outv** : ndarray
@@ -642,12 +1271,408 @@ def skgrad(var, lon, lat, xdim, ydim, cyclic=True, sphere=True):
        
     """
     var = np.asarray(var)
+    outu, outv = out or (None, None)
+    if metrics is None:
+        metrics = getmetrics(var.ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim, sphere=sphere)
+    if _useworkers(workers):
+        out = (_getout(outu, var), _getout(outv, var))
+        func = lambda var, out: skgrad(var, lon, lat, xdim, ydim, cyclic=cyclic, out=out, metrics=metrics, workers=1)
+        return _threadapply(func, (var,), (xdim, ydim), out=out, workers=workers)
+
  
-    outu = -dvardy(var,lat,ydim, sphere=sphere)       
-    outv = dvardx(var,lon,lat,xdim,ydim,cyclic=True, sphere=sphere)
+    outu = dvardy(var,lat,ydim, out=outu, metrics=metrics)
+    np.negative(outu, out=outu)
+    outv = dvardx(var,lon,lat,xdim,ydim,cyclic=cyclic, out=outv, metrics=metrics)
     
     return outu, outv
 
+# kinematicsで計算できる量。合成量は (第1項, 第2項, 第2項の符号, 曲率項, 曲率項の符号) で表す。
+_KINEMATICS_DERIVS = ('dudx', 'dudy', 'dvdx', 'dvdy')
+_KINEMATICS_COMBOS = collections.OrderedDict([
+    ('div',     ('dudx', 'dvdy', +1, 'vtan', -1)),
+    ('rot',     ('dvdx', 'dudy', -1, 'utan', +1)),
+    ('stretch', ('dudx', 'dvdy', -1, 'vtan', -1)),
+    ('shear',   ('dvdx', 'dudy', +1, 'utan', +1))])
+_KINEMATICS = tuple(_KINEMATICS_COMBOS) + _KINEMATICS_DERIVS
+
+def kinematics(u, v, lon, lat, xdim, ydim, cyclic=True, sphere=True, names=None, out=None, metrics=None, workers=None):
+    ur"""
+    水平風の運動学的な量（発散、渦度、変形、速度勾配）をまとめて計算する。
+
+    4つの1階微分 :math:`u_x, u_y, v_x, v_y` をそれぞれ1度だけ計算し、要求された量を組み立てる。
+    :py:func:`div` と :py:func:`rot` を個別に呼ぶ場合に比べて微分の計算量が半分になる。
+
+    :Arguments:
+     **u, v** : ndarray
+       ベクトルの東西、南北成分。
+     **lon, lat** : array_like
+       緯度と経度
+     **xdim, ydim** : int
+       緯度、経度の軸
+     **cyclic** : bool, optional
+       経度微分の際に周境界とするかどうか。デフォルトはTrue
+     **sphere** : bool, optional
+       球面緯度経度座標かどうか。デフォルトはTrue。Falseにすると直交座標として扱う。
+     **names** : str or sequence of str, optional
+       計算する量の名前。'div', 'rot', 'stretch', 'shear', 'dudx', 'dudy', 'dvdx', 'dvdy' から選ぶ。
+       デフォルトはすべて。
+     **out** : dict, optional
+       量の名前をキーとして、結果を書き込む配列を与える辞書。指定しない量は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **result** : dict
+       namesで指定した量の名前をキーとする、u, v と同じ形状のndarrayの辞書。
+
+    .. note::
+       各量は次のように定義される。
+
+       ========= ===================================================================
+       div       :math:`u_x + v_y - \frac{v\tan\phi}{a}`
+       rot       :math:`v_x - u_y + \frac{u\tan\phi}{a}`
+       stretch   :math:`u_x - v_y - \frac{v\tan\phi}{a}`
+       shear     :math:`v_x + u_y + \frac{u\tan\phi}{a}`
+       ========= ===================================================================
+
+       ここで、:math:`(\cdot)_x = \frac{1}{a\cos\phi}\frac{\partial}{\partial\lambda}`、
+       :math:`(\cdot)_y = \frac{1}{a}\frac{\partial}{\partial\phi}`。
+       div, rot の値は :py:func:`div`、 :py:func:`rot` と一致する。
+       div, rot, stretch, shear の南北端の値は0とする。
+
+    **Examples**
+     >>> kin = kinematics(u, v, lon, lat, 3, 2)
+     >>> kin['div'], kin['rot']
+     >>> vor = kinematics(u, v, lon, lat, 3, 2, names='rot')['rot']
+    """
+    u, v = np.asarray(u), np.asarray(v)
+    ndim = u.ndim
+    if names is None:
+        names = _KINEMATICS
+    elif isinstance(names, basestring):
+        names = (names,)
+    for name in names:
+        if not name in _KINEMATICS:
+            raise ValueError, "unknown kinematic quantity '{0}'".format(name)
+    out = out or {}
+    if metrics is None:
+        metrics = getmetrics(ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim, sphere=sphere)
+    if _useworkers(workers):
+        out = dict((name, _getout(out.get(name), u)) for name in names)
+        func = lambda u, v, out: kinematics(u, v, lon, lat, xdim, ydim, cyclic=cyclic, names=names, out=out,
+                                            metrics=metrics, workers=1)
+        return _threadapply(func, (u, v), (xdim, ydim), out=out, workers=workers)
+
+    # 各微分を参照する回数。出力として要求された微分は最後まで保持する。
+    refs = dict((d, int(d in names)) for d in _KINEMATICS_DERIVS + ('utan', 'vtan'))
+    for name in names:
+        if name in _KINEMATICS_COMBOS:
+            first, second, sign, curv, csign = _KINEMATICS_COMBOS[name]
+            refs[first] += 1
+            refs[second] += 1
+            refs[curv] += 1
+
+    work = {}
+    for d, var, func in [('dudx', u, 'x'), ('dudy', u, 'y'), ('dvdx', v, 'x'), ('dvdy', v, 'y')]:
+        if refs[d] == 0:
+            continue
+        if func == 'x':
+            work[d] = dvardx(var, lon, lat, xdim, ydim, cyclic=cyclic, out=out.get(d), metrics=metrics)
+        else:
+            work[d] = dvardy(var, lat, ydim, out=out.get(d), metrics=metrics)
+    if metrics.sphere:
+        for curv, var in [('utan', u), ('vtan', v)]:
+            if refs[curv] > 0:
+                work[curv] = np.multiply(var, metrics.tanlat, out=_getout(None, var))
+                work[curv] /= a0
+
+    result = {}
+    for name in names:
+        if not name in _KINEMATICS_COMBOS:
+            result[name] = work[name]
+            continue
+        first, second, sign, curv, csign = _KINEMATICS_COMBOS[name]
+        refs[first] -= 1
+        refs[second] -= 1
+        res = out.get(name)
+        if res is None and refs[first] == 0:
+            # 以降参照しない微分の配列に上書きする
+            res = work.pop(first)
+            if sign > 0:
+                res += work[second]
+            else:
+                res -= work[second]
+        else:
+            res = _getout(res, u)
+            if sign > 0:
+                np.add(work[first], work[second], out=res)
+            else:
+                np.subtract(work[first], work[second], out=res)
+        if metrics.sphere:
+            if csign > 0:
+                res += work[curv]
+            else:
+                res -= work[curv]
+        if not metrics.curvilinear:
+            res[_axslice(ndim,ydim,slice(0,1))]    = 0.
+            res[_axslice(ndim,ydim,slice(-1,None))] = 0.
+        result[name] = res
+
+    return result
+
+#=== ヘルムホルツ分解 ==============================================================================
+#
+# 球面上のポアソン方程式を、経度方向はFFTで東西波数ごとに分離し、緯度方向は有限体積法で
+# 離散化した三重対角行列を解いて求める。行列のLU分解(トーマス法の前進消去の係数)は
+# GridMetrics に保持し、同じ格子では再利用する。
+
+class _PoissonSolver(object):
+    u"""
+    :py:func:`invlaplacian` 、 :py:func:`helmholtz` で用いる三重対角行列の分解。
+
+    経度は等間隔で全球を覆っていなければならない。緯度の端が極から1格子間隔以内にある場合は
+    極の周りを通るフラックスを0とし、そうでない場合は端の外側の格子でゼロとする。
+    """
+    def __init__(self, lon, lat):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        nx, ny = len(lon), len(lat)
+        dlon = 360./nx
+        if not np.allclose(np.diff(lon), dlon, rtol=1e-4, atol=0):
+            raise ValueError, "lon must be equally spaced and cover the whole circle"
+        if ny < 3:
+            raise ValueError, "at least 3 latitudes are required"
+        dlam = dlon*d2r
+        m = np.arange(nx//2+1)
+        self.nx, self.ny = nx, ny
+        self.kx  = np.sin(m*dlam)/dlam               # 中央差分 dvardx の固有値
+        self.kx2 = (2.*np.sin(m*dlam/2.)/dlam)**2    # 2階差分 d2vardx2 の固有値の符号を変えたもの
+
+        phi  = lat*d2r
+        dphi = np.diff(phi)
+        polar = [90. - abs(lat[0]) < abs(lat[1]-lat[0]), 90. - abs(lat[-1]) < abs(lat[-1]-lat[-2])]
+        # セルの境界
+        bnd = np.r_[phi[0]-0.5*dphi[0], 0.5*(phi[1:]+phi[:-1]), phi[-1]+0.5*dphi[-1]]
+        if polar[0]:
+            bnd[0] = np.sign(phi[0])*PI/2.
+        if polar[1]:
+            bnd[-1] = np.sign(phi[-1])*PI/2.
+        cosb = np.cos(bnd)
+        cosb[[0, -1]] *= np.logical_not(polar)
+        area  = np.diff(np.sin(bnd))
+        width = np.diff(bnd)
+        self.pole  = np.cos(phi) < 1e-10
+        self.cosb  = cosb
+        self.area  = area
+        self.width = width/area
+        self.zonal = np.where(self.pole, 0., self.width/np.cos(phi).clip(min=1e-10))
+        self.pinned = all(polar)
+
+        # 境界を通るフラックスの係数。外側の格子(値はゼロ)との間隔は端の格子間隔と同じとする。
+        dface = np.r_[dphi[0], dphi, dphi[-1]]
+        flux  = cosb/dface
+        lower = np.r_[0., flux[1:-1]] / area
+        upper = np.r_[flux[1:-1], 0.] / area
+        diag  = -(flux[:-1] + flux[1:]) / area
+        A = np.repeat(lower[:, NA], len(m), axis=1)
+        C = np.repeat(upper[:, NA], len(m), axis=1)
+        B = diag[:, NA] - self.kx2[NA, :]*self.zonal[:, NA]
+        # 極の格子では東西波数1以上の成分をゼロとする
+        fixed = self.pole[:, NA] & (m[NA, :] > 0)
+        if self.pinned:
+            # 全球では東西平均成分に定数の不定性があるので、端の値を固定して後で平均を除く
+            fixed[0, 0] = True
+        A[fixed], B[fixed], C[fixed] = 0., 1., 0.
+        self.fixed = fixed
+
+        cp = np.empty_like(C)
+        invden = np.empty_like(B)
+        invden[0] = 1./B[0]
+        cp[0] = C[0]*invden[0]
+        for j in range(1, ny):
+            invden[j] = 1./(B[j] - A[j]*cp[j-1])
+            cp[j] = C[j]*invden[j]
+        self.lower, self.cp, self.invden = A, cp, invden
+
+    def _removemean(self, spec):
+        spec[..., 0] -= (spec[..., 0]*self.area).sum(axis=-1)[..., NA] / self.area.sum()
+
+    def solve(self, spec):
+        u"""
+        緯度、東西波数を最後の2軸にもつ右辺のフーリエ係数specを、解で上書きする。
+        """
+        if self.pinned:
+            self._removemean(spec)
+        spec[..., self.fixed] = 0.
+        ny = self.ny
+        spec[..., 0, :] *= self.invden[0]
+        for j in range(1, ny):
+            spec[..., j, :] -= self.lower[j]*spec[..., j-1, :]
+            spec[..., j, :] *= self.invden[j]
+        for j in range(ny-2, -1, -1):
+            spec[..., j, :] -= self.cp[j]*spec[..., j+1, :]
+        if self.pinned:
+            self._removemean(spec)
+        return spec
+
+    def _faceflux(self, spec):
+        u"""
+        セル境界での値にcos(lat)を掛けたものの、セル内での差をセルの面積で割る。
+        """
+        shape = spec.shape[:-2] + (self.ny+1, spec.shape[-1])
+        face = np.empty(shape, dtype=spec.dtype)
+        face[..., 1:-1, :] = spec[..., 1:, :] + spec[..., :-1, :]
+        face[..., 1:-1, :] *= 0.5
+        face[..., 0, :]  = spec[..., 0, :]
+        face[..., -1, :] = spec[..., -1, :]
+        face *= self.cosb[:, NA]
+        return np.diff(face, axis=-2) / self.area[:, NA]
+
+    def vrtdiv(self, uspec, vspec):
+        u"""
+        風のフーリエ係数から、有限体積法で渦度と発散のフーリエ係数を計算する。
+        """
+        dlam = 1j*self.kx[NA, :]*self.width[:, NA]
+        vrt = dlam*vspec - self._faceflux(uspec)
+        dvg = dlam*uspec + self._faceflux(vspec)
+        vrt /= a0
+        dvg /= a0
+        return vrt, dvg
+
+_HELMHOLTZ = ('strm', 'vpot', 'urot', 'vrot', 'udiv', 'vdiv')
+
+def _tospec(var, xdim, ydim):
+    u"""
+    経度方向のフーリエ係数を、緯度、東西波数を最後の2軸とする配列で返す。
+    """
+    return np.moveaxis(np.fft.rfft(var, axis=xdim), (ydim, xdim), (-2, -1))
+
+def _fromspec(spec, nx, xdim, ydim, out):
+    out[...] = np.fft.irfft(np.moveaxis(spec, (-2, -1), (ydim, xdim)), n=nx, axis=xdim)
+    return out
+
+def invlaplacian(var, lon, lat, xdim, ydim, out=None, metrics=None, workers=None):
+    ur"""
+    球面上の2次元ラプラシアンの逆演算(ポアソン方程式の解)を計算する。
+
+    渦度から流線関数、発散から速度ポテンシャルを求めるのに用いる。経度方向はFFTで
+    東西波数ごとに分け、緯度方向は三重対角行列を解く。行列の分解は格子ごとに
+    :py:class:`GridMetrics` に保持され、同じ格子では再利用される。
+
+    :Arguments:
+     **var** : ndarray
+       スカラー場
+     **lon, lat** : array_like
+       緯度と経度。経度は等間隔で全球を覆っていなければならない。
+     **xdim, ydim** : int
+       緯度、経度の軸
+     **out** : ndarray, optional
+       結果を書き込む配列。varと同じ形状でなければならない。指定しない場合は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **out** : ndarray
+       varと同じ形状のndarray
+
+    .. note::
+       :py:func:`laplacian` と同じ演算子を、緯度方向は保存形
+
+       .. math:: \frac{1}{a^2\cos\phi}\frac{\partial}{\partial \phi}\left( \cos\phi \frac{\partial \Phi}{\partial \phi} \right)
+
+       の有限体積法で離散化して解く。内部の格子では :py:func:`laplacian` と2次の精度で一致する。
+       緯度の端が極から1格子間隔以内にある場合は極を通るフラックスを0とし、結果の全球平均
+       (面積重み付き)を0とする。そうでない場合は端の1格子外側で値を0とする。
+
+    **Examples**
+     >>> vor  = rot(u, v, lon, lat, 3, 2)
+     >>> strm = invlaplacian(vor, lon, lat, 3, 2)
+    """
+    var = np.asarray(var)
+    out = _getout(out, var)
+    if metrics is None:
+        metrics = getmetrics(var.ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim)
+    metrics.check(var.ndim)
+    if _useworkers(workers):
+        func = lambda var, out: invlaplacian(var, lon, lat, xdim, ydim, out=out, metrics=metrics, workers=1)
+        return _threadapply(func, (var,), (xdim, ydim), out=out, workers=workers)
+
+    solver = metrics.poissonsolver()
+    spec = _tospec(var, xdim, ydim)
+    spec *= a0**2
+    solver.solve(spec)
+    return _fromspec(spec, solver.nx, xdim, ydim, out)
+
+def helmholtz(u, v, lon, lat, xdim, ydim, out=None, metrics=None, workers=None):
+    ur"""
+    水平風をヘルムホルツ分解し、流線関数、速度ポテンシャル、回転風、発散風を計算する。
+
+    :Arguments:
+     **u, v** : ndarray
+       ベクトルの東西、南北成分。
+     **lon, lat** : array_like
+       緯度と経度。経度は等間隔で全球を覆っていなければならない。
+     **xdim, ydim** : int
+       緯度、経度の軸
+     **out** : dict, optional
+       量の名前をキーとして、結果を書き込む配列を与える辞書。指定しない量は新たに確保する。
+     **metrics** : GridMetrics, optional
+       格子の計量因子。指定した場合は座標から因子を計算せずにこれを用いる。:py:func:`getmetrics` を参照。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **result** : dict
+       'strm', 'vpot', 'urot', 'vrot', 'udiv', 'vdiv' をキーとする、u, v と同じ形状のndarrayの辞書。
+
+    .. note::
+       渦度 :math:`\zeta` と発散 :math:`D` を経度方向のフーリエ係数から有限体積法で求め、
+       :py:func:`invlaplacian` と同じ方法で
+
+       .. math:: \nabla_{h}^2\psi = \zeta, \quad \nabla_{h}^2\chi = D
+
+       を解く。回転風、発散風は次のように中央差分で計算する。
+
+       .. math:: u_{\psi} = -\frac{1}{a}\frac{\partial \psi}{\partial \phi}, \quad
+                 v_{\psi} = \frac{1}{a\cos\phi}\frac{\partial \psi}{\partial \lambda}, \quad
+                 u_{\chi} = \frac{1}{a\cos\phi}\frac{\partial \chi}{\partial \lambda}, \quad
+                 v_{\chi} = \frac{1}{a}\frac{\partial \chi}{\partial \phi}
+
+    **Examples**
+     >>> hel = helmholtz(u, v, lon, lat, 3, 2)
+     >>> fx, fy = tnflux2d(hel['strm'], lon, lat, 3, 2)
+    """
+    u, v = np.asarray(u), np.asarray(v)
+    out = out or {}
+    if metrics is None:
+        metrics = getmetrics(u.ndim, lon=lon, lat=lat, xdim=xdim, ydim=ydim)
+    metrics.check(u.ndim)
+    if _useworkers(workers):
+        out = dict((name, _getout(out.get(name), u)) for name in _HELMHOLTZ)
+        func = lambda u, v, out: helmholtz(u, v, lon, lat, xdim, ydim, out=out, metrics=metrics, workers=1)
+        return _threadapply(func, (u, v), (xdim, ydim), out=out, workers=workers)
+
+    solver = metrics.poissonsolver()
+    vrt, dvg = solver.vrtdiv(_tospec(u, xdim, ydim), _tospec(v, xdim, ydim))
+    vrt *= a0**2
+    dvg *= a0**2
+    result = {}
+    result['strm'] = _fromspec(solver.solve(vrt), solver.nx, xdim, ydim, _getout(out.get('strm'), u))
+    del vrt
+    result['vpot'] = _fromspec(solver.solve(dvg), solver.nx, xdim, ydim, _getout(out.get('vpot'), u))
+    del dvg
+    result['urot'] = dvardy(result['strm'], lat, ydim, out=out.get('urot'), metrics=metrics)
+    np.negative(result['urot'], out=result['urot'])
+    result['vrot'] = dvardx(result['strm'], lon, lat, xdim, ydim, out=out.get('vrot'), metrics=metrics)
+    result['udiv'] = dvardx(result['vpot'], lon, lat, xdim, ydim, out=out.get('udiv'), metrics=metrics)
+    result['vdiv'] = dvardy(result['vpot'], lat, ydim, out=out.get('vdiv'), metrics=metrics)
+
+    return result
+
 def dvardvar(var1, var2, dim, cyclic=True):
     u"""
     d(var1)/d(var2) を axis=dim に沿って差分を計算
@@ -674,7 +1699,71 @@ def dvardvar(var1, var2, dim, cyclic=True):
 
     return out
 
-def vint(var, bottom, top, lev, zdim, punit=100.):
+def _vweights(lev, bottom, top, ps=None):
+    u"""
+    vint, vmean で各レベルが代表する気圧の厚さ(levの単位)を返す。
+
+    bottomからtopまでの範囲にあるレベルについて、隣り合うレベルの中間を境界とし、
+    最も下のレベルはbottom(psを与えた場合はbottomとpsの小さい方)から、最も上のレベルは
+    topまでとする。psを与えた場合は形状 (len(lev),) + ps.shape の配列を返す。
+    """
+    lev = np.asarray(lev, dtype=np.float64)
+    order = np.argsort(-lev)
+    p = lev[order]
+    pbot = np.asarray(bottom if ps is None else np.minimum(bottom, ps), dtype=np.float64)
+    pk = p.reshape((-1,) + (1,)*pbot.ndim)
+    inband = (pk <= pbot) & (pk >= top)
+    mid = 0.5*(pk[1:] + pk[:-1])
+    lower = np.empty(inband.shape)
+    lower[0] = pbot
+    lower[1:] = np.where(inband[:-1], mid, pbot)
+    upper = np.empty(inband.shape)
+    upper[-1] = top
+    upper[:-1] = np.where(inband[1:], mid, top)
+    dp = np.where(inband, lower - upper, 0.)
+    # 元のレベルの順に戻す
+    w = np.empty_like(dp)
+    w[order] = dp
+    return w
+
+def _vsum(var, w, zdim):
+    u"""
+    zdimに沿ったvarとwの積和を、軸の入れ替えをせずに計算する。wは1次元の重みか、
+    形状 (len(lev),) + (varからzdimを除いた形状) の重み。マスクされた値は0として扱う。
+    """
+    data = np.ma.filled(var, 0.) if isinstance(var, np.ma.MaskedArray) else var
+    ndim = data.ndim
+    if w.ndim == 1:
+        return np.tensordot(data, w, axes=(zdim, 0))
+    idx = 'abcdefghijklmnopqrstuvwxyz'[:ndim]
+    outidx = idx[:zdim] + idx[zdim+1:]
+    return np.einsum('{0},{0}->{1}'.format(idx, outidx), data, np.moveaxis(w, 0, zdim))
+
+def _vprepare(var, bottom, top, lev, zdim, ps):
+    u"""
+    vint, vmean の共通の前処理。入力、重み、符号、鉛直次元を返す。
+    """
+    if not isinstance(var, np.ma.MaskedArray):
+        var = np.asarray(var)
+    ndim = var.ndim
+    zdim = zdim % ndim
+    sign = 1.
+    if bottom < top:
+        bottom, top, sign = top, bottom, -1.
+    if ps is not None:
+        ps = np.broadcast_to(np.ma.getdata(ps), var.shape[:zdim] + var.shape[zdim+1:])
+    return var, _vweights(lev, bottom, top, ps=ps), sign, zdim
+
+def _vmask(var, w, zdim, out):
+    u"""
+    積分範囲のすべてのレベルがマスクされている点をマスクする。
+    """
+    if not isinstance(var, np.ma.MaskedArray):
+        return out
+    valid = _vsum(np.logical_not(np.ma.getmaskarray(var)).astype(np.float64), (w != 0).astype(np.float64), zdim)
+    return np.ma.masked_where(valid == 0, out, copy=False)
+
+def vint(var, bottom, top, lev, zdim, punit=100., ps=None):
     ur"""
     質量重み付き鉛直積分。
     
@@ -689,6 +1778,11 @@ def vint(var, bottom, top, lev, zdim, punit=100.):
        鉛直次元のインデックス。
      **punit** : float, optional
        levの単位(Pa)
+     **ps** : array_like, optional
+       地表気圧 [punit*Pa]。varから鉛直次元を除いた形状(もしくはそれにブロードキャスト
+       できる形状)。与えた場合は、積分の下端を格子点ごとにbottomとpsの小さい方とし、
+       地表面を含む層は地表面より上の部分だけを積分する。psがtopより上にあり積分範囲に
+       レベルがない点は、:py:func:`vmean` と同じくマスクする。
 
        
     :Returns:
@@ -699,30 +1793,23 @@ def vint(var, bottom, top, lev, zdim, punit=100.):
        p面座標系で与えられるデータの鉛直積分は次式で定義される。
        
        .. math:: vint = \frac{1}{g}\int_{bottom}^{top} \Phi dp
+
+       各レベルは隣り合うレベルとの中間までの層を代表するとし、その厚さを重みとして
+       鉛直次元に沿った積和をとる。マスクされた値は0として扱う。
        
     **Examples**
 
-    >>>
-    >>>
+    >>> pw = vint(q, 1000., 300., lev, 1, ps=ps)
+    >>> qu = vint(q*u, 1000., 300., lev, 1, ps=ps)
     """
-    var = np.ma.asarray(var)
-    lev = np.asarray(lev)
-    ndim = var.ndim
-
-    lev = lev[(lev <= bottom)&(lev >= top)]
-    lev_m = np.r_[bottom,(lev[1:] + lev[:-1])/2.,top]
-    dp = lev_m[:-1] - lev_m[1:]
-
-    #roll lat dim axis to last
-    var = tools.mrollaxis(var,zdim,ndim)
-    out = var[...,(lev <= bottom)&(lev >= top)] * dp / g * punit
-    if bottom > top:
-        out = out.sum(axis=-1)
-    else:
-        out = -out.sum(axis=-1)
-    return out
-
-def vmean(var, bottom, top, lev, zdim, punit=100.):
+    var, w, sign, zdim = _vprepare(var, bottom, top, lev, zdim, ps)
+    out = _vsum(var, w, zdim)
+    out *= sign * punit / g
+    if w.ndim > 1:
+        out = np.ma.masked_where(w.sum(axis=0) == 0, out, copy=False)
+    return _vmask(var, w, zdim, out)
+
+def vmean(var, bottom, top, lev, zdim, punit=100., ps=None):
     ur"""
     質量重み付き鉛直平均。
     
@@ -737,6 +1824,9 @@ def vmean(var, bottom, top, lev, zdim, punit=100.):
        鉛直次元のインデックス。
      **punit** : float, optional
        levの単位(Pa)
+     **ps** : array_like, optional
+       地表気圧 [punit*Pa]。与えた場合は、平均の下端を格子点ごとにbottomとpsの小さい方とする。
+       :py:func:`vint` を参照。
 
        
     :Returns:
@@ -745,25 +1835,360 @@ def vmean(var, bottom, top, lev, zdim, punit=100.):
        
     **Examples**
 
-    >>>
-    >>>
+    >>> tmean = vmean(t, 850., 300., lev, 1, ps=ps)
     """
-    var = np.ma.asarray(var)
-    lev = np.asarray(lev)
-    ndim = var.ndim
+    var, w, sign, zdim = _vprepare(var, bottom, top, lev, zdim, ps)
+    out = _vsum(var, w, zdim)
+    total = w.sum(axis=0)
+    if np.ndim(total) == 0:
+        out /= total
+    else:
+        out = np.ma.masked_where(total == 0, out, copy=False)
+        out /= np.where(total == 0, 1., total)
+    return _vmask(var, w, zdim, out)
 
-    lev = lev[(lev <= bottom)&(lev >= top)]
-    lev_m = np.r_[bottom,(lev[1:] + lev[:-1])/2.,top]
-    dp = lev_m[:-1] - lev_m[1:]
+#=== 鉛直内挿 ======================================================================================
 
-    #roll lat dim axis to last
-    var = tools.mrollaxis(var,zdim,ndim)
-    out = var[...,(lev <= bottom)&(lev >= top)] * dp 
-    out = out.sum(axis=-1)/(dp.sum())
+_EXTRAPOLATE = ('error', 'nan', 'constant', 'linear')
 
-    return out
+class VerticalInterpolator(object):
+    u"""
+    鉛直方向の線形内挿の添字と重みを保持し、同じレベル間の内挿を繰り返し行うためのクラス。
+
+    内挿先の各レベルを挟む元のレベルの添字と重みを作成時に一度だけ計算し、呼び出し時には
+    鉛直次元に沿って2つのレベルを取り出して重み付き和をとるだけで済ませる。
+    配列の軸の入れ替えや、レベルごとの内挿関数の作成は行わない。
 
-def vinterp(var, oldz, newz, zdim, logintrp=True, bounds_error=True):
+    :Arguments:
+     **oldz** : array_like
+      元データの鉛直レベル(1次元)。単調であれば増加、減少のどちらでもよい。
+     **newz** : array_like
+      内挿するレベル。
+     **logintrp** : bool, optional
+      log(z)で線形内挿するかどうか。デフォルトはTrue
+     **extrapolate** : {'error', 'nan', 'constant', 'linear'}, optional
+      oldzの範囲外のレベルの扱い。
+
+      ========= ========================================================
+      'error'   ValueErrorを送出する(デフォルト)。
+      'nan'     NaNとする。MaskedArrayの場合はマスクする。
+      'constant' 最も近い端のレベルの値とする。
+      'linear'  端の2レベルから線形に外挿する。
+      ========= ========================================================
+
+    **Attributes**
+
+    ========= ===============================================
+    lower     下側(添字の小さい側)のレベルの添字
+    upper     上側のレベルの添字
+    weight    上側のレベルの重み。内挿値は (1-weight)*var[lower] + weight*var[upper]
+    outside   oldzの範囲外のレベルかどうか
+    ========= ===============================================
+
+    **Examples**
+     >>> interp = VerticalInterpolator(lev, [850., 500., 250.])
+     >>> for var in (u, v, t):
+     ...     result = interp(var, 1)
+    """
+    def __init__(self, oldz, newz, logintrp=True, extrapolate='error'):
+        if not extrapolate in _EXTRAPOLATE:
+            raise ValueError, "extrapolate must be one of {0}, not '{1}'".format(_EXTRAPOLATE, extrapolate)
+        oldz = np.asarray(oldz, dtype=np.float64)
+        newz = np.atleast_1d(np.asarray(newz, dtype=np.float64))
+        if oldz.ndim != 1 or newz.ndim != 1:
+            raise ValueError, "oldz and newz must be 1-dimensional"
+        if len(oldz) < 2:
+            raise ValueError, "oldz must have at least 2 levels"
+        self.oldz, self.newz = oldz, newz
+        self.logintrp = logintrp
+        self.extrapolate = extrapolate
+        if logintrp:
+            oldz, newz = np.log(oldz), np.log(newz)
+
+        # 昇順に並べ替えて探索し、元の添字に戻す
+        order = np.argsort(oldz)
+        sortz = oldz[order]
+        if np.any(np.diff(sortz) == 0):
+            raise ValueError, "oldz must not contain duplicate levels"
+        pos = np.searchsorted(sortz, newz).clip(1, len(sortz)-1)
+        weight = (newz - sortz[pos-1]) / (sortz[pos] - sortz[pos-1])
+        self.outside = (newz < sortz[0]) | (newz > sortz[-1])
+        if np.any(self.outside):
+            if extrapolate == 'error':
+                raise ValueError, "newz {0} is outside the range of oldz".format(self.newz[self.outside])
+            elif extrapolate == 'constant':
+                weight = weight.clip(0., 1.)
+        self.lower, self.upper = order[pos-1], order[pos]
+        self.weight = weight
+
+    def __call__(self, var, zdim, out=None):
+        u"""
+        varをzdimに沿って内挿する。
+
+        :Arguments:
+         **var** : array_like
+          内挿するデータ。var.shape[zdim] == len(oldz) でなければならない。
+          MaskedArrayの場合は、内挿に用いたレベルのどちらかがマスクされていればマスクする。
+         **zdim** : int
+          鉛直次元のインデックス。
+         **out** : ndarray, optional
+          結果を書き込む配列。指定しない場合は新たに確保する。
+
+        :Returns:
+         **result** : ndarray or MaskedArray
+          result.shape[zdim] == len(newz) になる。
+        """
+        masked = isinstance(var, np.ma.MaskedArray)
+        mask = np.ma.getmask(var)
+        var = np.ma.getdata(var)
+        ndim = var.ndim
+        zdim = zdim % ndim
+        if var.shape[zdim] != len(self.oldz):
+            raise ValueError, "length of dimension {0} must be {1}, not {2}".format(zdim, len(self.oldz), var.shape[zdim])
+        shape = list(var.shape)
+        shape[zdim] = len(self.newz)
+        dtype = np.result_type(var.dtype, np.float32)
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        elif out.shape != tuple(shape):
+            raise ValueError, "out must have shape {0}, not {1}".format(tuple(shape), out.shape)
+        nan = self.outside & (self.extrapolate == 'nan')
+
+        work = None
+        for k, (i0, i1, w) in enumerate(zip(self.lower, self.upper, self.weight)):
+            o = out[_axslice(ndim, zdim, k)]
+            if nan[k]:
+                o[...] = np.nan
+                continue
+            lower = var[_axslice(ndim, zdim, i0)]
+            upper = var[_axslice(ndim, zdim, i1)]
+            if w == 0.:
+                o[...] = lower
+            elif w == 1.:
+                o[...] = upper
+            else:
+                if work is None:
+                    work = np.empty(o.shape, dtype=dtype)
+                np.multiply(lower, 1.-w, out=o)
+                np.multiply(upper, w, out=work)
+                o += work
+
+        if not masked:
+            return out
+        newmask = np.zeros(shape, dtype=bool)
+        if mask is not np.ma.nomask:
+            for k, (i0, i1, w) in enumerate(zip(self.lower, self.upper, self.weight)):
+                m = newmask[_axslice(ndim, zdim, k)]
+                if w != 1.:
+                    m |= mask[_axslice(ndim, zdim, i0)]
+                if w != 0.:
+                    m |= mask[_axslice(ndim, zdim, i1)]
+        newmask[_axslice(ndim, zdim, nan)] = True
+        return np.ma.MaskedArray(out, mask=newmask)
+
+_vinterp_cache = collections.OrderedDict()
+_vinterp_lock = threading.Lock()
+_VINTERP_CACHESIZE = 16
+
+def _getvinterpolator(oldz, newz, logintrp, extrapolate):
+    u"""
+    同じレベルの組み合わせであれば、作成済みの :py:class:`VerticalInterpolator` を返す。
+    """
+    key = (_arraykey(np.asarray(oldz, dtype=np.float64)), _arraykey(np.atleast_1d(np.asarray(newz, dtype=np.float64))),
+           logintrp, extrapolate)
+    with _vinterp_lock:
+        interp = _vinterp_cache.pop(key, None)
+        if interp is None:
+            interp = VerticalInterpolator(oldz, newz, logintrp=logintrp, extrapolate=extrapolate)
+            if len(_vinterp_cache) >= _VINTERP_CACHESIZE:
+                _vinterp_cache.popitem(last=False)
+        _vinterp_cache[key] = interp
+    return interp
+
+class ColumnInterpolator(object):
+    u"""
+    鉛直座標が格子点ごとに異なる場合の線形内挿の添字と重みを保持するクラス。
+
+    各鉛直柱で内挿先のレベルを挟む添字を二分探索で求め、重みとともに保持する。
+    同じ座標で複数の変数を内挿する場合は、探索は作成時の一度だけで済む。
+    配列は平坦化して添字で参照するので、軸の入れ替えや柱ごとのコピーはしない。
+    柱をいくつかの組に分けてスレッドで並列に計算する。単精度の入力は単精度のまま計算する。
+
+    :Arguments:
+     **oldz** : array_like
+      元データの鉛直座標。内挿する変数と同じ形状で、各柱で単調であれば増加、減少の
+      どちらでもよい。MaskedArrayの場合、柱の向きはマスクされていない最初と最後のレベルで
+      判定し、マスクされたレベルが内挿先を挟む値(地表面より下のレベルなど)はマスクされる。
+     **newz** : array_like
+      内挿するレベル(1次元)。
+     **zdim** : int
+      鉛直次元のインデックス。
+     **logintrp** : bool, optional
+      log(z)で線形内挿するかどうか。デフォルトはTrue
+     **extrapolate** : {'error', 'nan', 'constant', 'linear'}, optional
+      oldzの範囲外のレベルの扱い。:py:class:`VerticalInterpolator` を参照。デフォルトは'constant'。
+     **workers** : int, optional
+      並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    **Attributes**
+
+    ========= ===============================================
+    shape     内挿する変数の形状
+    outshape  内挿後の形状
+    ========= ===============================================
+
+    **Examples**
+     >>> interp = ColumnInterpolator(z, [1000., 5000., 10000.], 1, logintrp=False)
+     >>> uz, vz = interp(u), interp(v)
+    """
+    def __init__(self, oldz, newz, zdim, logintrp=True, extrapolate='constant', workers=None):
+        if not extrapolate in _EXTRAPOLATE:
+            raise ValueError, "extrapolate must be one of {0}, not '{1}'".format(_EXTRAPOLATE, extrapolate)
+        mask = np.ma.getmaskarray(oldz) if isinstance(oldz, np.ma.MaskedArray) else None
+        oldz = np.ma.getdata(oldz)
+        newz = np.atleast_1d(np.asarray(newz, dtype=np.float64))
+        if logintrp:
+            oldz = np.log(oldz)
+            newz = np.log(newz)
+        dtype = np.result_type(oldz.dtype, np.float32)
+        zflat = np.ascontiguousarray(oldz, dtype=dtype).ravel()
+        newz = newz.astype(dtype)
+
+        shape = oldz.shape
+        ndim = len(shape)
+        zdim = zdim % ndim
+        nz, nnew = shape[zdim], len(newz)
+        if nz < 2:
+            raise ValueError, "oldz must have at least 2 levels"
+        self.shape = shape
+        self.outshape = shape[:zdim] + (nnew,) + shape[zdim+1:]
+        self.extrapolate = extrapolate
+        self._inner = inner = int(np.prod(shape[zdim+1:]))
+        self._ncol = ncol = int(np.prod(shape[:zdim])) * inner
+        self._nz, self._nnew = nz, nnew
+        self._mask = None if mask is None else np.ascontiguousarray(mask).ravel()
+        self._workers = tools.get_num_threads() if workers is None else workers
+        itype = np.int32 if zflat.size < 2**31 else np.intp
+        self.lower  = np.empty((nnew, ncol), dtype=itype)
+        self.weight = np.empty((nnew, ncol), dtype=dtype)
+        self._bad = None if mask is None else np.empty((nnew, ncol), dtype=bool)
+
+        # 減少する柱は符号を反転し、すべての柱で座標が増加するようにする
+        z3 = zflat.reshape(-1, nz, inner)
+        if mask is None:
+            sign = np.where(z3[:, -1, :] < z3[:, 0, :], -1, 1).astype(dtype)
+            zflat = (z3 * sign[:, NA, :]).ravel()
+        else:
+            # 向きはマスクされていない最初と最後のレベルで決め、マスクされたレベルは
+            # 内挿先を挟まないように、最初より下を-inf、最後より上を+infとする。
+            # 途中のマスクされたレベルは1つ下の値とする。
+            valid = ~self._mask.reshape(-1, nz, inner)
+            first = np.argmax(valid, axis=1)
+            last = nz - 1 - np.argmax(valid[:, ::-1, :], axis=1)
+            zfirst = np.take_along_axis(z3, first[:, NA, :], axis=1)[:, 0, :]
+            zlast = np.take_along_axis(z3, last[:, NA, :], axis=1)[:, 0, :]
+            sign = np.where(zlast < zfirst, -1, 1).astype(dtype)
+            z3 = np.where(valid, z3 * sign[:, NA, :], -np.inf).astype(dtype)
+            np.maximum.accumulate(z3, axis=1, out=z3)
+            z3[np.arange(nz)[NA, :, NA] > last[:, NA, :]] = np.inf
+            zflat = z3.ravel()
+        sign = sign.ravel()
+        # 二分探索の各段で進める層数
+        halves = []
+        size = nz - 1
+        while size > 1:
+            halves.append(size // 2)
+            size -= size // 2
+
+        def run(cols):
+            base = self._base(cols)
+            for k, t in enumerate(newz):
+                ts = t * sign[cols]
+                lo = base.copy()
+                for half in halves:
+                    cand = lo + half*inner
+                    lo = np.where(zflat.take(cand) <= ts, cand, lo)
+                z0 = zflat.take(lo)
+                with np.errstate(invalid='ignore'):
+                    w = ts - z0
+                    w /= zflat.take(lo + inner) - z0
+                if self._mask is not None:
+                    # マスクされたレベルが内挿先を挟む点は、__call__でマスクする
+                    bad = (self._mask.take(lo) & (w != 1)) | (self._mask.take(lo + inner) & (w != 0))
+                    w[bad] = 0
+                    self._bad[k, cols] = bad
+                outside = (w < 0) | (w > 1)
+                if extrapolate == 'error' and outside.any():
+                    raise ValueError, "newz[{0}] is outside the range of oldz".format(k)
+                elif extrapolate == 'constant':
+                    np.clip(w, 0, 1, out=w)
+                elif extrapolate == 'nan':
+                    w[outside] = np.nan
+                self.lower[k, cols] = lo
+                self.weight[k, cols] = w
+        tools.threadmap(run, self._colslices(), self._workers)
+
+    def _base(self, cols):
+        u"""
+        柱の範囲colsについて、最下層の平坦化した添字を返す。
+        """
+        o, i = divmod(np.arange(cols.start, cols.stop), self._inner)
+        return o*(self._nz*self._inner) + i
+
+    def _colslices(self):
+        step = max(1, -(-self._ncol // max(1, self._workers)))
+        return [slice(c, min(c+step, self._ncol)) for c in range(0, self._ncol, step)]
+
+    def __call__(self, var):
+        u"""
+        varを内挿する。
+
+        :Arguments:
+         **var** : array_like
+          内挿するデータ。oldzと同じ形状でなければならない。
+
+        :Returns:
+         **result** : ndarray or MaskedArray
+          形状はoutshape。varかoldzがMaskedArrayの場合は、内挿に用いたレベルのどちらかが
+          マスクされていればマスクしたMaskedArrayを返す。範囲外をNaNとした点もマスクする。
+        """
+        mask = self._mask
+        if isinstance(var, np.ma.MaskedArray):
+            vmask = np.ascontiguousarray(np.ma.getmaskarray(var)).ravel()
+            mask = vmask if mask is None else mask | vmask
+        var = np.ma.getdata(var)
+        if var.shape != self.shape:
+            raise ValueError, "var must have the same shape as oldz {0}, not {1}".format(self.shape, var.shape)
+        dtype = np.result_type(var.dtype, self.weight.dtype)
+        yflat = np.ascontiguousarray(var, dtype=dtype).ravel()
+        out = np.empty(self.outshape, dtype=dtype)
+        outflat = out.reshape(-1)
+        outmask = None if mask is None else np.zeros(self.outshape, dtype=bool)
+        maskflat = None if mask is None else outmask.reshape(-1)
+        inner = self._inner
+
+        def run(cols):
+            o, i = divmod(np.arange(cols.start, cols.stop), inner)
+            outbase = o*(self._nnew*inner) + i
+            for k in range(self._nnew):
+                lo = self.lower[k, cols]
+                hi = lo + inner
+                w = self.weight[k, cols]
+                res = yflat.take(lo)*(1-w)
+                res += yflat.take(hi)*w
+                outflat.put(outbase + k*inner, res)
+                if maskflat is not None:
+                    m = (mask.take(lo) & (w != 1)) | (mask.take(hi) & (w != 0))
+                    m |= np.isnan(w)
+                    if self._bad is not None:
+                        m |= self._bad[k, cols]
+                    maskflat.put(outbase + k*inner, m)
+        tools.threadmap(run, self._colslices(), self._workers)
+        if outmask is not None:
+            return np.ma.MaskedArray(out, mask=outmask)
+        return out
+
+def vinterp(var, oldz, newz, zdim, logintrp=True, bounds_error=True, extrapolate=None, workers=None):
     u"""
     指定した鉛直レベルへの線形内挿。
     
@@ -771,7 +2196,8 @@ def vinterp(var, oldz, newz, zdim, logintrp=True, bounds_error=True):
      **var** : array_like
        内挿するデータ。
      **old_z** : array_like
-       元データの鉛直レベル。
+       元データの鉛直レベル。1次元の配列か、格子点ごとに異なる場合はvarと同じ形状の配列。
+       単調であれば増加、減少のどちらでもよい。
      **new_z** : array_like
        内挿するレベル。
      **zdim** : int
@@ -779,53 +2205,70 @@ def vinterp(var, oldz, newz, zdim, logintrp=True, bounds_error=True):
      **logintrp** : bool, optional
        log(z)で線形内挿するかどうか。デフォルトはTrue
      **bounds_error** : bool, optional
+       old_zの範囲外のレベルがある場合にエラーとするかどうか。Falseの場合はNaNとする。
+       デフォルトはTrue。old_zが1次元の場合のみ有効。
+     **extrapolate** : {None, 'error', 'nan', 'constant', 'linear'}, optional
+       old_zの範囲外のレベルの扱い。指定した場合はbounds_errorより優先する。
+       :py:class:`VerticalInterpolator` を参照。old_zがvarと同じ形状の場合のデフォルトは
+       'constant'(端の値)。
+     **workers** : int, optional
+       old_zがvarと同じ形状の場合に、並列計算に用いるスレッド数。
+       デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
 
     :Returns:
      **result** : array_like
-       内挿後のデータ。result.shape[zdim] == len(new_z)になる。
+       内挿後のデータ。result.shape[zdim] == len(new_z)になる。varかold_zがMaskedArrayの
+       場合は、内挿に用いたレベルのどちらかがマスクされていればマスクしたMaskedArrayを返す。
+
+    .. note::
+       old_zが1次元の場合は :py:class:`VerticalInterpolator` を用いる。同じold_z, new_zの
+       組み合わせについては内挿の重みを再利用する。
+       old_zが格子点ごとに異なる場合は :py:class:`ColumnInterpolator` を用いる。各鉛直柱で
+       内挿先を挟むレベルを二分探索で求める。単精度の入力は単精度のまま計算する。
        
     **Examples**
 
     >>> from pymet.grid import vinterp
-    >>>
+    >>> t500 = vinterp(t, lev, [500.], 1)
+    >>> u_z  = vinterp(u, z, [1000., 5000., 10000.], 1, logintrp=False)
         
     """
-    var = np.array(var)
-    ndim = var.ndim    
-
-    new_z = np.array(newz)
-    old_z = np.array(oldz)
-    if logintrp:
-        old_z = np.log(old_z)
-        new_z = np.log(new_z)
-    old_zn = var.shape[zdim]
-    new_zn = len(new_z)
-    
-    #roll z dim axis to last    
-    var = np.rollaxis(var,zdim,ndim)
-    old_shape = var.shape
-    new_shape = list(old_shape)
-    new_shape[-1] = new_zn
-    var = var.reshape(-1,old_zn)
-    if old_z.ndim == ndim:
-        out = np.empty((var.shape[0],new_zn))
-        old_z = np.rollaxis(old_z,zdim,ndim).reshape(-1,old_zn)
-        out = _internal.linear_interp(var, old_z, new_z)
-    elif old_z.ndim == 1:
-        f = scipy.interpolate.interp1d(old_z,var,kind='linear',bounds_error=bounds_error)
-        out = f(new_z)
-
-    #reroll lon dim axis to original dim
-    out = out.reshape(new_shape)
-    out = np.rollaxis(out,ndim-1,zdim)
-
+    if np.ndim(oldz) == 1:
+        if extrapolate is None:
+            extrapolate = 'error' if bounds_error else 'nan'
+        interp = _getvinterpolator(oldz, newz, logintrp, extrapolate)
+        return interp(var, zdim)
+
+    if extrapolate is None:
+        extrapolate = 'constant'
+    if not isinstance(oldz, np.ma.MaskedArray):
+        oldz = np.asarray(oldz)
+    if not _useworkers(workers):
+        workers = 1
+    interp = ColumnInterpolator(oldz, newz, zdim, logintrp=logintrp, extrapolate=extrapolate, workers=workers)
+    return interp(var)
+
+_DISTANCE_CHUNK = 65536
+
+def _haversine(lon1, lon2, lat1, lat2, out=None):
+    u"""
+    haversine公式による大円距離[m]。同じ形状の配列に対して計算し、outに書き込む。
+    """
+    phi1 = lat1*d2r
+    phi2 = lat2*d2r
+    h = np.sin((phi2 - phi1)*0.5)**2
+    h += np.cos(phi1)*np.cos(phi2)*np.sin((lon2 - lon1)*(0.5*d2r))**2
+    np.clip(h, 0., 1., out=h)
+    out = np.arctan2(np.sqrt(h), np.sqrt(1. - h), out=out)
+    out *= 2.*a0
     return out
 
-
-
 def distance(lon1,lon2,lat1,lat2):
     u"""
-    2点間の距離を計算する。
+    2点間の大円距離を計算する。
+
+    haversine公式を用いるので、近い2点間でも桁落ちしない。配列を与えた場合はブロードキャスト
+    した形状の結果を返し、一時配列が大きくならないように先頭の次元に沿って分割して計算する。
 
     :Arguments:
      **lon1, lon2** : float or ndarray of floats
@@ -836,30 +2279,237 @@ def distance(lon1,lon2,lat1,lat2):
         
     :Returns:
      **result** : floats or ndarray of floats
-        (lon1, lat1), (lon2, lat2) 間の距離 (km)
+        (lon1, lat1), (lon2, lat2) 間の距離 (m)
 
 
     **Examples**
 
     >>> from pymet.grid import distance
     >>> distance(100., 180., 30., 40.)   
+    >>> d = distance(lon[NA,:], 140., lat[:,NA], 35.)
+
+    .. seealso::
+
+       .. autosummary::
+          :nosignatures:
+
+          SphereIndex
+    """
+    args = [np.asarray(a, dtype=np.float64) for a in (lon1, lon2, lat1, lat2)]
+    shape = np.broadcast(*args).shape
+    if len(shape) == 0:
+        return _haversine(*[a.reshape(1) for a in args])[0]
+
+    out = np.empty(shape)
+    args = [np.broadcast_to(a, shape) for a in args]
+    rowsize = int(np.prod(shape[1:]))
+    step = max(_DISTANCE_CHUNK//max(rowsize, 1), 1)
+    for i in range(0, shape[0], step):
+        sl = slice(i, i+step)
+        _haversine(*[a[sl] for a in args], out=out[sl])
+    return out
+
+#=== 球面上の近傍探索 ==============================================================================
+
+def _unitvector(lon, lat):
+    u"""
+    経度、緯度(degrees)を単位球面上の3次元座標に変換する。最後の次元が(x, y, z)。
+    """
+    lon = np.asarray(lon, dtype=np.float64)*d2r
+    lat = np.asarray(lat, dtype=np.float64)*d2r
+    coslat = np.cos(lat)
+    return np.stack(np.broadcast_arrays(coslat*np.cos(lon), coslat*np.sin(lon), np.sin(lat)), axis=-1)
+
+def _chord(radius):
+    u"""
+    大円距離[m]を単位球面上の弦の長さに変換する。
+    """
+    return 2.*np.sin(np.minimum(np.asarray(radius, dtype=np.float64)/a0, PI)*0.5)
+
+class SphereIndex(object):
+    u"""
+    格子点の球面上の位置に対する空間インデックス。
+
+    格子点を単位球面上の3次元座標に変換してKD木(scipy.spatial.cKDTree)を1度だけ構築し、
+    指定した点から一定距離以内の格子点、最近傍の格子点、緯度経度の範囲内の格子点を
+    格子点数Nに対してO(log N)程度の計算量で探索する。距離は :py:func:`distance` と同じ
+    大円距離[m]で返す。
+
+    :Arguments:
+     **lon, lat** : array_like
+       格子点の経度、緯度(degrees)。1次元の座標軸を与えた場合は (len(lat), len(lon)) の
+       格子とし、同じ形状の配列を与えた場合はその各要素を格子点とする。
+     **leafsize** : int, optional
+       KD木の葉の大きさ。デフォルトは16。
+
+    :Attributes:
+     **shape** : tuple
+       格子の形状。返すインデックスはこの形状の配列に対するもの。
+     **lon, lat** : ndarray
+       格子点の経度、緯度を1次元にしたもの。
+
+    **Examples**
+     >>> index = SphereIndex(lon, lat)
+     >>> dist, (j, i) = index.queryradius(140., 35., 500.e3)
+     >>> composite = var[..., j, i]
+     >>> dist, (j, i) = index.query(stnlon, stnlat)
+     >>> mask = index.radiusmask(tclon, tclat, 300.e3)
+
+    .. note::
+       同じ座標の格子に対しては :py:func:`getsphereindex` を使うと、構築したインデックスを
+       再利用できる。
+
+    .. autosummary::
+
+       SphereIndex.query
+       SphereIndex.queryradius
+       SphereIndex.radiusmask
+       SphereIndex.querybox
+    """
+    def __init__(self, lon, lat, leafsize=16):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        if lon.ndim == 1 and lat.ndim == 1:
+            lon, lat = np.meshgrid(lon, lat)
+        elif lon.shape != lat.shape:
+            raise ValueError, "lon and lat must be 1-D axes or arrays of the same shape"
+        self.shape = lon.shape
+        self.lon = lon.ravel()
+        self.lat = lat.ravel()
+        self.size = self.lon.size
+        # 規則格子では中央値による分割が非常に遅い(極に同じ点が並ぶ)ので、中点分割で構築する
+        self.tree = cKDTree(_unitvector(self.lon, self.lat), leafsize=leafsize, balanced_tree=False)
+        # 緯度の範囲の探索用
+        self._latorder = np.argsort(self.lat, kind='mergesort')
+        self._latsorted = self.lat[self._latorder]
+
+    def _index(self, flat):
+        return np.unravel_index(flat, self.shape)
+
+    def _distance(self, lon, lat, flat):
+        return distance(lon, self.lon[flat], lat, self.lat[flat])
+
+    def query(self, lon, lat, k=1):
+        u"""
+        最近傍のk個の格子点を探す。
+
+        :Arguments:
+         **lon, lat** : float or array_like
+           探索する点の経度、緯度(degrees)。ブロードキャストできる形状。
+         **k** : int, optional
+           探す格子点の数。デフォルトは1。
+
+        :Returns:
+         **dist** : ndarray
+           格子点までの距離[m]。形状は探索する点の形状で、k>1の場合は最後に長さkの次元が付き、
+           近い順に並ぶ。
+         **index** : tuple of ndarrays
+           格子点のインデックス。distと同じ形状の配列を格子の次元の数だけ並べたもの。
+        """
+        if not 1 <= k <= self.size:
+            raise ValueError, "k must be between 1 and the number of grid points"
+        lon, lat = np.broadcast_arrays(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        chord, flat = self.tree.query(_unitvector(lon, lat), k=k)
+        if k > 1:
+            lon, lat = lon[...,NA], lat[...,NA]
+        return self._distance(lon, lat, flat), self._index(flat)
+
+    def queryradius(self, lon, lat, radius):
+        u"""
+        指定した点から半径radius以内の格子点を探す。
+
+        :Arguments:
+         **lon, lat** : float or array_like
+           探索する点の経度、緯度(degrees)。ブロードキャストできる形状。
+         **radius** : float
+           半径[m]。
+
+        :Returns:
+         **dist** : ndarray
+           格子点までの距離[m]。近い順に並ぶ。
+         **index** : tuple of ndarrays
+           格子点のインデックス。
+
+         lon, latがスカラーの場合は (dist, index) 、配列の場合は各点の (dist, index) を
+         1次元に並べたリストを返す。
+        """
+        lon, lat = np.broadcast_arrays(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        chord = _chord(radius)
+        points = _unitvector(lon.ravel(), lat.ravel())
+        result = []
+        for x, y, flat in zip(lon.ravel(), lat.ravel(), self.tree.query_ball_point(points, chord)):
+            flat = np.asarray(flat, dtype=np.intp)
+            dist = self._distance(x, y, flat)
+            order = np.argsort(dist, kind='mergesort')
+            result.append((dist[order], self._index(flat[order])))
+        if lon.ndim == 0:
+            return result[0]
+        return result
+
+    def radiusmask(self, lon, lat, radius):
+        u"""
+        指定した点のいずれかから半径radius以内の格子点でTrueとなる配列を返す。
+
+        :Arguments:
+         **lon, lat** : float or array_like
+           点の経度、緯度(degrees)。ブロードキャストできる形状。
+         **radius** : float
+           半径[m]。
+
+        :Returns:
+         **mask** : ndarray of bool
+           形状はshape。
+        """
+        lon, lat = np.broadcast_arrays(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        mask = np.zeros(self.size, dtype=bool)
+        points = _unitvector(lon.ravel(), lat.ravel())
+        for flat in self.tree.query_ball_point(points, _chord(radius)):
+            mask[flat] = True
+        return mask.reshape(self.shape)
+
+    def querybox(self, lonmin, lonmax, latmin, latmax):
+        u"""
+        経度lonmin～lonmax、緯度latmin～latmaxの範囲(境界を含む)の格子点を探す。
+
+        経度は360度の周期として扱い、lonmin > lonmax の場合は日付変更線をまたぐ範囲とする。
+
+        :Returns:
+         **index** : tuple of ndarrays
+           格子点のインデックス。格子の並びの順。
+        """
+        i0 = np.searchsorted(self._latsorted, latmin, side='left')
+        i1 = np.searchsorted(self._latsorted, latmax, side='right')
+        flat = self._latorder[i0:i1]
+        if lonmax - lonmin < 360.:
+            width = (lonmax - lonmin) % 360.
+            flat = flat[(self.lon[flat] - lonmin) % 360. <= width]
+        return self._index(np.sort(flat))
+
+_sphereindex_cache = collections.OrderedDict()
+_sphereindex_lock = threading.Lock()
+_SPHEREINDEX_CACHESIZE = 4
+
+def getsphereindex(lon, lat):
+    u"""
+    格子の空間インデックス :py:class:`SphereIndex` を返す。
+
+    座標の値が同じであれば、構築済みのものを再利用する。最近使われた4個の格子を保持する。
+
+    :Arguments:
+     **lon, lat** : array_like
+       格子点の経度、緯度(degrees)。 :py:class:`SphereIndex` を参照。
+
+    :Returns:
+     **index** : SphereIndex
     """
-    nx1, ny1 = np.size(lon1), np.size(lat1)
-    nx2, ny2 = np.size(lon2), np.size(lat2)
-
-    if nx1 == 1 and nx2 == 1 :
-        lon2 = np.asarray(lon2)
-        lat2 = np.asarray(lat2)
-    elif nx2 == 1 and ny2 == 1 :
-        lon1 = np.asarray(lon1)
-        lat1 = np.asarray(lat1)
-    elif nx1 > 1 and ny1 > 1 and nx2 > 1 and ny2 > 1:
-        lon1 = np.asarray(lon1)
-        lat1 = np.asarray(lat1)
-        lon2 = np.asarray(lon2)
-        lat2 = np.asarray(lat2)
-
-    return a0 * np.arccos(np.sin(lat1*d2r)*np.sin(lat2*d2r)
-                        +np.cos(lat1*d2r)*np.cos(lat2*d2r)*np.cos((lon2-lon1)*d2r))
+    key = (_arraykey(lon), _arraykey(lat))
+    with _sphereindex_lock:
+        index = _sphereindex_cache.pop(key, None)
+        if index is None:
+            index = SphereIndex(lon, lat)
+            if len(_sphereindex_cache) >= _SPHEREINDEX_CACHESIZE:
+                _sphereindex_cache.popitem(last=False)
+        _sphereindex_cache[key] = index
+    return index
 
 
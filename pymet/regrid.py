@@ -0,0 +1,421 @@
+# coding: utf-8
+u"""
+=====================================================
+水平格子の変換モジュール (:mod:`pymet.regrid`)
+=====================================================
+
+緯度経度格子の間でデータを内挿する。入力格子と出力格子の組に対して重みを一度だけ計算し、
+疎行列(scipy.sparse.csr_matrix)として保持して、先頭の任意の次元をまとめて1回の疎行列積で
+変換する。重みはメモリ上にキャッシュし、ディスクに保存して再利用することもできる。
+
+変換の方法
+==========
+
+================ ================================================================
+'bilinear'       双線形内挿。入力は1次元の緯度、経度座標の格子。
+'nearest'        大円距離で最も近い格子点の値。入力、出力とも任意の格子。
+'conservative'   1次の保存型内挿(格子の面積の重なりによる重み付き平均)。
+                 入力、出力とも1次元の緯度、経度座標の格子。
+================ ================================================================
+
+.. autosummary::
+
+   Regridder
+   getregridder
+   loadregridder
+   regrid
+
+-----------------------
+"""
+import numpy as np
+import collections
+import threading
+import hashlib
+import os
+import scipy.sparse as sparse
+import grid
+
+__all__ = ['Regridder', 'getregridder', 'loadregridder', 'regrid']
+
+_METHODS = ('bilinear', 'nearest', 'conservative')
+
+#=== 重みの計算 ====================================================================================
+
+def _iscyclic(lon, period=360.):
+    u"""
+    1次元の経度座標が全球を一周しているかどうかを返す。
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    if lon.ndim != 1 or lon.size < 2:
+        return False
+    dlon = abs(lon[1] - lon[0])
+    return abs(abs(lon[-1] - lon[0]) + dlon - period) < 1.e-3*dlon
+
+def _check1d(lon, lat, method):
+    if np.ndim(lon) != 1 or np.ndim(lat) != 1:
+        raise ValueError, "method '{0}' requires 1-D lon and lat".format(method)
+
+def _linearweights(x, xin, cyclic=False, extrapolate=False, period=360.):
+    u"""
+    座標xinに対して、点xを線形内挿するための両側の添字と重みを返す。
+
+    xinは単調であればよい(減少でもよい)。cyclic=Trueの場合はperiodの周期とする。
+    範囲外の点は、extrapolate=Trueなら端の値とし、Falseならvalid=Falseとする。
+
+    :Returns:
+     **i0, i1, w0, w1** : ndarray
+     **valid** : ndarray of bool
+    """
+    x = np.asarray(x, dtype=np.float64)
+    xin = np.asarray(xin, dtype=np.float64)
+    n = len(xin)
+    order = np.argsort(xin, kind='mergesort')
+    xs = xin[order]
+    if cyclic:
+        xs = np.r_[xs, xs[0] + period]
+        order = np.r_[order, order[0]]
+        x = (x - xs[0]) % period + xs[0]
+        k = np.clip(np.searchsorted(xs, x, side='right') - 1, 0, n-1)
+        valid = np.ones(x.shape, dtype=bool)
+    else:
+        k = np.clip(np.searchsorted(xs, x, side='right') - 1, 0, n-2)
+        valid = (x >= xs[0]) & (x <= xs[-1])
+    w1 = (x - xs[k])/(xs[k+1] - xs[k])
+    if extrapolate:
+        np.clip(w1, 0., 1., out=w1)
+        valid[...] = True
+    return order[k], order[k+1], 1. - w1, w1, valid
+
+def _bilinear(lonin, latin, lonout, latout, extrapolate=False):
+    u"""
+    双線形内挿の重み行列を返す。
+    """
+    _check1d(lonin, latin, 'bilinear')
+    nx = len(lonin)
+    ix0, ix1, wx0, wx1, vx = _linearweights(lonout, lonin, cyclic=_iscyclic(lonin), extrapolate=extrapolate)
+    iy0, iy1, wy0, wy1, vy = _linearweights(latout, latin, extrapolate=extrapolate)
+    rows = np.flatnonzero(vx & vy)
+    cols = [iy*nx + ix for iy in (iy0[rows], iy1[rows]) for ix in (ix0[rows], ix1[rows])]
+    data = [wy*wx for wy in (wy0[rows], wy1[rows]) for wx in (wx0[rows], wx1[rows])]
+    return np.tile(rows, 4), np.concatenate(cols), np.concatenate(data)
+
+def _nearest(lonin, latin, lonout, latout):
+    u"""
+    最近傍の格子点の値をとる重み行列を返す。
+    """
+    index = grid.getsphereindex(lonin, latin)
+    dist, idx = index.query(lonout, latout)
+    cols = np.ravel_multi_index(idx, index.shape)
+    rows = np.arange(cols.size)
+    return rows, cols, np.ones(cols.size)
+
+def _cellbounds(x, cyclic=False, period=360.):
+    u"""
+    格子点の中点を境界とするセルの下端、上端を返す。座標が減少する場合も下端<上端とする。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    mid = (x[1:] + x[:-1])/2.
+    if cyclic:
+        step = np.sign(x[-1] - x[0])*period
+        first = (x[-1] - step + x[0])/2.
+        last = (x[-1] + x[0] + step)/2.
+    else:
+        first = x[0] - (mid[0] - x[0])
+        last = x[-1] + (x[-1] - mid[-1])
+    b0 = np.r_[first, mid]
+    b1 = np.r_[mid, last]
+    return np.minimum(b0, b1), np.maximum(b0, b1)
+
+def _overlap(lo_out, hi_out, lo_in, hi_in, period=None):
+    u"""
+    出力セルと入力セルの区間の重なりの長さを (出力, 入力) の配列で返す。
+    periodを与えた場合は周期的な区間として扱う。
+    """
+    shifts = (0.,) if period is None else (-period, 0., period)
+    result = 0.
+    for shift in shifts:
+        lower = np.maximum(lo_out[:,None], lo_in[None,:] + shift)
+        upper = np.minimum(hi_out[:,None], hi_in[None,:] + shift)
+        result = result + np.maximum(upper - lower, 0.)
+    return result
+
+def _conservative(lonin, latin, lonout, latout):
+    u"""
+    1次の保存型内挿の重み行列を返す。
+
+    緯度経度格子のセルの面積は :math:`a^2\\Delta\\lambda\\Delta(\\sin\\phi)` なので、重なりの面積は
+    経度方向の重なりと sin(lat) の重なりの積となり、重み行列は両者のクロネッカー積で書ける。
+    出力セルのうち入力格子に覆われる部分で正規化する。
+    """
+    _check1d(lonin, latin, 'conservative')
+    _check1d(lonout, latout, 'conservative')
+    cycin, cycout = _iscyclic(lonin), _iscyclic(lonout)
+    xin = _cellbounds(lonin, cyclic=cycin)
+    xout = _cellbounds(lonout, cyclic=cycout)
+    wx = _overlap(xout[0], xout[1], xin[0], xin[1], period=360. if cycin else None)
+    sinlat = lambda b: np.sin(np.clip(b, -90., 90.)*grid.d2r)
+    yin = [sinlat(b) for b in _cellbounds(latin)]
+    yout = [sinlat(b) for b in _cellbounds(latout)]
+    wy = _overlap(yout[0], yout[1], yin[0], yin[1])
+    w = sparse.kron(sparse.csr_matrix(wy), sparse.csr_matrix(wx), format='coo')
+    # 出力セルのうち入力格子に覆われる面積で正規化する
+    area = np.asarray(w.sum(axis=1)).ravel()
+    keep = w.data > 0.
+    rows, cols, data = w.row[keep], w.col[keep], w.data[keep]
+    return rows, cols, data/area[rows]
+
+#=== 変換 ==========================================================================================
+
+def _gridshape(lon, lat):
+    u"""
+    格子の(緯度, 経度)の形状を返す。
+    """
+    if np.ndim(lon) == 2:
+        if np.shape(lon) != np.shape(lat):
+            raise ValueError, "2-D lon and lat must have the same shape"
+        return np.shape(lon)
+    return (np.size(lat), np.size(lon))
+
+def _points(lon, lat):
+    u"""
+    格子点の経度、緯度を1次元に並べて返す。
+    """
+    if np.ndim(lon) == 2:
+        return np.ravel(lon), np.ravel(lat)
+    lon, lat = np.meshgrid(lon, lat)
+    return lon.ravel(), lat.ravel()
+
+class Regridder(object):
+    u"""
+    緯度経度格子の間の変換。
+
+    入力格子の値を1次元に並べたベクトルに対する重み行列(出力格子点数×入力格子点数の
+    疎行列)を計算して保持する。 :py:meth:`__call__` は最後の2次元が(緯度, 経度)の配列を受け取り、
+    それより前の次元の各2次元場を同じ重み行列で変換する。
+
+    :Arguments:
+     **lonin, latin** : array_like
+       入力格子の経度、緯度(degrees)。1次元の座標軸、もしくは同じ形状の2次元配列('nearest'のみ)。
+     **lonout, latout** : array_like
+       出力格子の経度、緯度(degrees)。1次元の座標軸、もしくは同じ形状の2次元配列
+       ('conservative'では1次元のみ)。
+     **method** : {'bilinear', 'nearest', 'conservative'}, optional
+       変換の方法。デフォルトは'bilinear'。
+     **extrapolate** : bool, optional
+       'bilinear'で入力格子の範囲外の点を端の値とするかどうか。Falseの場合は欠損とする。
+       デフォルトはFalse。経度が全球を一周している入力格子では、経度方向は周期的に内挿する。
+     **weights** : scipy.sparse matrix, optional
+       計算済みの重み行列。与えた場合は重みを計算しない。
+
+    :Attributes:
+     **weights** : scipy.sparse.csr_matrix
+       重み行列。
+     **shapein, shapeout** : tuple
+       入力、出力格子の(緯度, 経度)の形状。
+
+    **Examples**
+     >>> rg = Regridder(lon1, lat1, lon25, lat25, method='conservative')
+     >>> t25 = rg(t1)            # t1.shape == (nt, nz, 181, 360)
+     >>> t25.shape
+     (nt, nz, 73, 144)
+
+    .. note::
+       入力に欠損値(MaskedArray)がある場合は、欠損でない入力格子点の重みで正規化した値を返し、
+       欠損でない入力格子点の重みがない出力格子点を欠損とする。
+
+    .. seealso::
+
+       .. autosummary::
+          :nosignatures:
+
+          getregridder
+          pymet.field.regrid
+    """
+    def __init__(self, lonin, latin, lonout, latout, method='bilinear', extrapolate=False, weights=None):
+        if not method in _METHODS:
+            raise ValueError, "method must be one of {0}, not '{1}'".format(_METHODS, method)
+        self.method = method
+        self.shapein = _gridshape(lonin, latin)
+        self.shapeout = _gridshape(lonout, latout)
+        nin, nout = np.prod(self.shapein), np.prod(self.shapeout)
+        if weights is None:
+            if method == 'bilinear':
+                rows, cols, data = _bilinear(lonin, latin, *_points(lonout, latout), extrapolate=extrapolate)
+            elif method == 'nearest':
+                rows, cols, data = _nearest(lonin, latin, *_points(lonout, latout))
+            else:
+                rows, cols, data = _conservative(lonin, latin, lonout, latout)
+            weights = sparse.csr_matrix((data, (rows, cols)), shape=(nout, nin))
+        else:
+            weights = sparse.csr_matrix(weights)
+            if weights.shape != (nout, nin):
+                raise ValueError, "weights must have shape {0}, not {1}".format((nout, nin), weights.shape)
+        self.weights = weights
+        # 重みをもたない(入力格子の範囲外の)出力格子点
+        self._empty = np.diff(weights.indptr) == 0
+        self._typed = {np.dtype(weights.dtype): weights}
+
+    def __call__(self, var):
+        u"""
+        変換する。
+
+        :Arguments:
+         **var** : array_like
+           最後の2次元が入力格子の(緯度, 経度)である配列。
+
+        :Returns:
+         **result** : ndarray or MaskedArray
+           最後の2次元を出力格子の形状にした配列。入力が欠損値をもつ場合、もしくは入力格子の
+           範囲外の出力格子点がある場合はMaskedArray。
+
+        .. note::
+           先頭の次元の各2次元場に同じ疎行列を順に掛ける。入力がfloat32の場合は重みもfloat32に
+           して計算し、結果もfloat32で返す。
+        """
+        masked = np.ma.isMaskedArray(var) and np.ma.getmask(var) is not np.ma.nomask
+        var = np.ma.asarray(var) if masked else np.asarray(var)
+        if var.shape[-2:] != self.shapein:
+            raise ValueError, "last two dimensions must be {0}, not {1}".format(self.shapein, var.shape[-2:])
+        lead = var.shape[:-2]
+        dtype = np.float32 if var.dtype == np.float32 else np.result_type(var.dtype, np.float64)
+        weights = self._typedweights(dtype)
+        x = np.ma.getdata(var).reshape(-1, self.weights.shape[1])
+        out = np.empty((x.shape[0], self.weights.shape[0]), dtype=dtype)
+        if masked:
+            valid = ~np.ma.getmaskarray(var).reshape(x.shape)
+            mask = np.empty(out.shape, dtype=bool)
+            for i in range(x.shape[0]):
+                num = weights.dot(np.where(valid[i], x[i], 0))
+                den = weights.dot(valid[i].astype(dtype))
+                np.less_equal(den, 1.e-6, out=mask[i])
+                den[mask[i]] = 1.
+                np.divide(num, den, out=out[i])
+        else:
+            for i in range(x.shape[0]):
+                out[i] = weights.dot(x[i])
+            mask = self._empty if self._empty.any() else None
+        out = out.reshape(lead + self.shapeout)
+        if masked:
+            return np.ma.array(out, mask=mask.reshape(out.shape), copy=False)
+        if mask is not None:
+            return np.ma.array(out, mask=np.broadcast_to(mask.reshape(self.shapeout), out.shape).copy(),
+                               copy=False)
+        return out
+
+    def _typedweights(self, dtype):
+        u"""
+        dtypeに変換した重み行列を返す。変換したものは保持しておく。
+        """
+        dtype = np.dtype(dtype)
+        weights = self._typed.get(dtype)
+        if weights is None:
+            weights = self._typed[dtype] = self.weights.astype(dtype)
+        return weights
+
+    def save(self, path):
+        u"""
+        重み行列をnpz形式でpathに保存する。 :py:func:`loadregridder` で読み込む。
+        """
+        w = self.weights
+        np.savez(path, data=w.data, indices=w.indices, indptr=w.indptr, shape=w.shape,
+                 shapein=self.shapein, shapeout=self.shapeout, method=self.method)
+
+def loadregridder(path):
+    u"""
+    :py:meth:`Regridder.save` で保存した重みから :py:class:`Regridder` を作る。
+
+    :Arguments:
+     **path** : str
+       ファイル名。
+
+    :Returns:
+     **regridder** : Regridder
+    """
+    f = np.load(path)
+    try:
+        weights = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        (nyi, nxi), (nyo, nxo) = f['shapein'], f['shapeout']
+        method = str(f['method'])
+    finally:
+        f.close()
+    return Regridder(np.empty(nxi), np.empty(nyi), np.empty(nxo), np.empty(nyo), method=method, weights=weights)
+
+def _gridhash(method, extrapolate, *coords):
+    u"""
+    変換の方法と座標の値から、重みを保存するファイル名に用いるハッシュを作る。
+    """
+    h = hashlib.sha1(method + str(bool(extrapolate)))
+    for c in coords:
+        c = np.ascontiguousarray(c, dtype=np.float64)
+        h.update(str(c.shape))
+        h.update(c.tobytes())
+    return h.hexdigest()
+
+_regridder_cache = collections.OrderedDict()
+_regridder_lock = threading.Lock()
+_REGRIDDER_CACHESIZE = 8
+
+def getregridder(lonin, latin, lonout, latout, method='bilinear', extrapolate=False, cachedir=None):
+    u"""
+    :py:class:`Regridder` を返す。
+
+    座標の値と方法が同じであれば計算済みのものを再利用する。最近使われた8個を保持する。
+    cachedirを与えた場合は、座標と方法から作ったハッシュをファイル名として重みをディレクトリに
+    保存し、次回以降(別のプロセスからでも)そのファイルを読み込む。
+
+    :Arguments:
+     **lonin, latin, lonout, latout, method, extrapolate** :
+       :py:class:`Regridder` を参照。
+     **cachedir** : str, optional
+       重みを保存するディレクトリ。
+
+    :Returns:
+     **regridder** : Regridder
+
+    **Examples**
+     >>> rg = getregridder(lon1, lat1, lon25, lat25, method='conservative', cachedir='~/.pymet/regrid')
+    """
+    key = (method, bool(extrapolate),
+           grid._arraykey(lonin), grid._arraykey(latin), grid._arraykey(lonout), grid._arraykey(latout))
+    with _regridder_lock:
+        regridder = _regridder_cache.pop(key, None)
+        if regridder is None:
+            path = None
+            if cachedir is not None:
+                cachedir = os.path.expanduser(cachedir)
+                name = _gridhash(method, extrapolate, lonin, latin, lonout, latout)
+                path = os.path.join(cachedir, 'regrid_{0}_{1}.npz'.format(method, name))
+            if path is not None and os.path.exists(path):
+                regridder = loadregridder(path)
+            else:
+                regridder = Regridder(lonin, latin, lonout, latout, method=method, extrapolate=extrapolate)
+                if path is not None:
+                    if not os.path.isdir(cachedir):
+                        os.makedirs(cachedir)
+                    regridder.save(path)
+            if len(_regridder_cache) >= _REGRIDDER_CACHESIZE:
+                _regridder_cache.popitem(last=False)
+        _regridder_cache[key] = regridder
+    return regridder
+
+def regrid(var, lonin, latin, lonout, latout, method='bilinear', extrapolate=False, cachedir=None):
+    u"""
+    最後の2次元が(緯度, 経度)の配列を別の緯度経度格子に変換する。
+
+    :Arguments:
+     **var** : array_like
+       入力データ。最後の2次元が入力格子の(緯度, 経度)。
+     **lonin, latin, lonout, latout, method, extrapolate, cachedir** :
+       :py:func:`getregridder` を参照。
+
+    :Returns:
+     **result** : ndarray or MaskedArray
+       最後の2次元を出力格子の形状にした配列。
+
+    **Examples**
+     >>> lon25, lat25 = np.arange(0, 360, 2.5), np.arange(-90, 90.1, 2.5)
+     >>> t25 = regrid(t, lon, lat, lon25, lat25, method='conservative')
+    """
+    regridder = getregridder(lonin, latin, lonout, latout, method=method, extrapolate=extrapolate,
+                             cachedir=cachedir)
+    return regridder(var)
@@ -0,0 +1,314 @@
+# coding: utf-8
+u"""
+=============================================
+水平平滑化モジュール (:mod:`pymet.smooth`)
+=============================================
+
+緯度経度格子のデータに水平方向の平滑化、空間フィルタをかける。フィルタはいずれも経度方向と
+緯度方向の1次元フィルタの組み合わせ(分離型)で、経度方向は周期境界として扱える。緯度、経度
+以外の次元はまとめて1回の演算で処理する。
+
+欠損値(MaskedArray)の格子点と、周期境界でない方向の両端の外側は値をもたないものとし、
+有効な格子点にかかる重みの和で正規化する。欠損値の格子点は結果でも欠損とする。
+
+.. autosummary::
+
+   smooth
+   gaussfilter
+   zonaltrunc
+   lanczos2d
+
+-----------------------
+"""
+import numpy as np
+import scipy.ndimage as ndimage
+import scipy.fftpack as fftpack
+import constants
+import grid
+import tools
+
+a0 = constants.earth_radius
+d2r = constants.pi/180.
+
+__all__ = ['smooth', 'gaussfilter', 'zonaltrunc', 'lanczos2d']
+
+#=== 共通処理 ======================================================================================
+
+def _prepare(var):
+    u"""
+    入力を浮動小数点のndarrayと有効な格子点を表す配列(欠損値がなければNone)に分ける。
+    float32の入力はfloat32のまま計算する。
+    """
+    data = np.ma.getdata(var)
+    dtype = np.float32 if data.dtype == np.float32 else np.result_type(data.dtype, np.float64)
+    data = np.asarray(data, dtype=dtype)
+    mask = np.ma.getmask(var)
+    if mask is np.ma.nomask or not mask.any():
+        return data, None
+    return data, ~mask
+
+def _correlate(data, weights, axis, cyclic, out=None):
+    u"""
+    axisに沿って対称な重みweightsをかける。cyclic=Falseの場合、両端の外側は0とする。
+    """
+    if len(weights) > data.shape[axis]:
+        raise ValueError, "filter length {0} exceeds the dimension length {1}".format(len(weights), data.shape[axis])
+    return ndimage.correlate1d(data, weights, axis=axis, output=out, mode='wrap' if cyclic else 'constant')
+
+def _normalize(var, apply, xdim, ydim):
+    u"""
+    線形なフィルタapply(data)を、有効な格子点にかかる重みの和で割って正規化する。
+
+    欠損値がない場合は、重みの和は緯度、経度以外の次元によらないので、長さ1の次元に
+    置き換えた配列で計算する。
+    """
+    data, valid = _prepare(var)
+    if valid is None:
+        shape = [1]*data.ndim
+        shape[xdim], shape[ydim] = data.shape[xdim], data.shape[ydim]
+        out = apply(data)
+        out /= apply(np.ones(shape, dtype=data.dtype))
+        return out
+    num = apply(np.where(valid, data, 0))
+    den = apply(valid.astype(data.dtype))
+    bad = ~valid
+    bad |= den <= 1.e-6
+    den[bad] = 1.
+    num /= den
+    return np.ma.array(num, mask=bad, copy=False)
+
+def _axes(var, xdim, ydim):
+    ndim = np.ndim(var)
+    if ndim < 2:
+        raise ValueError, "input array must have at least 2 dimensions"
+    return xdim % ndim, ydim % ndim
+
+#=== フィルタ ======================================================================================
+
+def smooth(var, xdim, ydim, npoint=9, weight=0.25, niter=1, cyclic=True):
+    ur"""
+    n点平滑化。
+
+    :Arguments:
+     **var** : array_like
+       入力データ。MaskedArrayでもよい。
+     **xdim, ydim** : int
+       経度、緯度の軸
+     **npoint** : {9, 5}, optional
+       9点平滑化もしくは5点平滑化。デフォルトは9。
+     **weight** : float, optional
+       1方向の隣接点にかける重み s 。デフォルトは0.25。
+     **niter** : int, optional
+       繰り返しの回数。デフォルトは1。
+     **cyclic** : bool, optional
+       東西の境界を周期境界として扱うかどうか。デフォルトはTrue。
+
+    :Returns:
+     **out** : ndarray or MaskedArray
+       varと同じ形状の配列。
+
+    .. note::
+       1次元の3点フィルタ :math:`S_{x}a_{i} = s a_{i-1} + (1-2s) a_{i} + s a_{i+1}` を用いて、
+       9点平滑化は :math:`S_{y}S_{x}a` 、5点平滑化は :math:`(S_{x} + S_{y} - 1)a` で計算する。
+       s=0.25の9点平滑化は1-2-1フィルタを2方向にかけたものになる。
+
+    **Examples**
+     >>> z500s = smooth(z500, 3, 2, npoint=9, niter=2)
+    """
+    xdim, ydim = _axes(var, xdim, ydim)
+    w = np.array([weight, 1. - 2.*weight, weight])
+    if npoint == 9:
+        def apply(a):
+            out = _correlate(a, w, xdim, cyclic)
+            return _correlate(out, w, ydim, False, out=out)
+    elif npoint == 5:
+        def apply(a):
+            out = _correlate(a, w, xdim, cyclic)
+            out += _correlate(a, w, ydim, False)
+            out -= a
+            return out
+    else:
+        raise ValueError, "npoint must be 5 or 9, not {0}".format(npoint)
+    out = var
+    for i in range(niter):
+        out = _normalize(out, apply, xdim, ydim)
+    return out
+
+def gaussfilter(var, lon, lat, xdim, ydim, sigma, cyclic=True, truncate=4.):
+    ur"""
+    ガウシアンフィルタ。
+
+    水平距離 r [m] に対して :math:`\exp(-r^{2}/2\sigma^{2})` の重みをかける。経度方向の幅は
+    各緯度の格子間隔 :math:`a\cos\phi\Delta\lambda` で換算するので、高緯度ほど多くの格子点を
+    平均する(極では東西平均となる)。
+
+    :Arguments:
+     **var** : array_like
+       入力データ。MaskedArrayでもよい。
+     **lon, lat** : array_like
+       経度と緯度(1次元)
+     **xdim, ydim** : int
+       経度、緯度の軸
+     **sigma** : float
+       ガウス関数の標準偏差 [m]
+     **cyclic** : bool, optional
+       東西の境界を周期境界として扱うかどうか。デフォルトはTrue。
+     **truncate** : float, optional
+       重みを打ち切る距離(sigmaの倍数)。デフォルトは4.。周期境界の経度方向は
+       フーリエ空間で計算するので打ち切らない。
+
+    :Returns:
+     **out** : ndarray or MaskedArray
+       varと同じ形状の配列。
+
+    **Examples**
+     >>> t2ms = gaussfilter(t2m, lon, lat, 2, 1, 500.e3)
+    """
+    if np.ndim(lon) != 1 or np.ndim(lat) != 1:
+        raise ValueError, "gaussfilter requires 1-D lon and lat"
+    if sigma <= 0:
+        raise ValueError, "sigma must be positive"
+    xdim, ydim = _axes(var, xdim, ydim)
+    ndim = np.ndim(var)
+    lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    nx = len(lon)
+    dlon = np.abs(np.mean(np.diff(lon)))*d2r
+    dlat = np.abs(np.mean(np.diff(lat)))*d2r
+    # 緯度方向は格子点数で一定の幅
+    wy = _gaussweights(sigma/(a0*dlat), truncate, np.shape(var)[ydim])
+    # 経度方向の幅(格子点数)は緯度ごとに異なる
+    with np.errstate(divide='ignore'):
+        sx = sigma/(a0*np.cos(lat*d2r).clip(0., None)*dlon)
+    if cyclic:
+        m = _wavenumber(nx)
+        with np.errstate(invalid='ignore'):
+            response = np.exp(-0.5*(2.*np.pi*m[np.newaxis, :]*sx[:, np.newaxis]/nx)**2)
+        response[:, 0] = 1.
+        shape = [1]*ndim
+        shape[ydim], shape[xdim] = response.shape
+        response = (response if ydim < xdim else response.T).reshape(shape)
+        def xfilter(a):
+            spec = fftpack.rfft(a, axis=xdim)
+            spec *= response
+            return fftpack.irfft(spec, axis=xdim, overwrite_x=True)
+    else:
+        wx = [_gaussweights(min(s, nx), truncate, nx) for s in sx]
+        def xfilter(a):
+            out = np.empty_like(a)
+            for j, w in enumerate(wx):
+                sl = grid._axslice(ndim, ydim, slice(j, j+1))
+                _correlate(a[sl], w, xdim, False, out=out[sl])
+            return out
+    def apply(a):
+        out = xfilter(a)
+        return _correlate(out, wy, ydim, False, out=out)
+    return _normalize(var, apply, xdim, ydim)
+
+def _gaussweights(s, truncate, nmax=None):
+    u"""
+    格子点数で表した標準偏差sのガウス関数の重み。
+    """
+    n = int(np.ceil(truncate*s))
+    if nmax is not None:
+        n = min(n, (nmax - 1)//2)
+    k = np.arange(-n, n+1)
+    w = np.exp(-0.5*(k/max(s, 1.e-6))**2)
+    return w/w.sum()
+
+def _wavenumber(n):
+    u"""
+    scipy.fftpack.rfftの出力の各要素の波数。
+    """
+    return (np.arange(n) + 1)//2
+
+def zonaltrunc(var, xdim, kmax, kmin=0):
+    u"""
+    東西波数で切断する。
+
+    経度方向にフーリエ変換し、東西波数kmin以上kmax以下の成分だけを残す。経度は全球を
+    等間隔に覆っていること。
+
+    :Arguments:
+     **var** : array_like
+       入力データ。欠損値を含まないこと。
+     **xdim** : int
+       経度の軸
+     **kmax** : int
+       残す最大の東西波数
+     **kmin** : int, optional
+       残す最小の東西波数。デフォルトは0(東西平均を含む)。
+
+    :Returns:
+     **out** : ndarray
+       varと同じ形状の配列。
+
+    **Examples**
+     東西波数1-3の成分を取り出す。
+      >>> z500w = zonaltrunc(z500, 3, 3, kmin=1)
+    """
+    data, valid = _prepare(var)
+    if valid is not None:
+        raise ValueError, "zonaltrunc cannot handle masked values"
+    if kmin < 0 or kmax < kmin:
+        raise ValueError, "wavenumbers must satisfy 0 <= kmin <= kmax"
+    xdim = xdim % data.ndim
+    m = _wavenumber(data.shape[xdim])
+    spec = fftpack.rfft(data, axis=xdim)
+    spec *= tools.expand((m >= kmin) & (m <= kmax), data.ndim, axis=xdim)
+    return fftpack.irfft(spec, axis=xdim, overwrite_x=True)
+
+def lanczos2d(var, xdim, ydim, cutoff, length=None, cyclic=True):
+    ur"""
+    分離型の2次元Lanczos低周波フィルタ。
+
+    :Arguments:
+     **var** : array_like
+       入力データ。MaskedArrayでもよい。
+     **xdim, ydim** : int
+       経度、緯度の軸
+     **cutoff** : float or tuple
+       カットオフ波長(格子点数)。(経度方向, 緯度方向)のタプルで別々に与えることもできる。
+       2より大きいこと。
+     **length** : int or tuple, optional
+       重みの項数(奇数)。デフォルトは各方向について 2*cutoff+1 を超えない最大の奇数。
+     **cyclic** : bool, optional
+       東西の境界を周期境界として扱うかどうか。デフォルトはTrue。
+
+    :Returns:
+     **out** : ndarray or MaskedArray
+       varと同じ形状の配列。
+
+    .. note::
+       各方向の重みは :py:func:`pymet.stats.lancoz` と同じ
+
+       .. math:: w_{k} = 2f_{c}\,{\rm sinc}(2f_{c}k)\,{\rm sinc}(k/n) \hspace{3em} k = -n, \ldots, n
+
+       で、和が1になるように正規化する。
+
+    **Examples**
+     >>> z500l = lanczos2d(z500, 3, 2, 10)
+    """
+    xdim, ydim = _axes(var, xdim, ydim)
+    cutoffs = cutoff if np.iterable(cutoff) else (cutoff, cutoff)
+    lengths = length if np.iterable(length) else (length, length)
+    wx, wy = [_lanczosweights(c, l) for c, l in zip(cutoffs, lengths)]
+    def apply(a):
+        out = _correlate(a, wx, xdim, cyclic)
+        return _correlate(out, wy, ydim, False, out=out)
+    return _normalize(var, apply, xdim, ydim)
+
+def _lanczosweights(cutoff, length=None):
+    u"""
+    カットオフ波長cutoff(格子点数)、項数lengthのLanczos低周波フィルタの重み。
+    """
+    if cutoff <= 2:
+        raise ValueError, "cutoff must be larger than 2 grid points, not {0}".format(cutoff)
+    if length is None:
+        length = 2*int(cutoff) + 1
+    elif length % 2 == 0:
+        raise ValueError, "length must be odd number"
+    n = length//2
+    fc = 1./cutoff
+    k = np.arange(-n, n+1)
+    w = 2.*fc*np.sinc(2.*fc*k)*np.sinc(k/float(n))
+    return w/w.sum()
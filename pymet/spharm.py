@@ -0,0 +1,576 @@
+# coding: utf-8
+u"""
+=====================================================
+球面調和関数変換モジュール (:mod:`pymet.spharm`)
+=====================================================
+
+全球の緯度経度格子(ガウス格子もしくは等間隔格子)のデータを球面調和関数で展開し、
+スペクトル空間で微分演算を行う。経度方向はFFT、緯度方向は正規化ルジャンドル陪関数による
+求積で変換する。ルジャンドル関数と求積の重みは格子ごとに計算してキャッシュする。
+
+差分による :py:mod:`pymet.grid` の関数と異なり、極の近傍でも精度が落ちない。
+
+変換
+====
+
+.. autosummary::
+
+   Spharmt
+   getspharmt
+
+微分演算
+========
+
+.. autosummary::
+
+   div
+   rot
+   grad
+   laplacian
+   invlaplacian
+   truncate
+
+-----------------------
+"""
+import numpy as np
+import collections
+import threading
+import constants
+import grid
+
+a0 = constants.earth_radius
+
+__all__ = ['Spharmt', 'getspharmt',
+           'div', 'rot', 'grad', 'laplacian', 'invlaplacian', 'truncate']
+
+#=== ルジャンドル関数と求積 ========================================================================
+
+def _legendre(mu, ntrunc):
+    ur"""
+    正規化ルジャンドル陪関数とその緯度微分を計算する。
+
+    正規化は :math:`\frac{1}{2}\int_{-1}^{1} (\bar{P}_{n}^{m})^2 d\mu = 1` とする。
+    m = 0, ..., ntrunc について、n = m, ..., ntrunc の値を行にもつ配列のリストを返す。
+
+    :Returns:
+     **P**  : :math:`\bar{P}_{n}^{m}`
+     **Q**  : :math:`\bar{P}_{n}^{m}/\cos\phi` 。m=0ではNone。
+     **dP** : :math:`d\bar{P}_{n}^{m}/d\phi`
+    """
+    nlat = len(mu)
+    coslat = np.sqrt(1. - mu**2)
+    eps = lambda n, m: np.sqrt((n**2 - m**2)/(4.*n**2 - 1.))
+
+    def recurrence(start, nn, m):
+        # n = m, m+1, ... の3項漸化式
+        p = np.empty((len(nn), nlat))
+        p[0] = start
+        if len(nn) > 1:
+            p[1] = np.sqrt(2.*m+3.) * mu * start
+        for i in range(2, len(nn)):
+            p[i] = (mu*p[i-1] - eps(nn[i]-1., m)*p[i-2]) / eps(float(nn[i]), m)
+        return p
+
+    def cosdpdmu(p, nn, m):
+        # (1-mu^2) dP_n/dmu = -n eps_{n+1} P_{n+1} + (n+1) eps_n P_{n-1}
+        n = nn[:-1, np.newaxis].astype(float)
+        pminus = np.vstack((np.zeros((1, nlat)), p[:-2]))
+        return -n*eps(n+1., m)*p[1:] + (n+1.)*eps(n, m)*pminus
+
+    P, Q, dP = [], [], []
+    pmm = np.ones(nlat)
+    for m in range(ntrunc+1):
+        nn = np.arange(m, ntrunc+2)   # 微分にはntrunc+1までを用いる
+        if m == 0:
+            p = recurrence(pmm, nn, m)
+            # m=0 の微分は極で0
+            d = np.zeros((len(nn)-1, nlat))
+            np.divide(cosdpdmu(p, nn, m), coslat, out=d, where=coslat>0)
+            Q.append(None)
+        else:
+            # P/cos(phi) も同じ漸化式を満たすので、極でも割り算をせずに計算できる
+            qmm = np.sqrt((2.*m+1.)/(2.*m)) * pmm
+            pmm = qmm * coslat
+            p = recurrence(pmm, nn, m)
+            q = recurrence(qmm, nn, m)
+            d = cosdpdmu(q, nn, m)
+            Q.append(q[:-1])
+        P.append(p[:-1])
+        dP.append(d)
+    return P, Q, dP
+
+def _quadrature(lat, gridtype=None):
+    u"""
+    緯度方向の求積点 mu=sin(lat) と重みを入力と同じ順序で返す。重みの和は2。
+
+    ガウス格子ではガウス・ルジャンドル求積を用いる。等間隔格子では余緯度の余弦級数
+    :math:`\cos k\theta\ (k < n)` を厳密に積分する重み(離散コサイン変換に基づく)を用いる。
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    nlat = len(lat)
+    if gridtype is None:
+        gridtype = 'gaussian' if _isgaussian(lat) else 'regular'
+    if gridtype == 'gaussian':
+        if not _isgaussian(lat):
+            raise ValueError, "lat is not a Gaussian grid with {0} latitudes".format(nlat)
+        mu, w = np.polynomial.legendre.leggauss(nlat)
+        if lat[0] > lat[-1]:
+            mu, w = mu[::-1], w[::-1]
+        return mu, w
+    elif gridtype == 'regular':
+        dlat = np.diff(lat)
+        if not np.allclose(dlat, dlat[0], rtol=1e-4, atol=0) or 180./abs(dlat[0]) > nlat + 1e-6:
+            raise ValueError, "lat must be equally spaced and cover the whole sphere"
+        theta = np.deg2rad(90. - lat)
+        k = np.arange(nlat)
+        moment = np.where(k % 2 == 0, 2./(1. - k**2 + (k == 1)), 0.)
+        w = np.linalg.solve(np.cos(k[:, np.newaxis]*theta[np.newaxis, :]), moment)
+        return np.cos(theta), w
+    else:
+        raise ValueError, "gridtype must be 'gaussian' or 'regular', not '{0}'".format(gridtype)
+
+def _isgaussian(lat):
+    u"""
+    latがガウス緯度かどうかを判定する。
+    """
+    mu = np.polynomial.legendre.leggauss(len(lat))[0]
+    return np.allclose(np.sort(lat), np.rad2deg(np.arcsin(mu)), rtol=0, atol=1e-3)
+
+#=== 変換 ==========================================================================================
+
+class Spharmt(object):
+    ur"""
+    全球緯度経度格子の球面調和関数変換。
+
+    スペクトル係数は、m = 0, ..., ntrunc について n = m, ..., ntrunc の順に並べた複素数の
+    1次元配列(最後の軸)で表す。
+
+    .. math:: f(\lambda,\phi) = \sum_{m=-N}^{N}\sum_{n=|m|}^{N} f_{n}^{m} \bar{P}_{n}^{m}(\sin\phi)e^{im\lambda}
+
+    :Arguments:
+     **lon, lat** : array_like
+      経度、緯度 [degrees]。経度は東向きに等間隔で全球を覆うこと。緯度はガウス緯度もしくは
+      等間隔(極を含む場合、含まない場合のどちらでもよい)で、南北どちら向きでもよい。
+     **ntrunc** : int, optional
+      三角切断の波数。デフォルトは格子で表現できる最大の波数で、ガウス格子では nlat-1、
+      等間隔格子では (nlat-1)/2 (いずれも (nlon-1)/2 を超えない)。
+     **gridtype** : {None, 'gaussian', 'regular'}, optional
+      緯度格子の種類。Noneの場合は緯度の値から判定する。
+     **rsphere** : float, optional
+      球の半径 [m]。デフォルトは地球半径。
+
+    **Attributes**
+
+    ========= ===============================================
+    nlon      経度の格子数
+    nlat      緯度の格子数
+    ntrunc    切断波数
+    nmodes    スペクトル係数の数
+    order     各係数の東西波数 m
+    degree    各係数の全波数 n
+    ========= ===============================================
+
+    .. note::
+       等間隔格子の求積は緯度の格子数の半分の全波数までしか厳密でないため、同じ解像度の
+       ガウス格子に比べて切断波数は小さくなる。
+
+    **Examples**
+     >>> sp = getspharmt(lon, lat)
+     >>> spec = sp.grdtospec(z500)           # z500[..., lat, lon]
+     >>> z500_t42 = sp.spectogrd(spec * (sp.degree <= 42))
+    """
+    def __init__(self, lon, lat, ntrunc=None, gridtype=None, rsphere=a0):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        nlon, nlat = len(lon), len(lat)
+        dlon = np.diff(lon)
+        if not np.allclose(dlon, 360./nlon, rtol=1e-4, atol=0):
+            raise ValueError, "lon must be equally spaced eastward and cover the whole sphere"
+        mu, w = _quadrature(lat, gridtype)
+        gaussian = gridtype == 'gaussian' or (gridtype is None and _isgaussian(lat))
+        nmax = min(nlat-1 if gaussian else (nlat-1)//2, (nlon-1)//2)
+        if ntrunc is None:
+            ntrunc = nmax
+        elif ntrunc > nmax or ntrunc < 0:
+            raise ValueError, "ntrunc must be between 0 and {0} for this grid, not {1}".format(nmax, ntrunc)
+
+        self.nlon, self.nlat = nlon, nlat
+        self.ntrunc = ntrunc
+        self.rsphere = rsphere
+        self.weights = w
+        self._P, self._Q, self._dP = _legendre(mu, ntrunc)
+        self._halfw = 0.5*w
+        self.order  = np.concatenate([np.repeat(m, ntrunc+1-m) for m in range(ntrunc+1)])
+        self.degree = np.concatenate([np.arange(m, ntrunc+1) for m in range(ntrunc+1)])
+        self.nmodes = len(self.degree)
+        self._offsets = np.r_[0, np.cumsum(ntrunc+1-np.arange(ntrunc+1))]
+
+    def _mslice(self, m):
+        return slice(self._offsets[m], self._offsets[m+1])
+
+    def _check(self, data):
+        if data.shape[-2:] != (self.nlat, self.nlon):
+            raise ValueError, "last two dimensions must be (nlat, nlon) = {0}, not {1}".format(
+                (self.nlat, self.nlon), data.shape[-2:])
+
+    def _fourier(self, data):
+        u"""
+        経度方向のフーリエ係数 f_m(phi) (m = 0, ..., ntrunc) を返す。
+        """
+        return np.fft.rfft(data, axis=-1)[..., :self.ntrunc+1] / self.nlon
+
+    def _invfourier(self, fm):
+        u"""
+        フーリエ係数から格子点の値に戻す。
+        """
+        shape = fm.shape[:-1] + (self.nlon//2+1,)
+        full = np.zeros(shape, dtype=np.complex128)
+        full[..., :self.ntrunc+1] = fm
+        return np.fft.irfft(full * self.nlon, n=self.nlon, axis=-1)
+
+    def _analysis(self, fm, table, m):
+        u"""
+        緯度方向の求積 sum_j w_j/2 f_m(phi_j) table[n, j] 。
+        """
+        x = fm * self._halfw
+        return np.dot(x.real, table[m].T) + 1j*np.dot(x.imag, table[m].T)
+
+    def _synthesis(self, spec, table, m):
+        u"""
+        sum_n spec_n table[n, j] 。
+        """
+        s = spec[..., self._mslice(m)]
+        return np.dot(s.real, table[m]) + 1j*np.dot(s.imag, table[m])
+
+    def grdtospec(self, data):
+        u"""
+        格子点の値をスペクトル係数に変換する。
+
+        :Arguments:
+         **data** : array_like
+          最後の2軸が(緯度, 経度)の配列。
+        :Returns:
+         **spec** : complex ndarray
+          形状は data.shape[:-2] + (nmodes,) 。
+        """
+        data = np.asarray(data, dtype=np.float64)
+        self._check(data)
+        fm = self._fourier(data)
+        spec = np.empty(data.shape[:-2] + (self.nmodes,), dtype=np.complex128)
+        for m in range(self.ntrunc+1):
+            spec[..., self._mslice(m)] = self._analysis(fm[..., m], self._P, m)
+        return spec
+
+    def spectogrd(self, spec):
+        u"""
+        スペクトル係数を格子点の値に変換する。
+
+        :Arguments:
+         **spec** : complex array_like
+          最後の軸がスペクトル係数の配列。
+        :Returns:
+         **data** : ndarray
+          形状は spec.shape[:-1] + (nlat, nlon) 。
+        """
+        spec = np.asarray(spec)
+        fm = np.empty(spec.shape[:-1] + (self.nlat, self.ntrunc+1), dtype=np.complex128)
+        for m in range(self.ntrunc+1):
+            fm[..., m] = self._synthesis(spec, self._P, m)
+        return self._invfourier(fm)
+
+    def vrtdivspec(self, u, v):
+        ur"""
+        ベクトル場の渦度と発散のスペクトル係数を返す。
+
+        :Arguments:
+         **u, v** : array_like
+          最後の2軸が(緯度, 経度)のベクトルの東西、南北成分。
+        :Returns:
+         **vrtspec, divspec** : complex ndarray
+
+        .. note::
+           部分積分により、:math:`u\cos\phi` を微分せずに次のように求める。
+
+           .. math:: \zeta_{n}^{m} = \frac{1}{2a}\sum_{j} w_{j}\left[ im\,v_{m}\frac{\bar{P}_{n}^{m}}{\cos\phi}
+                                    + u_{m}\frac{d\bar{P}_{n}^{m}}{d\phi} \right]_{j}, \quad
+                     D_{n}^{m} = \frac{1}{2a}\sum_{j} w_{j}\left[ im\,u_{m}\frac{\bar{P}_{n}^{m}}{\cos\phi}
+                                    - v_{m}\frac{d\bar{P}_{n}^{m}}{d\phi} \right]_{j}
+        """
+        u = np.asarray(u, dtype=np.float64)
+        v = np.asarray(v, dtype=np.float64)
+        self._check(u)
+        self._check(v)
+        um, vm = self._fourier(u), self._fourier(v)
+        shape = u.shape[:-2] + (self.nmodes,)
+        vrtspec = np.empty(shape, dtype=np.complex128)
+        divspec = np.empty(shape, dtype=np.complex128)
+        for m in range(self.ntrunc+1):
+            sl = self._mslice(m)
+            vrtspec[..., sl] = self._analysis(um[..., m], self._dP, m)
+            divspec[..., sl] = -self._analysis(vm[..., m], self._dP, m)
+            if m > 0:
+                vrtspec[..., sl] += 1j*m*self._analysis(vm[..., m], self._Q, m)
+                divspec[..., sl] += 1j*m*self._analysis(um[..., m], self._Q, m)
+        vrtspec /= self.rsphere
+        divspec /= self.rsphere
+        return vrtspec, divspec
+
+    def gradient(self, spec):
+        ur"""
+        スペクトル係数で表したスカラー場の水平勾配を格子点で返す。
+
+        :Arguments:
+         **spec** : complex array_like
+        :Returns:
+         **u, v** : ndarray
+          :math:`\frac{1}{a\cos\phi}\frac{\partial f}{\partial\lambda}, \frac{1}{a}\frac{\partial f}{\partial\phi}`
+        """
+        spec = np.asarray(spec)
+        shape = spec.shape[:-1] + (self.nlat, self.ntrunc+1)
+        um = np.zeros(shape, dtype=np.complex128)
+        vm = np.empty(shape, dtype=np.complex128)
+        for m in range(self.ntrunc+1):
+            vm[..., m] = self._synthesis(spec, self._dP, m)
+            if m > 0:
+                um[..., m] = 1j*m*self._synthesis(spec, self._Q, m)
+        return self._invfourier(um)/self.rsphere, self._invfourier(vm)/self.rsphere
+
+    def laplacianfactor(self):
+        u"""
+        ラプラシアンの固有値 -n(n+1)/a^2 を係数の順に返す。
+        """
+        n = self.degree.astype(np.float64)
+        return -n*(n+1.)/self.rsphere**2
+
+_spharmt_cache = collections.OrderedDict()
+_spharmt_lock = threading.Lock()
+_SPHARMT_CACHESIZE = 4
+
+def getspharmt(lon, lat, ntrunc=None, gridtype=None, rsphere=a0):
+    u"""
+    格子に対応する :py:class:`Spharmt` を返す。
+
+    ルジャンドル関数の表は大きいので、最近使われた4つの格子についてのみ保持する。
+
+    :Arguments:
+     引数は :py:class:`Spharmt` と同じ。
+
+    :Returns:
+     **sp** : Spharmt
+    """
+    key = (grid._arraykey(lon), grid._arraykey(lat), ntrunc, gridtype, rsphere)
+    with _spharmt_lock:
+        sp = _spharmt_cache.pop(key, None)
+        if sp is None:
+            sp = Spharmt(lon, lat, ntrunc=ntrunc, gridtype=gridtype, rsphere=rsphere)
+            if len(_spharmt_cache) >= _SPHARMT_CACHESIZE:
+                _spharmt_cache.popitem(last=False)
+        _spharmt_cache[key] = sp
+    return sp
+
+#=== 微分演算 ======================================================================================
+
+def _pack(var, xdim, ydim):
+    u"""
+    緯度、経度の軸を最後に移した配列と、元に戻すための情報を返す。
+    """
+    var = np.asarray(var)
+    ndim = var.ndim
+    xdim, ydim = xdim % ndim, ydim % ndim
+    order = [i for i in range(ndim) if not i in (xdim, ydim)] + [ydim, xdim]
+    return var.transpose(order), order
+
+def _unpack(data, order):
+    return np.ascontiguousarray(data.transpose(np.argsort(order)))
+
+def div(u, v, lon, lat, xdim, ydim, ntrunc=None, gridtype=None):
+    u"""
+    水平発散を球面調和関数展開で計算する。
+
+    :Arguments:
+     **u, v** : ndarray
+       ベクトルの東西、南北成分。
+     **lon, lat** : array_like
+       経度と緯度
+     **xdim, ydim** : int
+       経度、緯度の軸
+     **ntrunc** : int, optional
+       三角切断の波数。:py:class:`Spharmt` を参照。
+     **gridtype** : {None, 'gaussian', 'regular'}, optional
+       緯度格子の種類。Noneの場合は緯度の値から判定する。
+
+    :Returns:
+     **div** : ndarray
+       u, v と同じ形状のndarray
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.grid.div
+    """
+    sp = getspharmt(lon, lat, ntrunc=ntrunc, gridtype=gridtype)
+    u, order = _pack(u, xdim, ydim)
+    v, order = _pack(v, xdim, ydim)
+    vrtspec, divspec = sp.vrtdivspec(u, v)
+    return _unpack(sp.spectogrd(divspec), order)
+
+def rot(u, v, lon, lat, xdim, ydim, ntrunc=None, gridtype=None):
+    u"""
+    回転の鉛直成分(相対渦度)を球面調和関数展開で計算する。
+
+    :Arguments:
+     **u, v** : ndarray
+       ベクトルの東西、南北成分。
+     **lon, lat** : array_like
+       経度と緯度
+     **xdim, ydim** : int
+       経度、緯度の軸
+     **ntrunc** : int, optional
+       三角切断の波数。:py:class:`Spharmt` を参照。
+     **gridtype** : {None, 'gaussian', 'regular'}, optional
+       緯度格子の種類。Noneの場合は緯度の値から判定する。
+
+    :Returns:
+     **rot** : ndarray
+       u, v と同じ形状のndarray
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.grid.rot
+    """
+    sp = getspharmt(lon, lat, ntrunc=ntrunc, gridtype=gridtype)
+    u, order = _pack(u, xdim, ydim)
+    v, order = _pack(v, xdim, ydim)
+    vrtspec, divspec = sp.vrtdivspec(u, v)
+    return _unpack(sp.spectogrd(vrtspec), order)
+
+def grad(var, lon, lat, xdim, ydim, ntrunc=None, gridtype=None):
+    u"""
+    水平勾配を球面調和関数展開で計算する。
+
+    :Arguments:
+     **var** : ndarray
+       スカラー場
+     **lon, lat** : array_like
+       経度と緯度
+     **xdim, ydim** : int
+       経度、緯度の軸
+     **ntrunc** : int, optional
+       三角切断の波数。:py:class:`Spharmt` を参照。
+     **gridtype** : {None, 'gaussian', 'regular'}, optional
+       緯度格子の種類。Noneの場合は緯度の値から判定する。
+
+    :Returns:
+     **outu, outv** : ndarray
+       varと同じ形状のndarray
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.grid.grad
+    """
+    sp = getspharmt(lon, lat, ntrunc=ntrunc, gridtype=gridtype)
+    var, order = _pack(var, xdim, ydim)
+    outu, outv = sp.gradient(sp.grdtospec(var))
+    return _unpack(outu, order), _unpack(outv, order)
+
+def laplacian(var, lon, lat, xdim, ydim, ntrunc=None, gridtype=None):
+    u"""
+    球面上の2次元ラプラシアンを球面調和関数展開で計算する。
+
+    :Arguments:
+     **var** : ndarray
+       スカラー場
+     **lon, lat** : array_like
+       経度と緯度
+     **xdim, ydim** : int
+       経度、緯度の軸
+     **ntrunc** : int, optional
+       三角切断の波数。:py:class:`Spharmt` を参照。
+     **gridtype** : {None, 'gaussian', 'regular'}, optional
+       緯度格子の種類。Noneの場合は緯度の値から判定する。
+
+    :Returns:
+     **out** : ndarray
+       varと同じ形状のndarray
+
+    .. seealso::
+
+     .. autosummary::
+        :nosignatures:
+
+        pymet.grid.laplacian
+    """
+    sp = getspharmt(lon, lat, ntrunc=ntrunc, gridtype=gridtype)
+    var, order = _pack(var, xdim, ydim)
+    spec = sp.grdtospec(var)
+    spec *= sp.laplacianfactor()
+    return _unpack(sp.spectogrd(spec), order)
+
+def invlaplacian(var, lon, lat, xdim, ydim, ntrunc=None, gridtype=None):
+    u"""
+    球面上の2次元ラプラシアンの逆演算を球面調和関数展開で計算する。
+
+    渦度から流線関数、発散から速度ポテンシャルを求めるのに用いる。全球平均(n=0)の成分は0とする。
+
+    :Arguments:
+     **var** : ndarray
+       スカラー場
+     **lon, lat** : array_like
+       経度と緯度
+     **xdim, ydim** : int
+       経度、緯度の軸
+     **ntrunc** : int, optional
+       三角切断の波数。:py:class:`Spharmt` を参照。
+     **gridtype** : {None, 'gaussian', 'regular'}, optional
+       緯度格子の種類。Noneの場合は緯度の値から判定する。
+
+    :Returns:
+     **out** : ndarray
+       varと同じ形状のndarray
+
+    **Examples**
+     >>> vor  = spharm.rot(u, v, lon, lat, 3, 2)
+     >>> strm = spharm.invlaplacian(vor, lon, lat, 3, 2)
+    """
+    sp = getspharmt(lon, lat, ntrunc=ntrunc, gridtype=gridtype)
+    var, order = _pack(var, xdim, ydim)
+    spec = sp.grdtospec(var)
+    factor = sp.laplacianfactor()
+    factor[0] = np.inf
+    spec /= factor
+    return _unpack(sp.spectogrd(spec), order)
+
+def truncate(var, lon, lat, xdim, ydim, ntrunc, gridtype=None):
+    u"""
+    全波数ntruncで三角切断した場を返す。
+
+    :Arguments:
+     **var** : ndarray
+       スカラー場
+     **lon, lat** : array_like
+       経度と緯度
+     **xdim, ydim** : int
+       経度、緯度の軸
+     **ntrunc** : int
+       三角切断の波数。
+     **gridtype** : {None, 'gaussian', 'regular'}, optional
+       緯度格子の種類。Noneの場合は緯度の値から判定する。
+
+    :Returns:
+     **out** : ndarray
+       varと同じ形状のndarray
+
+    **Examples**
+     >>> z500_t42 = spharm.truncate(z500, lon, lat, 3, 2, 42)
+    """
+    sp = getspharmt(lon, lat, ntrunc=ntrunc, gridtype=gridtype)
+    var, order = _pack(var, xdim, ydim)
+    return _unpack(sp.spectogrd(sp.grdtospec(var)), order)
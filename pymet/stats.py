@@ -6,7 +6,10 @@
 .. autosummary::
 
    runave
+   runcum
    lancoz
+   butterworth
+   StreamFilter
    regression
    rmse
    acc
@@ -16,14 +19,20 @@
 ---------------   
 """
 import numpy as np
+import collections
+import threading
 import scipy.signal as signal
+import scipy.ndimage as ndimage
+import scipy.fftpack as fftpack
 import tools, constants
+from grid import _axslice
 import scipy.linalg as linalg
+import scipy.sparse.linalg as sparse_linalg
 import scipy.stats
 PI = constants.pi
 NA = np.newaxis
 
-__all__ = ['runave', 'regression', 'lancoz', 
+__all__ = ['runave', 'runcum', 'regression', 'lancoz', 'butterworth', 'StreamFilter',
            'rmse', 'acc', 'corr',
            'eof']
 
@@ -58,6 +67,8 @@ def runave(a, length, axis=0, bound='mask'):
 
       .. math:: \bar{a}_{i} = \frac{0.5*a_{i-k} + a_{i-k+1} + \ldots + a_{i} + \ldots + a_{i+k-1} + 0.5*a_{i+k}}{n}
 
+      累積和の差で計算するので、計算量はlengthによらない。float32の入力はfloat32で返す。
+
     **Examples**       
      >>> runave([1, 2, 3, 4, 5], 3, bound='mask')
      masked_array(data = [-- 2.0 3.0 4.0 --], 
@@ -67,49 +78,11 @@ def runave(a, length, axis=0, bound='mask'):
      >>> runave([1, 2, 3, 4, 5], 3, bound='valid')
      array([ 2.  3.  4.])
     """
-    rdata = np.array(a)
-    ndim = rdata.ndim
-    nt = rdata.shape[axis]
-    rdata = np.rollaxis(rdata, axis, 0)
-    if nt < length:
-        raise ValueError, "input array first dimension length must be larger than length."
-
-    if ndim == 1:
-        if length%2 == 1:
-            w = np.ones(length)/float(length)
-        else:
-            w = np.r_[0.5, np.ones(length-1), 0.5]/float(length)                
-        out = signal.convolve(rdata, w, mode='same')
-        if bound == 'mask':
-            out = np.ma.asarray(out)
-            out[:length/2] = np.ma.masked
-            out[-(length/2):] = np.ma.masked
-        elif bound == 'valid':
-            out = out[(length/2):-(length/2)]
-        else:
-            raise ValueError, "unexpected bound option '%{0}'".format(bound)
-    else:
-        rdata, oldshape = tools.unshape(rdata) 
-        if length%2 != 0:
-            w = np.c_[(np.zeros(length),np.ones(length),np.zeros(length))]/float(length)
-        else:
-            w = np.c_[(np.zeros(length+1),np.r_[0.5, np.ones(length-1), 0.5],
-                           np.zeros(length+1))]/float(length)
-        out = signal.convolve2d(rdata, w, mode='same')
-        if bound=='mask':
-            out = np.ma.asarray(out)
-            out[:length/2,:] = np.ma.masked
-            out[-(length/2):,:] = np.ma.masked
-        elif 'valid':
-            out = out[(length/2):-(length/2),:]
-        else:
-            raise ValueError, "unexpected boud option '%{0}'".format(bound)
-        out = tools.deunshape(out, (-1,) + oldshape[1:])
-        out = tools.mrollaxis(out, 0, axis+1)
-        
-    return out
+    out, n = _runsum(a, length, axis, True, bound)
+    k = length//2
+    return _runbound(out, n, axis, k, k, bound)
 
-def lancoz(a, cutoff, cutoff2=None, length=None, axis=0, bound='mask', mode='lowpass'):
+def lancoz(a, cutoff, cutoff2=None, length=None, axis=0, bound='mask', mode='lowpass', method='auto'):
     ur"""
     時系列データに対してLancozフィルタをかける。
 
@@ -137,8 +110,12 @@ def lancoz(a, cutoff, cutoff2=None, length=None, axis=0, bound='mask', mode='low
        high-passフィルタとして施す。
       'bandpass'
        band-passフィルタとして施す。
+     **method** : {'auto', 'direct', 'fft'}, optional
+      畳み込みの方法。'auto'(デフォルト)は項数が 4*log2(時系列の長さ) 程度を超える場合にFFTを、
+      それ以外は直接の畳み込みを用いる。
     :Return:
       **out** : array_like
+       float32の入力はfloat32で返す。
 
     .. note::
      カットオフ周波数fc、項数nのLancoz低周波フィルタの重み関数は、
@@ -149,6 +126,9 @@ def lancoz(a, cutoff, cutoff2=None, length=None, axis=0, bound='mask', mode='low
 
      .. math:: {\rm sinc}(x) = \frac{\sin(\pi x)}{\pi x} \hspace{3em} {\rm sinc}(0) = 1
 
+     高周波フィルタの重みは :math:`\delta_{k0} - w_{k}` 。重みは (cutoff, cutoff2, length, mode) ごとに
+     保持して再利用する。
+
     **Examples**
      サンプリング間隔1日のデータに、カットオフ周期10日、項数21のLancoz低周波フィルタをかける。
       >>> data.shape
@@ -160,59 +140,188 @@ def lancoz(a, cutoff, cutoff2=None, length=None, axis=0, bound='mask', mode='low
       doi: <http://dx.doi.org/10.1175/1520-0450(1979)018<1016:LFIOAT>2.0.CO;2>
        
     """
-    rdata = np.array(a)
-    ndim = rdata.ndim
-    nt = rdata.shape[0]
-    rdata = np.rollaxis(rdata, axis, 0)
-    
-    if length == None: length = 2*max(cutoff,cutoff2) + 1
+    if not bound in ('mask', 'valid'):
+        raise ValueError, "unexpected bound option '{0}'".format(bound)
+    data = np.asarray(a)
+    data = np.asarray(data, dtype=_filterdtype(data))
+    ndim = data.ndim
+    axis = axis % ndim
+    nt = data.shape[axis]
+
+    if length is None:
+        length = 2*int(max(cutoff, cutoff2)) + 1
     if nt < length:
         raise ValueError, "input array time dimension length must be larger than 2*cutoff+1."
     elif length%2 == 0:
         raise ValueError, "length keyword must be odd number"
 
-    fc = 1./cutoff  # cutoff(or in) frequency
-    n = length/2
-    k = np.arange(-n, n+1)
-    if mode == 'lowpass':
-        w = 2. * fc * np.sinc(2.*fc*k) * np.sinc(k/n)
-    elif mode == 'highpass':
-        w = -2. * fc * np.sinc(2.*fc*k) * np.sinc(k/n)
-    elif mode == 'bandpass':
-        if cutoff2 == None: raise ValueError, "cutoff2 value is required in bandpass mode"
-        fc1 = max(fc, 1./cutoff2) # cut off
-        fc2 = min(fc, 1./cutoff2) # cut in
-        w = 2. * (fc1*np.sinc(2.*fc1*k) - fc2*np.sinc(2.*fc2*k)) * np.sinc(k/n)
-    else:
-        raise ValueError, "mode '{0}' is invalid".format(mode)
-            
-    if ndim == 1:
-        out = signal.convolve(rdata, w, mode='same')
-        if bound == 'mask':
-            out = np.ma.asarray(out)
-            out[:length/2] = np.ma.masked
-            out[-(length/2):] = np.ma.masked
-        elif bound == 'valid':
-            out = out[(length/2):-(length/2)]
-        else:
-            raise ValueError, "unexpected bound option '%{0}'".format(bound)
-    else:
-        rdata, oldshape = tools.unshape(rdata) 
-        w = np.c_[(np.zeros(length), w, np.zeros(length))]
-        out = signal.convolve2d(rdata, w, mode='same')
-        if bound=='mask':
-            out = np.ma.asarray(out)
-            out[:length/2,:] = np.ma.masked
-            out[-(length/2):,:] = np.ma.masked
-        elif 'valid':
-            out = out[(length/2):-(length/2),:]
-        else:
-            raise ValueError, "unexpected boud option '%{0}'".format(bound)
-        out = tools.deunshape(out, (-1,) + oldshape[1:])
-        out = tools.mrollaxis(out, 0, axis+1)
+    w = _lanczosweights(cutoff, cutoff2, length, mode)
+    out = _convolve(data, w, axis, method)
+
+    k = length//2
+    s = lambda start, stop: _axslice(ndim, axis, slice(start, stop))
+    if bound == 'valid':
+        return out[s(k, nt-k)]
+    mask = np.zeros(out.shape, dtype=bool)
+    mask[s(0, k)] = True
+    mask[s(nt-k, None)] = True
+    return np.ma.array(out, mask=mask)
+
+_FILTER_CACHESIZE = 32
+_lanczos_cache = collections.OrderedDict()
+_lanczos_lock = threading.Lock()
+
+def _lanczosweights(cutoff, cutoff2, length, mode):
+    u"""
+    Lanczosフィルタの重み。(cutoff, cutoff2, length, mode)ごとに最近使われた32組を保持する。
+    返す配列は書き換えられない。
+    """
+    key = (float(cutoff), None if cutoff2 is None else float(cutoff2), int(length), mode)
+    with _lanczos_lock:
+        w = _lanczos_cache.pop(key, None)
+        if w is None:
+            fc = 1./cutoff  # cutoff(or in) frequency
+            n = length//2
+            k = np.arange(-n, n+1)
+            sigma = np.sinc(k/float(n)) if n > 0 else np.ones(1)
+            if mode == 'lowpass':
+                w = 2. * fc * np.sinc(2.*fc*k) * sigma
+            elif mode == 'highpass':
+                w = -2. * fc * np.sinc(2.*fc*k) * sigma
+                w[n] += 1.
+            elif mode == 'bandpass':
+                if cutoff2 is None: raise ValueError, "cutoff2 value is required in bandpass mode"
+                fc1 = max(fc, 1./cutoff2) # cut off
+                fc2 = min(fc, 1./cutoff2) # cut in
+                w = 2. * (fc1*np.sinc(2.*fc1*k) - fc2*np.sinc(2.*fc2*k)) * sigma
+            else:
+                raise ValueError, "mode '{0}' is invalid".format(mode)
+            w.flags.writeable = False
+            if len(_lanczos_cache) >= _FILTER_CACHESIZE:
+                _lanczos_cache.popitem(last=False)
+        _lanczos_cache[key] = w
+    return w
+
+def _convolve(data, w, axis, method='auto'):
+    u"""
+    axisに沿って対称な重みwをかける(両端の外側は0とする)。
 
+    method='auto'の場合は、項数が 4*log2(FFTの長さ) を超えるときにFFTを、それ以外は直接の
+    畳み込みを用いる。どちらも軸を入れ替えたコピーは作らず、入力と同じ型で返す。
+    """
+    nt = data.shape[axis]
+    nfft = fftpack.next_fast_len(nt)
+    if method == 'auto':
+        method = 'fft' if len(w) > 4*np.log2(max(nfft, 2)) else 'direct'
+    if method == 'direct':
+        return ndimage.correlate1d(data, w, axis=axis, mode='constant')
+    elif method != 'fft':
+        raise ValueError, "method must be 'auto', 'direct' or 'fft', not '{0}'".format(method)
+    # 中心を先頭に置いた重みの伝達関数は実数なので、fftpackの実数FFTの出力に要素ごとにかけられる
+    n = len(w)//2
+    wc = np.zeros(nfft)
+    wc[:n+1] = w[n:]
+    if n > 0:
+        wc[-n:] = w[:n]
+    response = np.fft.rfft(wc).real[(np.arange(nfft) + 1)//2]
+    spec = fftpack.rfft(data, n=nfft, axis=axis)
+    spec *= tools.expand(response.astype(spec.dtype), data.ndim, axis=axis)
+    out = fftpack.irfft(spec, axis=axis, overwrite_x=True)
+    if nfft != nt:
+        out = out[_axslice(data.ndim, axis, slice(0, nt))]
     return out
 
+def butterworth(a, cutoff, cutoff2=None, order=4, axis=0, mode='lowpass'):
+    ur"""
+    時系列データに対して、Butterworthフィルタを前向きと後ろ向きに1回ずつかける(位相のずれのない
+    フィルタ)。
+
+    2次のセクション(SOS)に分けた再帰型フィルタで計算するので、1項あたりの計算量はカットオフ周期に
+    よらない。 :py:func:`lancoz` と異なり両端の値も失われない(端は奇関数の鏡像で延長する)。
+
+    :Arguments:
+     **a** : array_like
+      入力データ。MaskedArrayの場合、再帰型フィルタでは1点の欠損値が時系列全体に広がるので、
+      いずれかの時刻で欠損している時系列は全体をマスクする。
+     **cutoff** : float
+      カットオフ(イン)周期。入力データのステップ数で指定
+     **cutoff2** : float, optional
+      バンドパスフィルタをかける場合の2つ目のカットオフ(イン)周期。入力データのステップ数で指定
+     **order** : int, optional
+      フィルタの次数。デフォルトは4。前後にかけるので、応答は2倍の次数のフィルタの振幅の2乗になる。
+     **axis** : int, optional
+      フィルタをかける軸。デフォルトは 0。
+     **mode** : {'lowpass', 'highpass', 'bandpass'}, optional
+      フィルタの種類。デフォルトは'lowpass'。
+
+    :Returns:
+     **out** : ndarray or MaskedArray
+      入力と同じ形状の配列。float32の入力はfloat32で返す。
+
+    **Examples**
+     サンプリング間隔1日のデータから20-100日周期の成分を取り出す。
+      >>> mjo = butterworth(olr, 20, cutoff2=100, mode='bandpass')
+    """
+    mask = np.ma.getmask(a)
+    if mask is not np.ma.nomask and mask.any():
+        ndim = np.ndim(a)
+        axis = axis % ndim
+        # 欠損値を含む時系列は0で埋めて計算し、全体をマスクする
+        bad = np.broadcast_to(np.expand_dims(mask.any(axis=axis), axis), np.shape(a))
+        out = butterworth(np.where(bad, 0, np.ma.getdata(a)), cutoff, cutoff2=cutoff2, order=order,
+                          axis=axis, mode=mode)
+        return np.ma.array(out, mask=bad)
+    data = np.asarray(np.ma.getdata(a))
+    dtype = _filterdtype(data)
+    sos = _butterworthsos(cutoff, cutoff2, order, mode)
+    ndim = data.ndim
+    axis = axis % ndim
+    if axis == ndim - 1:
+        return signal.sosfiltfilt(sos, data, axis=axis).astype(dtype, copy=False)
+
+    # lfilterは時間が最後の軸で連続な配列のほうが速いので、時間以外の格子点をncol個ずつ
+    # 並べ替えて計算する
+    shape = data.shape
+    nt = shape[axis]
+    npre, npost = int(np.prod(shape[:axis])), int(np.prod(shape[axis+1:]))
+    d3 = data.reshape(npre, nt, npost)
+    out = np.empty((npre, nt, npost), dtype=dtype)
+    ncol = 1024
+    for i in range(npre):
+        for j in range(0, npost, ncol):
+            block = np.ascontiguousarray(d3[i, :, j:j+ncol].T, dtype=np.float64)
+            out[i, :, j:j+ncol] = signal.sosfiltfilt(sos, block, axis=-1).T
+    return out.reshape(shape)
+
+_butterworth_cache = collections.OrderedDict()
+_butterworth_lock = threading.Lock()
+
+def _butterworthsos(cutoff, cutoff2, order, mode):
+    u"""
+    Butterworthフィルタの2次セクションの係数。(cutoff, cutoff2, order, mode)ごとに最近使われた
+    32組を保持する。
+    """
+    key = (float(cutoff), None if cutoff2 is None else float(cutoff2), int(order), mode)
+    with _butterworth_lock:
+        sos = _butterworth_cache.pop(key, None)
+        if sos is None:
+            # 周波数はナイキスト周波数(0.5/ステップ)で規格化する
+            if mode in ('lowpass', 'highpass'):
+                wn = 2./cutoff
+            elif mode == 'bandpass':
+                if cutoff2 is None: raise ValueError, "cutoff2 value is required in bandpass mode"
+                wn = [2./max(cutoff, cutoff2), 2./min(cutoff, cutoff2)]
+            else:
+                raise ValueError, "mode '{0}' is invalid".format(mode)
+            if not np.all((np.asarray(wn) > 0) & (np.asarray(wn) < 1)):
+                raise ValueError, "cutoff periods must be longer than 2 time steps"
+            sos = signal.butter(order, wn, btype=mode, output='sos')
+            sos.flags.writeable = False
+            if len(_butterworth_cache) >= _FILTER_CACHESIZE:
+                _butterworth_cache.popitem(last=False)
+        _butterworth_cache[key] = sos
+    return sos
+
 def runcum(a, length, axis=0, bound='mask'):
     ur"""
     移動積算値を計算する。
@@ -244,40 +353,194 @@ def runcum(a, length, axis=0, bound='mask'):
     >>> runcum(a, d, mode='valid')
     array([  3.,   6.,   9.,  12.,  15.,  18.,  21.,  24.])
     """
-    rdata = np.array(a)
-    ndim = rdata.ndim
-    nt = rdata.shape[axis]
-    rdata = np.rollaxis(rdata, axis, 0)
-    if nt < length:
+    out, n = _runsum(a, length, axis, False, bound)
+    return _runbound(out, n, axis, length-1, 0, bound)
+
+def _runsum(a, length, axis, average, bound):
+    u"""
+    axisに沿ったlength項の移動和(averageがTrueの場合は移動平均)を、累積和の差で計算する。
+    計算量は項数によらず入力の大きさに比例する。
+
+    averageがTrueでlengthが偶数の場合は、length+1項の両端に0.5の重みをつける。先頭の項から
+    始まる窓の結果を順に並べた配列(長さは bound='valid' の場合と同じ)と、入力の長さを返す。
+    累積和は倍精度で計算し、float32の入力はfloat32で返す。
+    """
+    if not bound in ('mask', 'valid'):
+        raise ValueError, "unexpected bound option '{0}'".format(bound)
+    data = np.asarray(a)
+    ndim = data.ndim
+    axis = axis % ndim
+    n = data.shape[axis]
+    if n < length:
         raise ValueError, "input array first dimension length must be larger than length."
 
-    if ndim == 1:
-        w = np.ones(length)
-        out = signal.convolve(rdata, w, mode='full')
-        if bound == 'mask':
-            out = out[:-length+1]
-            out = np.ma.asarray(out)
-            out[:length-1] = np.ma.masked
-        elif bound == 'valid':
-            out = out[length-1:-length+1]
+    # csum[i] = a[0] + ... + a[i-1]
+    shape = list(data.shape)
+    shape[axis] = n + 1
+    csum = np.empty(shape, dtype=np.float64)
+    csum[_axslice(ndim, axis, slice(0, 1))] = 0.
+    np.cumsum(data, axis=axis, dtype=np.float64, out=csum[_axslice(ndim, axis, slice(1, None))])
+    return _runwindows(data, csum, axis, length, average), n
+
+def _runwindows(data, csum, axis, length, average):
+    u"""
+    dataとその累積和csum(axisに沿ってdataより1つ長く、csum[i]はdata[i]より前までの和)から、
+    dataに収まるすべての窓の移動和(移動平均)を計算する。
+    """
+    ndim = data.ndim
+    s = lambda start, stop: _axslice(ndim, axis, slice(start, stop))
+    nterm = length + 1 if average and length % 2 == 0 else length
+    m = max(data.shape[axis] - nterm + 1, 0)
+    out = np.subtract(csum[s(nterm, nterm+m)], csum[s(0, m)])
+    if nterm != length:
+        out -= 0.5*data[s(0, m)]
+        out -= 0.5*data[s(nterm-1, nterm-1+m)]
+    if average:
+        out /= length
+    return out.astype(_filterdtype(data), copy=False)
+
+def _filterdtype(data):
+    u"""
+    フィルタの結果の型。float32はfloat32のまま、それ以外は倍精度以上とする。
+    """
+    return np.float32 if data.dtype == np.float32 else np.result_type(data.dtype, np.float64)
+
+def _runbound(out, n, axis, before, after, bound):
+    u"""
+    移動平均、移動和の結果outを、bound='mask'の場合は前にbefore項、後ろにafter項のマスクされた
+    値を加えて入力と同じ長さにする。
+    """
+    if bound == 'valid':
+        return out
+    ndim = out.ndim
+    axis = axis % ndim
+    s = lambda start, stop: _axslice(ndim, axis, slice(start, stop))
+    shape = list(out.shape)
+    shape[axis] = n
+    result = np.zeros(shape, dtype=out.dtype)
+    result[s(before, n-after)] = out
+    mask = np.zeros(shape, dtype=bool)
+    mask[s(0, before)] = True
+    mask[s(n-after, None)] = True
+    return np.ma.array(result, mask=mask)
+
+class StreamFilter(object):
+    ur"""
+    時系列を時間方向のブロックに分けて順に与え、 :py:func:`lancoz` 、 :py:func:`runave` 、
+    :py:func:`runcum` と同じフィルタをかける。
+
+    年ごとのファイルに分かれた長期間の日々のデータなどを、全期間を読み込まずに処理するためのもの。
+    前のブロックの末尾のうち次のブロックの計算に必要な項(lancoz、runaveではlength-1項)だけを
+    保持し、値が確定した時刻の結果をすぐに返すので、メモリはブロックの大きさに比例する。
+
+    :py:meth:`push` が返す結果をaxisに沿ってつなげたものは、全期間を一度に与えたときの
+    bound='valid' の結果とビット単位で一致する(lancozは method='direct' の結果と一致する)。
+
+    :Arguments:
+     **kind** : {'lancoz', 'runave', 'runcum'}
+      フィルタの種類。
+     **length** : int, optional
+      項数。runave、runcumでは必須。lancozのデフォルトは 2*max(cutoff,cutoff2)+1 。
+     **cutoff, cutoff2, mode** : optional
+      lancozのカットオフ周期とフィルタの種類。 :py:func:`lancoz` を参照。
+     **axis** : int, optional
+      時間の軸。デフォルトは0。
+
+    :Attributes:
+     **offset** : int
+      最初の結果に対応する入力の時刻のインデックス。lancoz、runaveではlength/2、runcumでは
+      length-1。
+     **nin, nout** : int
+      これまでに受け取った入力と、返した結果の時刻の数。
+
+    **Examples**
+     10日の低周波フィルタを年ごとのファイルに順にかける。
+      >>> filt = StreamFilter('lancoz', cutoff=10)
+      >>> for path in paths:
+      ...     result = filt.push(read(path))
+      ...     write(result, start=filt.nout - len(result) + filt.offset)
+    """
+    def __init__(self, kind, length=None, cutoff=None, cutoff2=None, mode='lowpass', axis=0):
+        if kind == 'lancoz':
+            if cutoff is None:
+                raise ValueError, "cutoff is required for lancoz"
+            if length is None:
+                length = 2*int(max(cutoff, cutoff2)) + 1
+            elif length%2 == 0:
+                raise ValueError, "length keyword must be odd number"
+            self.weights = _lanczosweights(cutoff, cutoff2, length, mode)
+            self.offset = length//2
+            ntail = length - 1
+        elif kind in ('runave', 'runcum'):
+            if length is None:
+                raise ValueError, "length is required for {0}".format(kind)
+            self.weights = None
+            average = kind == 'runave'
+            self.offset = length//2 if average else length - 1
+            ntail = (length if average and length % 2 == 0 else length - 1)
         else:
-            raise ValueError, "unexpected bound option '%{0}'".format(bound)
-    else:
-        rdata, oldshape = tools.unshape(rdata) 
-        w = np.c_[(np.zeros(length),np.ones(length),np.zeros(length))]
-        out = signal.convolve2d(rdata, w, mode='full')
-        if bound=='mask':
-            out = out[:-length+1,1:-1]
-            out = np.ma.asarray(out)
-            out[:length-1,:] = np.ma.masked            
-        elif 'valid':
-            out = out[length-1:-length+1,1:-1]
+            raise ValueError, "kind must be 'lancoz', 'runave' or 'runcum', not '{0}'".format(kind)
+        self.kind = kind
+        self.length = length
+        self.axis = axis
+        self.ntail = ntail
+        self.reset()
+
+    def reset(self):
+        u"""
+        保持している末尾の項を捨てて、新しい時系列を始める。
+        """
+        self._tail = None
+        self._csum = None
+        self.nin = 0
+        self.nout = 0
+
+    def push(self, chunk):
+        u"""
+        次の時刻のブロックを与え、新たに値が確定した時刻の結果を返す。
+
+        :Arguments:
+         **chunk** : array_like
+          時間方向以外の形状が前のブロックと同じ配列。
+
+        :Returns:
+         **out** : ndarray
+          時間方向の長さは確定した時刻の数で、0のこともある。
+        """
+        chunk = np.asarray(chunk)
+        ndim = chunk.ndim
+        axis = self.axis % ndim
+        s = lambda start, stop: _axslice(ndim, axis, slice(start, stop))
+        if self.kind == 'lancoz':
+            chunk = np.asarray(chunk, dtype=_filterdtype(chunk))
+        if self._tail is not None:
+            chunk = np.asarray(chunk, dtype=self._tail.dtype)
+        data = chunk if self._tail is None else np.concatenate((self._tail, chunk), axis=axis)
+        n = data.shape[axis]
+
+        if self.kind == 'lancoz':
+            if n >= self.length:
+                k = self.length//2
+                out = _convolve(data, self.weights, axis, 'direct')[s(k, n-k)]
+            else:
+                shape = list(data.shape)
+                shape[axis] = 0
+                out = np.empty(shape, dtype=data.dtype)
         else:
-            raise ValueError, "unexpected boud option '%{0}'".format(bound)
-        out = tools.deunshape(out, (-1,) + oldshape[1:])
-        out = tools.mrollaxis(out, 0, axis+1)
-        
-    return out
+            # 累積和は前のブロックの続きから同じ順序で足すので、一度に計算した場合と一致する
+            shape = list(chunk.shape)
+            shape[axis] = 1
+            last = np.zeros(shape) if self._csum is None else self._csum[s(-1, None)]
+            csum = np.cumsum(np.concatenate((last, chunk), axis=axis), axis=axis, dtype=np.float64)
+            if self._csum is not None:
+                csum = np.concatenate((self._csum[s(None, -1)], csum), axis=axis)
+            out = _runwindows(data, csum, axis, self.length, self.kind == 'runave')
+            self._csum = csum[s(max(n - self.ntail, 0), None)]
+
+        self._tail = data[s(max(n - self.ntail, 0), None)].copy()
+        self.nin += chunk.shape[axis]
+        self.nout += out.shape[axis]
+        return out
 
 def regression(x, y, axis=0, dof=None):
     u"""
@@ -521,81 +784,186 @@ def eofold(data,lat=None,ano=True):
     
     return EOFs, PCs, explained
 
-def eof(data, tdim=0, lat=None, ydim=None):
-    """ 
+def eof(data, tdim=0, lat=None, ydim=None, nmodes=None, method='auto', oversample=10, niter=4,
+        random_state=None):
+    ur"""
     EOF解析。
 
     :Arguments: 
-      **data** : ndarray
-       入力する2次元以上のデータ配列。
+      **data** : ndarray or MaskedArray
+       入力する2次元以上のデータ配列。偏差を与えること。MaskedArrayの場合は、いずれかの時刻で
+       欠損している格子点を除いて計算し、EOFでもその格子点をマスクする。
       **tdim** : int, optional
        入力データの時間次元の軸。デフォルトは0、すなわち先頭。
       **lat**  : array_like, optional
        指定すると緯度に応じた面積重みをつける。       
       **ydim** : int, optional
        latを指定した場合の緯度次元の軸
+      **nmodes** : int, optional
+       計算するモードの数。デフォルトはすべてのモード。
+      **method** : {'auto', 'svd', 'covariance', 'randomized', 'lanczos'}, optional
+       'svd':
+         特異値分解(SVD)ですべてのモードを求める。
+       'covariance':
+         時間方向と空間方向の短い方の共分散行列(時間の数をTn、格子点数をXnとして
+         min(Tn, Xn) 次の正方行列)の固有値問題を解く。Tn << Xn の場合に速い。
+       'randomized':
+         乱数で行列の値域を近似してからSVDを行う(Halko et al. 2011)。上位のモードだけを
+         求める場合に、高解像度のデータでも速い。
+       'lanczos':
+         Lanczos法(ARPACK)で上位nmodes個の特異値を求める。
+       'auto':
+         デフォルト。nmodesを与えない場合は'svd'、与えた場合は min(Tn, Xn) が
+         (2*niter+2)*(nmodes+oversample) 以下なら'covariance'、それ以外は'randomized'。
+      **oversample** : int, optional
+       'randomized'で余分に求める次元数。デフォルトは10。
+      **niter** : int, optional
+       'randomized'のべき乗反復の回数。デフォルトは4。
+      **random_state** : int, optional
+       'randomized'で用いる乱数のシード。
        
     :Returns:
-     **EOFs** : ndarray
+     **EOFs** : ndarray or MaskedArray
        m番目のEOFモードの空間構造。形状(M,Xn),Xnは空間方向のデータ数、M=min(Xn,Tn)
+       (nmodesを与えた場合はM=nmodes)
      **PCs** : ndarray
-       m番目のEOFモードの時系列。形状(M,Tn),Tnは時間方向のデータ数。M=min(Xn,Tn)
+       m番目のEOFモードの時系列。形状(M,Tn),Tnは時間方向のデータ数。
      **lambdas** : 1darray
-       m番目のEOFモードの寄与率[%]。長さM。
+       m番目のEOFモードの寄与率[%]。長さM。全分散に対する割合。
 
     .. note::
-     計算の際にはSVD解析を用いる。
+     PCsは分散が1になるように規格化し、EOFsはPCsへの回帰係数とする。各モードの符号は、EOFの
+     絶対値が最大の格子点で正となるように揃える。float32の入力はfloat32のまま計算する。
        
     **Referrences**
-     
+     Halko, N., P. G. Martinsson, and J. A. Tropp, 2011: Finding structure with randomness:
+     Probabilistic algorithms for constructing approximate matrix decompositions. SIAM Rev., 53, 217-288.
+
     **Examples**
-     >>>
-     
+     >>> EOFs, PCs, lambdas = eof(z500a, tdim=0, lat=lat, ydim=1, nmodes=10)
     """    
-    data = np.asarray(data)
-    ndim = data.ndim
-    dtype = data.dtype
+    ndim = np.ndim(data)
     if ndim<2:
         raise ValueError, "input data must have more than two dimendin."
+    tdim = tdim % ndim
+    values = np.asarray(np.ma.getdata(data))
+    dtype = np.float32 if values.dtype == np.float32 else np.result_type(values.dtype, np.float64)
+
+    #時間軸を先頭にして(時間, 格子点)の2次元にする
+    values = np.rollaxis(values, tdim, 0)
+    spshape = values.shape[1:]
+    tn = values.shape[0]
+    x = np.asarray(values.reshape(tn, -1), dtype=dtype)
+    mask = np.ma.getmask(data)
+    valid = None
+    if mask is not np.ma.nomask and mask.any():
+        valid = ~np.rollaxis(mask, tdim, 0).reshape(tn, -1).any(axis=0)
+        x = x[:, valid]
 
     #緯度重みを考慮
-    if lat!=None and ydim!=None:
-        factor = tools.expand(np.sqrt(np.cos(PI/180.*lat)), ndim, axis=ydim)
-        data = data * factor
-        
-    #時間軸を先頭に
-    data = np.rollaxis(data, tdim, 0)
-    data, oldshape = tools.unshape(data)
-    tn, xn = data.shape
-        
-    #SVD
-    A, Lh, E = linalg.svd(data, full_matrices=False)
+    weight = None
+    if lat is not None and ydim is not None:
+        ydim = ydim % ndim
+        sydim = ydim - (ydim > tdim)
+        factor = tools.expand(np.sqrt(np.cos(PI/180.*np.asarray(lat))), len(spshape), axis=sydim)
+        weight = np.broadcast_to(factor, spshape).ravel().astype(dtype)
+        if valid is not None:
+            weight = weight[valid]
+        x = x * weight
+    xn = x.shape[1]
+
+    M = min(tn, xn)
+    k = M if nmodes is None else int(nmodes)
+    if not 0 < k <= M:
+        raise ValueError, "nmodes must be between 1 and {0}".format(M)
+    if method == 'auto':
+        if nmodes is None:
+            method = 'svd'
+        elif M <= (2*niter + 2)*(k + oversample):
+            method = 'covariance'
+        else:
+            method = 'randomized'
+
+    if method == 'svd':
+        A, Lh, E = linalg.svd(x, full_matrices=False)
+    elif method == 'covariance':
+        A, Lh, E = _eofcovariance(x, k)
+    elif method == 'randomized':
+        A, Lh, E = _eofrandomized(x, k, oversample, niter, random_state)
+    elif method == 'lanczos':
+        if k >= M:
+            raise ValueError, "nmodes must be smaller than {0} for method 'lanczos'".format(M)
+        A, Lh, E = sparse_linalg.svds(x, k=k)
+        order = np.argsort(Lh)[::-1]
+        A, Lh, E = A[:,order], Lh[order], E[order]
+    else:
+        raise ValueError, "method '{0}' is invalid".format(method)
+    A, Lh, E = A[:,:k], Lh[:k], E[:k]
 
-    lambdas = Lh*Lh/tn
+    #符号を揃える
+    sign = np.sign(E[np.arange(k), np.argmax(np.abs(E), axis=1)])
+    sign[sign == 0] = 1
+    A, E = A*sign, E*sign[:,NA]
+
+    lambdas = Lh.astype(np.float64)**2/tn
+    total = np.einsum('ij,ij->', x, x, dtype=np.float64)/tn
 
-    EOFs = E
-    PCs = np.transpose(A*Lh)
-    
     #規格化
-    EOFs = EOFs * np.sqrt(lambdas)[:,NA]
-    PCs = PCs / np.sqrt(lambdas)[:,NA]
+    EOFs = (E * (Lh/np.sqrt(tn))[:,NA]).astype(dtype, copy=False)
+    PCs = (np.transpose(A) * np.sqrt(tn)).astype(dtype, copy=False)
 
     #寄与率
-    lambdas = lambdas / lambdas.sum() * 100.
-    
-    # 形状を戻す
-    eofshape = list(oldshape)
-    eofshape.pop(tdim)
-    eofshape.insert(0, len(lambdas))
-    EOFs = EOFs.reshape(eofshape)           #(M,Tn,...)
-    print eofshape
+    lambdas = lambdas / total * 100.
+
     #緯度重みを考慮
-    if lat!=None and ydim!=None:
-        factor = tools.expand(np.sqrt(np.cos(PI/180.*lat)), ndim, axis=ydim)
-        EOFs = EOFs / factor
+    if weight is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            EOFs /= weight
+
+    # 形状を戻す
+    if valid is not None:
+        full = np.zeros((k, len(valid)), dtype=dtype)
+        full[:,valid] = EOFs
+        EOFs = np.ma.array(full, mask=np.repeat(~valid[NA,:], k, axis=0))
+    EOFs = EOFs.reshape((k,) + spshape)           #(M,...)
 
     return EOFs, PCs, lambdas
 
+def _eofcovariance(x, k):
+    u"""
+    (時間, 格子点)の行列xの上位k個の特異値分解を、短い方の次元の共分散行列の固有値問題から求める。
+    """
+    tn, xn = x.shape
+    if tn <= xn:
+        w, v = linalg.eigh(np.dot(x, x.T).astype(np.float64), eigvals=(tn-k, tn-1))
+    else:
+        w, v = linalg.eigh(np.dot(x.T, x).astype(np.float64), eigvals=(xn-k, xn-1))
+    w, v = w[::-1], v[:,::-1]
+    s = np.sqrt(w.clip(0., None))
+    inv = np.where(s > 0, 1./np.where(s > 0, s, 1.), 0.)
+    if tn <= xn:
+        u = v.astype(x.dtype)
+        vt = np.dot(u.T, x)*inv[:,NA].astype(x.dtype)
+    else:
+        vt = v.T.astype(x.dtype)
+        u = np.dot(x, vt.T)*inv[NA,:].astype(x.dtype)
+    return u, s.astype(x.dtype), vt
+
+def _eofrandomized(x, k, oversample, niter, random_state):
+    u"""
+    乱数による値域の近似(べき乗反復つき)で、行列xの上位k個の特異値分解を求める。
+    """
+    tn, xn = x.shape
+    l = min(k + oversample, tn, xn)
+    rs = np.random.RandomState(random_state)
+    q = np.dot(x, rs.standard_normal((xn, l)).astype(x.dtype))
+    q, r = linalg.qr(q, mode='economic')
+    for i in range(niter):
+        z, r = linalg.qr(np.dot(x.T, q), mode='economic')
+        q, r = linalg.qr(np.dot(x, z), mode='economic')
+    ub, s, vt = linalg.svd(np.dot(q.T, x), full_matrices=False)
+    return np.dot(q, ub), s, vt
+
 def ceof(data,tdim=0):
     """
     複素EOF解析。
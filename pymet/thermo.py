@@ -0,0 +1,462 @@
+# coding: utf-8
+u"""
+=============================================
+湿潤熱力学モジュール (:mod:`pymet.thermo`)
+=============================================
+
+水蒸気圧、露点、持ち上げ凝結高度(LCL)、相当温位と、気塊を持ち上げたときの温度、
+対流有効位置エネルギー(CAPE)、対流抑制(CIN)を計算する。
+
+気塊の計算は鉛直柱ごとのループではなく、多数の鉛直柱をまとめた配列に対して行う。
+持ち上げは下の層から1層ずつ進め、LCLより上では相当温位が保存する温度を各層で
+Newton法で求める。水平方向(鉛直以外の次元)はchunk本の鉛直柱ずつのブロックに分けて
+計算するので、全球の予報値でもブロック分の作業領域しか使わない。
+
+比湿は [kg/kg] 、気圧は [Pa] で与える(鉛直座標のlevはpunitで換算する)。飽和水蒸気圧、
+LCLの温度、相当温位は Bolton (1980) の式を用いる。
+
+.. autosummary::
+
+   satvap
+   vappres
+   mixratio
+   dewpoint
+   lcl
+   eptemp
+   parcel
+   cape
+
+-----------------------
+"""
+import numpy as np
+import constants
+import tools
+from grid import _useworkers
+
+__all__ = ['satvap', 'vappres', 'mixratio', 'dewpoint', 'lcl', 'eptemp', 'parcel', 'cape']
+
+eps = constants.air_eps
+rd = constants.air_rd
+t0 = 273.15
+p0 = 100000.
+
+#=== 要素ごとの計算 ================================================================================
+
+def satvap(temp):
+    ur"""
+    飽和水蒸気圧 [Pa] を計算する。
+
+    :Arguments:
+     **temp** : array_like
+       気温 [K]
+
+    :Returns:
+     **es** : ndarray
+
+    .. note::
+       Bolton (1980) の式
+
+       .. math:: e_{s} = 611.2\exp\left(\frac{17.67(T-273.15)}{T-29.65}\right)
+
+       を用いる。
+    """
+    temp = np.asarray(temp, dtype=np.float64)
+    return 611.2*np.exp(17.67*(temp - t0)/(temp - 29.65))
+
+def vappres(q, pres):
+    u"""
+    比湿と気圧から水蒸気圧 [Pa] を計算する。
+
+    :Arguments:
+     **q** : array_like
+       比湿 [kg/kg]
+     **pres** : array_like
+       気圧 [Pa]
+
+    :Returns:
+     **e** : ndarray
+    """
+    q = np.asarray(q, dtype=np.float64)
+    return q*pres/(eps + (1. - eps)*q)
+
+def mixratio(e, pres):
+    u"""
+    水蒸気圧と気圧から混合比 [kg/kg] を計算する。
+
+    :Arguments:
+     **e** : array_like
+       水蒸気圧 [Pa]
+     **pres** : array_like
+       気圧 [Pa]
+
+    :Returns:
+     **r** : ndarray
+    """
+    e = np.asarray(e, dtype=np.float64)
+    return eps*e/(pres - e)
+
+def dewpoint(e):
+    u"""
+    水蒸気圧から露点温度 [K] を計算する。 :py:func:`satvap` の逆関数。
+
+    :Arguments:
+     **e** : array_like
+       水蒸気圧 [Pa]
+
+    :Returns:
+     **td** : ndarray
+    """
+    x = np.log(np.asarray(e, dtype=np.float64)/611.2)
+    return t0 + 243.5*x/(17.67 - x)
+
+def lcl(temp, q, pres):
+    ur"""
+    気塊を乾燥断熱的に持ち上げたときの持ち上げ凝結高度(LCL)の温度と気圧を計算する。
+
+    :Arguments:
+     **temp** : array_like
+       気温 [K]
+     **q** : array_like
+       比湿 [kg/kg]
+     **pres** : array_like
+       気圧 [Pa]
+
+    :Returns:
+     **tlcl, plcl** : ndarray
+       LCLの温度 [K] と気圧 [Pa]
+
+    .. note::
+       LCLの温度は Bolton (1980) の式
+
+       .. math:: T_{L} = \frac{2840}{3.5\ln T - \ln e - 4.805} + 55
+
+       (eは水蒸気圧 [hPa])で求め、気圧は混合比rを保存する乾燥断熱変化
+       :math:`p_{L} = p(T_{L}/T)^{1/\kappa'}, \kappa' = 0.2854(1-0.28\times10^{-3}r)` から求める。
+
+    **Examples**
+     >>> tl, pl = lcl(t2m, q2m, ps)
+    """
+    temp = np.asarray(temp, dtype=np.float64)
+    r = _mixratio(q)
+    tl = _tlcl(temp, r, pres)
+    return tl, pres*(tl/temp)**(1./_kappa(r))
+
+def eptemp(temp, q, lev, zdim, punit=100.):
+    ur"""
+    相当温位を計算する。
+
+    :Arguments:
+     **temp** : array_like
+       気温 [K]
+     **q** : array_like
+       比湿 [kg/kg]
+     **lev** : array_like
+       気圧 [punit*Pa]
+     **zdim** : int
+       鉛直次元の軸
+     **punit** : float, optional
+       levをPaに換算するための定数。デフォルトは100.。
+
+    :Returns:
+     **out** : ndarray or MaskedArray
+       tempと同じ形状の配列。
+
+    .. note::
+       Bolton (1980) の式
+
+       .. math:: \theta_{e} = T\left(\frac{p_{0}}{p}\right)^{0.2854(1-0.28\times10^{-3}r)}
+                 \exp\left[\left(\frac{3.376}{T_{L}}-0.00254\right)r(1+0.81\times10^{-3}r)\right]
+
+       を用いる。rは混合比 [g/kg] 、 :math:`T_{L}` はLCLの温度( :py:func:`lcl` )。
+
+    **Examples**
+     >>> the = eptemp(t, q, lev, 1)
+    """
+    t, tmask = np.asarray(np.ma.getdata(temp), dtype=np.float64), np.ma.getmask(temp)
+    r = _mixratio(np.ma.getdata(q))
+    pres = tools.expand(np.asarray(lev, dtype=np.float64)*punit, t.ndim, axis=zdim)
+    out = np.exp(_lnthetae(t, r, pres, _tlcl(t, r, pres)))
+    mask = tmask | np.ma.getmask(q)
+    if mask is np.ma.nomask:
+        return out
+    return np.ma.array(out, mask=mask)
+
+#=== 内部の計算(混合比は [kg/kg]) =================================================================
+
+def _mixratio(q):
+    q = np.clip(np.asarray(q, dtype=np.float64), 1.e-10, None)
+    return q/(1. - q)
+
+def _kappa(r):
+    return 0.2854*(1. - 0.28*r)
+
+def _tlcl(temp, r, pres):
+    e = pres*r/(eps + r)
+    return 2840./(3.5*np.log(temp) - np.log(e/100.) - 4.805) + 55.
+
+def _lnthetae(temp, r, pres, tl):
+    u"""
+    相当温位の対数。
+    """
+    rg = 1000.*r
+    return np.log(temp) + _kappa(r)*np.log(p0/pres) + (3.376/tl - 0.00254)*rg*(1. + 0.81e-3*rg)
+
+def _satlnthetae(temp, pres):
+    u"""
+    飽和相当温位の対数と、その温度についての微分。
+    """
+    es = satvap(temp)
+    des = es*17.67*243.5/(temp - 29.65)**2
+    rg = 1000.*eps*es/(pres - es)
+    drg = 1000.*eps*pres*des/(pres - es)**2
+    a = 3.376/temp - 0.00254
+    b = rg*(1. + 0.81e-3*rg)
+    lnp = np.log(p0/pres)
+    f = np.log(temp) + 0.2854*(1. - 0.28e-3*rg)*lnp + a*b
+    df = 1./temp - 0.2854*0.28e-3*drg*lnp - 3.376/temp**2*b + a*(1. + 1.62e-3*rg)*drg
+    return f, df
+
+def _moisttemp(lnthe, pres, guess, tol=1.e-4, maxiter=50):
+    u"""
+    気圧presで飽和相当温位の対数がlntheとなる温度をNewton法で求める。
+
+    飽和相当温位は温度について単調増加かつ下に凸なので、解より高い初期値guessから始めれば
+    単調に収束する。
+    """
+    temp = guess.copy()
+    for i in range(maxiter):
+        f, df = _satlnthetae(temp, pres)
+        dt = (f - lnthe)/df
+        temp -= dt
+        if not np.any(np.abs(dt) > tol):
+            break
+    return temp
+
+def _virtual(temp, r):
+    return temp*(1. + r/eps)/(1. + r)
+
+#=== 気塊の持ち上げ ================================================================================
+
+def _startlevel(t, r, valid, pres, start, depth):
+    u"""
+    各鉛直柱で気塊を持ち上げ始める層の番号と、有効な層があるかどうかを返す。
+    t, r, validは(気圧の降順に並べた層, 鉛直柱)の2次元配列。
+    """
+    ok = valid.any(axis=0)
+    first = np.argmax(valid, axis=0)
+    if start == 'surface':
+        return first, ok
+    elif start == 'mostunstable':
+        p = pres[:, np.newaxis]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lnthe = _lnthetae(t, r, p, _tlcl(t, r, p))
+        lnthe[~(valid & (p >= pres[first] - depth))] = -np.inf
+        return np.argmax(lnthe, axis=0), ok
+    else:
+        raise ValueError, "start must be 'surface' or 'mostunstable', not '{0}'".format(start)
+
+def _ascent(t, r, valid, pres, start, depth):
+    u"""
+    気塊を持ち上げたときの温度と混合比、持ち上げ始める層、LCLの気圧を返す。
+    """
+    nz, n = t.shape
+    k0, ok = _startlevel(t, r, valid, pres, start, depth)
+    cols = np.arange(n)
+    tp, rp, pp = t[k0, cols], r[k0, cols], pres[k0]
+    tl = _tlcl(tp, rp, pp)
+    kp = _kappa(rp)
+    pl = pp*(tl/tp)**(1./kp)
+    lnthe = _lnthetae(tp, rp, pp, tl)
+
+    tpar = np.empty((nz, n))
+    rpar = np.empty((nz, n))
+    moist = tl.copy()
+    for k in range(nz):
+        above = pres[k] < pl
+        tpar[k] = tp*(pres[k]/pp)**kp
+        rpar[k] = rp
+        if above.any():
+            # 1つ下の層の解(LCLより下ではLCLの温度)を初期値とする
+            moist[above] = _moisttemp(lnthe[above], pres[k], moist[above])
+            tpar[k, above] = moist[above]
+            rpar[k, above] = mixratio(satvap(moist[above]), pres[k])
+    return tpar, rpar, k0, ok, pl
+
+def _parcelblock(t, r, valid, pres, start, depth):
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        tpar, rpar, k0, ok, pl = _ascent(t, r, valid, pres, start, depth)
+    use = (np.arange(len(pres))[:, np.newaxis] >= k0) & ok
+    return tpar, ~use
+
+def _capeblock(t, r, valid, pres, start, depth, virtual):
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        tpar, rpar, k0, ok, pl = _ascent(t, r, valid, pres, start, depth)
+        if virtual:
+            b = _virtual(tpar, rpar) - _virtual(t, r)
+        else:
+            b = tpar - t
+    k = np.arange(len(pres))[:, np.newaxis]
+    use = valid & (k >= k0)
+    b[~use] = 0.
+    # 自由対流高度(LFC): LCL以上で最初に浮力が正になる層
+    cand = use & (k > k0) & (pres[:, np.newaxis] <= pl) & (b > 0)
+    has = cand.any(axis=0) & ok
+    kf = np.argmax(cand, axis=0)
+
+    # 層ごとの正と負の面積。符号が変わる層は浮力が ln(p) について線形として0になる点で分ける
+    b1, b2 = b[:-1], b[1:]
+    s = np.abs(b1) + np.abs(b2)
+    s[s == 0] = 1.
+    cross = b1*b2 < 0
+    pos = np.where(cross, np.maximum(b1, b2)**2/(2.*s), 0.5*(b1 + b2).clip(0., None))
+    neg = np.where(cross, -np.minimum(b1, b2)**2/(2.*s), 0.5*(b1 + b2).clip(None, 0.))
+    dlnp = rd*np.log(pres[:-1]/pres[1:])[:, np.newaxis]
+    layer = use[:-1] & use[1:]
+    upper = k[1:]
+    cape = np.sum(np.where(layer & (upper >= kf), pos, 0.)*dlnp, axis=0)
+    cin = np.sum(np.where(layer & (upper <= kf), neg, 0.)*dlnp, axis=0)
+    cape[~has] = 0.
+    cin[~has] = 0.
+    return cape, cin, ~ok
+
+#=== 鉛直柱のブロックへの分割 ======================================================================
+
+def _columnapply(func, nout, temp, q, lev, zdim, punit, chunk, workers, profile):
+    u"""
+    鉛直柱をchunk本ずつのブロックに分け、気圧の降順に並べた (層, 鉛直柱) の2次元配列で
+    funcを呼ぶ。funcはnout個の結果の配列と欠損を表す配列を返す。profileがTrueの場合、結果は
+    入力と同じ形状、Falseの場合は鉛直次元を除いた形状になる。
+    """
+    t = np.asarray(np.ma.getdata(temp), dtype=np.float64)
+    ndim = t.ndim
+    zdim = zdim % ndim
+    shape = t.shape
+    nz = shape[zdim]
+    npre = int(np.prod(shape[:zdim]))
+    npost = int(np.prod(shape[zdim+1:]))
+    t = t.reshape(npre, nz, npost)
+    r = _mixratio(np.ma.getdata(q)).reshape(npre, nz, npost)
+    valid = ~(np.ma.getmaskarray(temp) | np.ma.getmaskarray(q)).reshape(npre, nz, npost)
+    valid &= np.isfinite(t) & np.isfinite(r)
+    pres = np.asarray(lev, dtype=np.float64)*punit
+    if len(pres) != nz:
+        raise ValueError, "length of lev must be equal to the length of vertical dimension"
+    order = np.argsort(-pres, kind='mergesort')
+    pres = pres[order]
+
+    chunk = max(int(chunk), 1)
+    nj = min(npost, chunk)
+    ni = max(1, chunk//npost) if npost <= chunk else 1
+    blocks = [(slice(i, i+ni), slice(j, j+nj)) for i in range(0, npre, ni) for j in range(0, npost, nj)]
+
+    def columns(a, si, sj):
+        block = a[si, :, sj][:, order]
+        return block.transpose(1, 0, 2).reshape(nz, -1)
+
+    def run(sl):
+        si, sj = sl
+        mi, mj = len(range(*si.indices(npre))), len(range(*sj.indices(npost)))
+        results = func(columns(t, si, sj), columns(r, si, sj), columns(valid, si, sj), pres)
+        for o, res in zip(outs, results):
+            if profile:
+                o[si, :, sj][:, order] = res.reshape(nz, mi, mj).transpose(1, 0, 2)
+            else:
+                o[si, sj] = res.reshape(mi, mj)
+
+    oshape = (npre, nz, npost) if profile else (npre, npost)
+    outs = [np.empty(oshape) for i in range(nout)] + [np.empty(oshape, dtype=bool)]
+    if _useworkers(workers):
+        tools.threadmap(run, blocks, workers)
+    else:
+        for sl in blocks:
+            run(sl)
+
+    rshape = shape if profile else shape[:zdim] + shape[zdim+1:]
+    mask = outs[-1].reshape(rshape)
+    return [np.ma.array(o.reshape(rshape), mask=mask) for o in outs[:-1]]
+
+def parcel(temp, q, lev, zdim, punit=100., start='surface', depth=30000., chunk=32768, workers=None):
+    ur"""
+    気塊を偽断熱的に持ち上げたときの各層の温度を計算する。
+
+    LCLまでは混合比を保存する乾燥断熱変化、LCLより上では飽和しながら相当温位を保存する
+    変化とし、凝結した水は取り除く(偽断熱)。
+
+    :Arguments:
+     **temp** : array_like
+       気温 [K]。MaskedArrayでもよく、地面より下などの欠損した層は用いない。
+     **q** : array_like
+       比湿 [kg/kg]
+     **lev** : array_like
+       気圧 [punit*Pa]。昇順、降順のどちらでもよい。
+     **zdim** : int
+       鉛直次元の軸
+     **punit** : float, optional
+       levをPaに換算するための定数。デフォルトは100.。
+     **start** : {'surface', 'mostunstable'}, optional
+       持ち上げ始める層。'surface'は最下層(欠損していない最も気圧の高い層)、'mostunstable'は
+       最下層からdepthまでの層のうち相当温位が最大の層。デフォルトは'surface'。
+     **depth** : float, optional
+       start='mostunstable'で持ち上げ始める層を探す厚さ [Pa]。デフォルトは300hPa。
+     **chunk** : int, optional
+       一度に計算する鉛直柱の数。デフォルトは32768。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **out** : MaskedArray
+       tempと同じ形状の配列。持ち上げ始める層より下はマスクされる。
+
+    **Examples**
+     >>> tp = parcel(t, q, lev, 1)
+    """
+    func = lambda t, r, valid, pres: _parcelblock(t, r, valid, pres, start, depth)
+    return _columnapply(func, 1, temp, q, lev, zdim, punit, chunk, workers, True)[0]
+
+def cape(temp, q, lev, zdim, punit=100., start='surface', depth=30000., virtual=True, chunk=32768, workers=None):
+    ur"""
+    対流有効位置エネルギー(CAPE)と対流抑制(CIN)を計算する。
+
+    :py:func:`parcel` と同じ方法で持ち上げた気塊の浮力を、気圧の対数について台形公式で
+    積分する。浮力の符号が変わる層では、浮力が0になる点で正と負の部分に分ける。
+
+    :Arguments:
+     **temp** : array_like
+       気温 [K]。MaskedArrayでもよく、地面より下などの欠損した層は用いない。
+     **q** : array_like
+       比湿 [kg/kg]
+     **lev** : array_like
+       気圧 [punit*Pa]。昇順、降順のどちらでもよい。
+     **zdim** : int
+       鉛直次元の軸
+     **punit** : float, optional
+       levをPaに換算するための定数。デフォルトは100.。
+     **start** : {'surface', 'mostunstable'}, optional
+       持ち上げ始める層。 :py:func:`parcel` を参照。
+     **depth** : float, optional
+       start='mostunstable'で持ち上げ始める層を探す厚さ [Pa]。デフォルトは300hPa。
+     **virtual** : bool, optional
+       浮力を仮温度で計算するかどうか。デフォルトはTrue。
+     **chunk** : int, optional
+       一度に計算する鉛直柱の数。デフォルトは32768。
+     **workers** : int, optional
+       並列計算に用いるスレッド数。デフォルトは :py:func:`pymet.tools.get_num_threads` の値。
+
+    :Returns:
+     **cape, cin** : MaskedArray
+       鉛直次元を除いた形状の配列 [J/kg] 。CINは0以下。有効な層がない鉛直柱はマスクされる。
+
+    .. note::
+       気塊と環境場の(仮)温度の差をBとして
+
+       .. math:: {\rm CAPE} = R_{d}\int_{p_{EL}}^{p_{LFC}} B^{+}\,d\ln p, \hspace{2em}
+                 {\rm CIN} = R_{d}\int_{p_{LFC}}^{p_{0}} B^{-}\,d\ln p
+
+       とする。自由対流高度(LFC)はLCL以上で最初に浮力が正になる層で、LFCより上の正の
+       部分はすべてCAPEに含める。LFCがない場合はCAPE、CINとも0とする。
+
+    **Examples**
+     >>> cape, cin = cape(t, q, lev, 1, start='mostunstable')
+    """
+    func = lambda t, r, valid, pres: _capeblock(t, r, valid, pres, start, depth, virtual)
+    return tuple(_columnapply(func, 2, temp, q, lev, zdim, punit, chunk, workers, False))
@@ -13,6 +13,15 @@ u"""
     deunshape
     expand
     mrollaxis
+    chunkslices
+
+-------------------
+並列計算
+-------------------
+.. autosummary::
+    set_num_threads
+    get_num_threads
+    threadmap
 
 -------------------
 文字列を扱うツール
@@ -32,10 +41,15 @@ u"""
 """
 import numpy as np
 import math
+import itertools
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
-__all__ = ['unshape', 'deunshape', 'expand', 'mrollaxis',
+__all__ = ['unshape', 'deunshape', 'expand', 'mrollaxis', 'chunkslices',
+           'set_num_threads', 'get_num_threads', 'threadmap',
            'lon2txt', 'lat2txt', 'd2s', 's2d',
            'roundoff']
 
@@ -167,6 +181,144 @@ def mrollaxis(a, axis, start=0):
         out.mask = mask
         return out
 
+def chunkslices(shape, axes, chunks=None, max_memory=None, itemsize=8, nbuffers=1):
+    u"""
+    配列をブロックに分けて処理するためのインデックスのリストを返す。
+
+    axesで指定した軸のみを分割し、その他の軸は常に全体を含む。chunksで各軸のブロックの長さを
+    直接指定するか、max_memoryで1ブロックあたりのメモリの上限を指定する。max_memoryの場合は
+    axesの先頭の軸から順にブロックを小さくする。
+
+    :Arguments:
+     **shape** : tuple
+      配列の形状
+     **axes** : sequence of int
+      分割してよい軸。外側の軸から順に並べる。
+     **chunks** : dict, optional
+      軸をキー、ブロックの長さを値とする辞書。
+     **max_memory** : int, optional
+      1ブロックあたりに使うメモリの上限 [byte]。すべての軸を長さ1にしても上限を超える場合は
+      長さ1のブロックを返す。
+     **itemsize** : int, optional
+      1要素あたりのバイト数。デフォルトは8(倍精度)。
+     **nbuffers** : int, optional
+      1ブロックの処理中に同時に確保される配列の数の目安。デフォルトは1。
+
+    :Returns:
+     **slices** : list of tuple
+      各ブロックを取り出すためのスライスのタプルのリスト。
+
+    **Examples**
+     >>> slices = chunkslices((10, 3, 73, 144), axes=[0, 1], chunks={0:4})
+     >>> len(slices)
+     3
+     >>> slices[-1]
+     (slice(8, 12, None), slice(None, None, None), slice(None, None, None), slice(None, None, None))
+     >>> for sl in slices:
+     ...     out[sl] = func(a[sl])
+    """
+    ndim = len(shape)
+    axes = [ax % ndim for ax in axes]
+    block = list(shape)
+    for axis, n in (chunks or {}).items():
+        if not axis % ndim in axes:
+            raise ValueError, "axis {0} cannot be chunked".format(axis)
+        block[axis % ndim] = max(1, min(int(n), shape[axis % ndim]))
+    if max_memory is not None:
+        for axis in axes:
+            nbytes = long(itemsize) * nbuffers * np.prod(block, dtype=np.int64)
+            if nbytes <= max_memory:
+                break
+            inner = nbytes // block[axis]
+            block[axis] = int(max(1, min(block[axis], max_memory // inner)))
+
+    starts = [range(0, shape[i], block[i]) if block[i] < shape[i] else [None] for i in range(ndim)]
+    slices = []
+    for idx in itertools.product(*starts):
+        slices.append(tuple(slice(None) if i0 is None else slice(i0, i0+block[i])
+                            for i, i0 in enumerate(idx)))
+    return slices
+
+_num_threads = 1
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+def set_num_threads(n=None):
+    u"""
+    pymetの関数が並列計算に用いるスレッド数の既定値を設定する。
+
+    workers引数を省略した関数はこの値を用いる。初期値は1(並列化しない)。
+
+    :Arguments:
+     **n** : int, optional
+      スレッド数。Noneの場合はCPUのコア数。
+
+    **Examples**
+     >>> import pymet
+     >>> pymet.set_num_threads(8)
+     >>> vor = pymet.grid.rot(u, v, lon, lat, 3, 2)             # 8スレッド
+     >>> vor = pymet.grid.rot(u, v, lon, lat, 3, 2, workers=1)  # このときだけ1スレッド
+    """
+    global _num_threads
+    if n is None:
+        n = multiprocessing.cpu_count()
+    n = int(n)
+    if n < 1:
+        raise ValueError, "number of threads must be positive, not {0}".format(n)
+    _num_threads = n
+
+def get_num_threads():
+    u"""
+    :py:func:`set_num_threads` で設定したスレッド数を返す。
+    """
+    return _num_threads
+
+def _getpool(workers):
+    u"""
+    スレッド数workersのスレッドプールを返す。一度作ったプールは再利用する。
+    """
+    with _pools_lock:
+        if not workers in _pools:
+            _pools[workers] = ThreadPool(workers)
+        return _pools[workers]
+
+def _inthread():
+    u"""
+    threadmapのワーカースレッドの中で呼ばれているかどうかを返す。
+    """
+    return getattr(_local, 'inthread', False)
+
+def threadmap(func, iterable, workers=None):
+    u"""
+    funcをiterableの各要素にスレッドプールで並列に適用し、結果のリストを返す。
+
+    NumPyの多くの演算はGILを解放するので、独立な部分配列に対する計算はスレッドで並列化できる。
+
+    :Arguments:
+     **func** : callable
+      1引数の関数
+     **iterable** : iterable
+      funcに渡す値
+     **workers** : int, optional
+      スレッド数。デフォルトは :py:func:`get_num_threads` の値。1以下の場合は並列化しない。
+      ワーカースレッドの中から呼んだ場合も並列化せずに順に計算する。
+
+    :Returns:
+     **results** : list
+      iterableの順序に並んだfuncの返り値のリスト。
+    """
+    workers = _num_threads if workers is None else workers
+    items = list(iterable)
+    if workers <= 1 or len(items) <= 1 or _inthread():
+        return map(func, items)
+    def run(item):
+        _local.inthread = True
+        try:
+            return func(item)
+        finally:
+            _local.inthread = False
+    return _getpool(workers).map(run, items)
     
 __months__ = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']    
 def d2s(d, fmt='%HZ%d%b%Y'):
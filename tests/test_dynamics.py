@@ -0,0 +1,61 @@
+# coding: utf-8
+u"""
+pymet.dynamics のテスト。
+
+ $ python -m unittest discover tests
+"""
+import unittest
+import numpy as np
+import pymet.dynamics as dynamics
+
+class TestEPFlux(unittest.TestCase):
+    def test_pole(self):
+        rs = np.random.RandomState(0)
+        lat = np.linspace(-90., 90., 37)
+        lev = np.array([1000., 850., 700., 500., 300., 200., 100.])
+        shape = (4, len(lev), len(lat), 36)
+        u = 10. + rs.randn(*shape)
+        v = rs.randn(*shape)
+        t = 250. + 5.*rs.randn(*shape) + np.linspace(40., 0., len(lev))[:,np.newaxis,np.newaxis]
+        omega = 0.1*rs.randn(*shape)
+        for result in dynamics.epflux(u, v, t, omega, lat, lev, 3, 2, 1):
+            mask = np.ma.getmaskarray(result)
+            self.assertTrue(mask[:,:,[0,-1]].all())
+            self.assertFalse(mask[:,:,1:-1].any())
+
+class TestIsentropic(unittest.TestCase):
+    def test_topography(self):
+        lev = np.array([1000., 925., 850., 700., 500., 300., 200., 100.])
+        column = np.array([290., 286., 282., 275., 260., 235., 220., 215.])
+        temp = np.ma.array(np.tile(column, (2, 1)).T, mask=False)
+        temp[:2,1] = np.ma.masked
+        temp.data[:2,1] = 1.e20
+        result = dynamics.isentropic(temp, lev, 0, [295., 300., 310., 330.])
+        pres = result['pres']
+        self.assertTrue(np.ma.getmaskarray(pres)[0,1])
+        self.assertFalse(np.ma.getmaskarray(pres)[1:].any())
+        np.testing.assert_allclose(pres[1:,1], pres[1:,0])
+        np.testing.assert_allclose(result['temp'][1:,1], result['temp'][1:,0])
+        self.assertTrue((pres[1:,0] < 850.).all())
+
+class TestTNFlux(unittest.TestCase):
+    def test_session(self):
+        rs = np.random.RandomState(0)
+        lon = np.arange(0., 360., 10.)
+        lat = np.linspace(-80., 80., 17)
+        lev = np.array([1000., 850., 500., 300., 200.])
+        shape = (3, len(lev), len(lat), len(lon))
+        U = 10. + 5.*rs.randn(1, *shape[1:])
+        V = rs.randn(1, *shape[1:])
+        T = (300. - np.linspace(0., 80., len(lev)))[:,np.newaxis,np.newaxis] + rs.randn(1, *shape[1:])
+        strm = 1.e6*rs.randn(*shape)
+        tn = dynamics.TNFlux3D(U, V, T, lon, lat, lev, 3, 2, 1)(strm)
+        session = dynamics.DiagnosticsSession(np.broadcast_to(U, shape), np.broadcast_to(V, shape),
+                                              np.broadcast_to(T, shape), lon, lat, lev, 3, 2, 1, strm=strm)
+        result = session.compute('tnx', 'tny', 'tnz')
+        for a, name in zip(tn, ('tnx', 'tny', 'tnz')):
+            np.testing.assert_array_equal(np.ma.getmaskarray(a), np.ma.getmaskarray(result[name]))
+            np.testing.assert_allclose(a.compressed(), result[name].compressed(), rtol=1.e-12)
+
+if __name__ == '__main__':
+    unittest.main()
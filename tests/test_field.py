@@ -0,0 +1,53 @@
+# coding: utf-8
+u"""
+pymet.field.core のテスト。
+
+ $ python -m unittest discover tests
+"""
+import unittest
+import datetime
+import numpy as np
+import pymet.field as field
+from pymet.field.core import McField, McGrid
+
+def curvilinearfield():
+    lon, lat = np.meshgrid(np.linspace(100., 160., 40), np.linspace(10., 50., 30))
+    lon = lon + 0.1*lat
+    grid = McGrid('test', lon=lon, lat=lat, lev=[1000., 850., 500.], time=range(10))
+    data = np.random.RandomState(0).rand(10, 3, 30, 40)
+    return McField(data, name='z', grid=grid), lon, lat
+
+class TestCurvilinearSlice(unittest.TestCase):
+    def test_getitem(self):
+        f, lon, lat = curvilinearfield()
+        s = f[:, :, 5:10, 2:9]
+        self.assertEqual(s.shape, (10, 3, 5, 7))
+        np.testing.assert_array_equal(s.grid.lon, lon[5:10, 2:9])
+        np.testing.assert_array_equal(s.grid.lat, lat[5:10, 2:9])
+
+    def test_dvardx(self):
+        f, lon, lat = curvilinearfield()
+        s = f[:, :, 5:10, 5:10]
+        self.assertEqual(field.dvardx(s, cyclic=False).shape, s.shape)
+
+class TestChunkslices(unittest.TestCase):
+    def test_curvilinear(self):
+        f, lon, lat = curvilinearfield()
+        slices = f.grid.chunkslices(max_memory=4*f.nbytes, nbuffers=4)
+        self.assertEqual(len(slices), 1)
+
+class TestTimefilter(unittest.TestCase):
+    def test_butterworth_masked(self):
+        time = [datetime.datetime(2000, 1, 1) + datetime.timedelta(days=i) for i in range(120)]
+        grid = McGrid('test', lon=np.arange(4.), lat=np.arange(3.), time=time)
+        data = np.ma.array(np.random.RandomState(0).rand(120, 3, 4), mask=False)
+        data[30,1,1] = np.ma.masked
+        data.data[30,1,1] = 1.e20
+        result = McField(data, name='x', grid=grid).timefilter(10, method='butterworth')
+        mask = np.ma.getmaskarray(result)
+        self.assertTrue(mask[:,1,1].all())
+        self.assertEqual(mask.sum(), 120)
+        self.assertLess(np.abs(result).max(), 1.)
+
+if __name__ == '__main__':
+    unittest.main()
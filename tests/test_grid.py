@@ -0,0 +1,47 @@
+# coding: utf-8
+u"""
+pymet.grid のテスト。
+
+ $ python -m unittest discover tests
+"""
+import unittest
+import numpy as np
+import pymet.grid as grid
+
+class TestVint(unittest.TestCase):
+    def test_ps_above_top(self):
+        lev = np.array([1000., 850., 700., 500., 300.])
+        var = np.ones((2, len(lev), 3))
+        ps = np.array([[1000., 400., 250.]])
+        vi = grid.vint(var, 1000., 300., lev, 1, ps=ps)
+        vm = grid.vmean(var, 1000., 300., lev, 1, ps=ps)
+        np.testing.assert_array_equal(np.ma.getmaskarray(vi), np.ma.getmaskarray(vm))
+        self.assertTrue(np.ma.getmaskarray(vi)[:,2].all())
+        self.assertFalse(np.ma.getmaskarray(vi)[:,:2].any())
+        np.testing.assert_allclose(vi[:,0], 700.*100./grid.g)
+
+class TestColumnInterpolator(unittest.TestCase):
+    def setUp(self):
+        # 高さとともに減少する気圧座標。2番目の柱は下の2レベルが地面の下。
+        self.lev = np.array([1000., 925., 850., 700., 500., 300.])
+        z = np.tile(self.lev, (3, 1)).T
+        self.z = np.ma.array(z, mask=np.zeros(z.shape, dtype=bool))
+        self.z[:2,1] = np.ma.masked
+        self.z.data[:2,1] = 1.e20
+        self.var = np.tile(np.arange(6.), (3, 1)).T
+
+    def test_masked_below_ground(self):
+        interp = grid.ColumnInterpolator(self.z, [950., 800., 600.], 0, logintrp=False)
+        out = interp(self.var)
+        mask = np.ma.getmaskarray(out)
+        self.assertTrue(mask[0,1])
+        self.assertEqual(mask.sum(), 1)
+        np.testing.assert_allclose(out.data[:,0], [2./3., 7./3., 3.5])
+        np.testing.assert_allclose(out.data[1:,1], [7./3., 3.5])
+
+    def test_all_valid(self):
+        interp = grid.ColumnInterpolator(np.tile(self.lev, (3, 1)).T, [950., 800., 600.], 0, logintrp=False)
+        np.testing.assert_allclose(interp(self.var), np.tile([2./3., 7./3., 3.5], (3, 1)).T)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+# coding: utf-8
+u"""
+pymet.stats のテスト。
+
+ $ python -m unittest discover tests
+"""
+import unittest
+import numpy as np
+import pymet.stats as stats
+
+class TestButterworth(unittest.TestCase):
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.data = rs.randn(200, 3, 4).astype(np.float32)
+
+    def test_unmasked(self):
+        out = stats.butterworth(self.data, 10.)
+        self.assertEqual(out.dtype, np.float32)
+        self.assertLess(np.abs(out).max(), np.abs(self.data).max())
+
+    def test_masked(self):
+        data = np.ma.array(self.data.copy(), mask=False)
+        data[50,1,2] = np.ma.masked
+        data.data[50,1,2] = 1.e20
+        out = stats.butterworth(data, 10.)
+        mask = np.ma.getmaskarray(out)
+        self.assertTrue(mask[:,1,2].all())
+        self.assertEqual(mask.sum(), 200)
+        # 他の時系列は欠損値の影響を受けない
+        np.testing.assert_array_equal(out.data[:,0], stats.butterworth(self.data, 10.)[:,0])
+
+if __name__ == '__main__':
+    unittest.main()
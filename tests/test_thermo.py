@@ -0,0 +1,35 @@
+# coding: utf-8
+u"""
+pymet.thermo のテスト。
+
+ $ python -m unittest discover tests
+"""
+import unittest
+import numpy as np
+import pymet.thermo as thermo
+
+class TestMostUnstable(unittest.TestCase):
+    def setUp(self):
+        # 地上付近は冷たく乾いた安定層で、850hPaに暖かく湿った層がある
+        self.lev = np.array([1000., 925., 850., 700., 500., 400., 300., 250., 200., 150., 100.])
+        self.temp = np.array([285., 290., 293., 283., 265., 252., 237., 227., 218., 215., 213.])
+        self.q = np.array([3.e-3, 4.e-3, 1.6e-2, 6.e-3, 2.e-3, 1.e-3, 3.e-4, 1.e-4, 5.e-5, 2.e-5, 1.e-5])
+
+    def test_parcel(self):
+        tp = thermo.parcel(self.temp, self.q, self.lev, 0, start='mostunstable')
+        mask = np.ma.getmaskarray(tp)
+        self.assertTrue(mask[:2].all())
+        self.assertFalse(mask[2:].any())
+        self.assertEqual(tp[2], self.temp[2])
+
+    def test_cape(self):
+        capes, cins = thermo.cape(self.temp, self.q, self.lev, 0)
+        capemu, cinmu = thermo.cape(self.temp, self.q, self.lev, 0, start='mostunstable')
+        self.assertEqual(capes, 0.)
+        self.assertGreater(capemu, 1000.)
+        # 探す厚さが最下層の1層分しかなければ、地上から持ち上げるのと同じ
+        capethin, cinthin = thermo.cape(self.temp, self.q, self.lev, 0, start='mostunstable', depth=5000.)
+        self.assertEqual(capethin, capes)
+
+if __name__ == '__main__':
+    unittest.main()